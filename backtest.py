@@ -0,0 +1,432 @@
+"""
+Перевірка налаштувань фільтрів на великих експортах каналів.
+
+Повідомлення читаються потоково (експорт не завантажується в пам'ять
+цілком) і проходять ту саму обробку, що й у bot.py: ключові слова,
+стоп-слова, not_a_reason, обробку тексту, стан тривоги,
+is_read_only_when_alarm і пошук дублікатів. Ключові слова, стоп-слова і
+обробка тексту діляться між процесами за каналами. Стан тривоги,
+is_read_only_when_alarm і дублікати між каналами залежать від порядку
+всіх повідомлень, тож батьківський процес проганяє їх одним потоком за
+часом публікації, і результат не залежить від --workers. Для цього
+кандидати (повідомлення з ключовими словами після стоп-слів) тримаються
+в пам'яті до кінця читання.
+
+Підтримувані формати:
+    - jsonl, рядок - {"chat_id": int, "id": int, "date": iso, "raw_text" або "text": str};
+    - json експорт Telegram Desktop ({"id": ..., "messages": [...]}), id каналу
+      береться з --channel-id або з поля "id" експорту (з префіксом -100).
+
+Відмінності від бота: на початку експорту тривоги немає, враховується лише
+область settings["region"], цитати і додаткові пости (причини тривоги) не
+відтворюються, а повідомлення без ключових слів з каналів
+is_read_only_when_alarm рахуються як no_keyword незалежно від тривоги.
+
+Приклади:
+    python backtest.py export.jsonl
+    python backtest.py result.json --channel-id -1001806611187 --output forwarded.jsonl --workers 8
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import re
+from collections import Counter
+from datetime import datetime
+from os import cpu_count, path
+
+from dedup import DedupIndex
+from matcher import KEYWORD, NOT_A_REASON, REGION, STOP_WORD, build_matcher
+from pipeline import compile_pipelines
+from translator import TranslationEngine
+
+
+BATCH_SIZE = 500
+QUEUE_BATCHES = 8  # Скільки пакетів може чекати в черзі одного процесу
+CHUNK_SIZE = 1 << 20
+HEADER_ID_RE = re.compile(r'"id"\s*:\s*(-?\d+)')
+SEPARATOR_RE = re.compile(r"[\s,]*")
+
+
+def message_text(value) -> str:
+    """
+    Текст повідомлення експорту: рядок або список рядків і сутностей {"text": ...}.
+
+    Args:
+        value (str | list): Поле text з експорту.
+
+    Returns:
+        str: Текст.
+    """
+    if isinstance(value, str):
+        return value
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in value or ())
+
+
+def iter_json_array(f, key: str):
+    """
+    Потоково читає об'єкти масиву key з великого json-файлу.
+
+    Args:
+        f (file): Текстовий файл.
+        key (str): Назва поля з масивом.
+
+    Returns:
+        generator: Пари (поля до масиву, об'єкт масиву); поля - словник з id експорту, якщо він є.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(CHUNK_SIZE)
+    marker = f'"{key}"'
+    # Дочитуємо, доки в буфері не буде і назви масиву, і його початку
+    while True:
+        position = buffer.find(marker)
+        start = buffer.find("[", position) if position >= 0 else -1
+        if start >= 0:
+            break
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+
+    # Прості поля експорту (id каналу) стоять перед масивом повідомлень
+    header = {}
+    match = HEADER_ID_RE.search(buffer, 0, position)
+    if match:
+        header["id"] = int(match.group(1))
+
+    # Буфер читається за індексом і обрізається лише при дочитуванні, а не після кожного об'єкта
+    index = start + 1
+    while True:
+        index = SEPARATOR_RE.match(buffer, index).end()
+        if index < len(buffer):
+            if buffer[index] == "]":
+                return
+            try:
+                item, index = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                pass  # Об'єкт обірвався на кінці буфера - дочитуємо
+            else:
+                yield header, item
+                continue
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer = buffer[index:] + chunk
+        index = 0
+
+
+def iter_messages(export_path: str, channel_id=None):
+    """
+    Потоково читає повідомлення експорту.
+
+    Args:
+        export_path (str): Шлях до json або jsonl файлу.
+        channel_id (int): Id каналу для json експорту (типово - з експорту).
+
+    Returns:
+        generator: Кортежі (id каналу, id повідомлення, час, текст).
+    """
+    with open(export_path, "r", encoding="utf-8") as f:
+        if export_path.endswith(".jsonl"):
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                text = record.get("raw_text", record.get("text"))
+                yield record["chat_id"], record.get("id"), record.get("date"), message_text(text)
+            return
+
+        for header, record in iter_json_array(f, "messages"):
+            if record.get("type", "message") != "message":
+                continue
+            chat_id = channel_id if channel_id is not None else int(f"-100{header.get('id')}")
+            yield chat_id, record.get("id"), record.get("date"), message_text(record.get("text"))
+
+
+def load_config(config_dir: str) -> tuple:
+    """
+    Args:
+        config_dir (str): Тека з channels.json, settings.json і translate.json.
+
+    Returns:
+        tuple: (налаштування, конвеєри каналів, матчер).
+    """
+    with open(path.join(config_dir, "channels.json"), "r", encoding="utf-8") as f:
+        channels = {int(k): v for k, v in json.load(f).items()}
+    with open(path.join(config_dir, "settings.json"), "r", encoding="utf-8") as f:
+        settings = json.load(f)
+    translator = TranslationEngine.from_json(path.join(config_dir, "translate.json"))
+
+    pipelines = compile_pipelines(channels, translator, settings["continue_symbols"], settings["max_message_rows"])
+    matcher = build_matcher(pipelines, settings["not_a_reason"], settings["region"])
+    return settings, pipelines, matcher
+
+
+class Samples:
+    """Рівномірні вибірки текстів (reservoir sampling): пам'ять не залежить від розміру експорту."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.reservoirs = {}  # (вид вибірки, id каналу, правило) -> [переглянуто, [тексти], генератор]
+
+    def add(self, kind: str, channel_id, rule: str, text: str) -> None:
+        key = (kind, channel_id, rule)
+        reservoir = self.reservoirs.get(key)
+        if reservoir is None:
+            # Свій генератор для кожної вибірки, щоб вона не залежала від того, які канали ще в процесі
+            reservoir = self.reservoirs[key] = [0, [], random.Random(repr(key))]
+        reservoir[0] += 1
+        if len(reservoir[1]) < self.size:
+            reservoir[1].append(text)
+        else:
+            index = reservoir[2].randrange(reservoir[0])
+            if index < self.size:
+                reservoir[1][index] = text
+
+    def texts(self) -> dict:
+        return {key: texts for key, (_, texts, _) in self.reservoirs.items()}
+
+
+class Shard:
+    """
+    Паралельна частина обробки: ключові слова, стоп-слова і обробка тексту
+    повідомлень каналів одного процесу. Усе, що залежить від попередніх
+    повідомлень інших каналів, робить Timeline.
+    """
+
+    def __init__(self, config_dir: str, samples: int):
+        _, self.pipelines, self.matcher = load_config(config_dir)
+        self.samples = Samples(samples)
+        self.counts = Counter()  # (подія, id каналу) -> кількість
+        self.hits = Counter()  # (вид списку, id каналу або None, шаблон) -> кількість
+
+    def process(self, index: int, chat_id, message_id, date, text: str):
+        """
+        Проганяє одне повідомлення через фільтри, що не залежать від стану бота.
+
+        Returns:
+            tuple | None: Кандидат (час, номер в експорті, id каналу, id повідомлення,
+                час з експорту, ключове слово, опрацьований текст, текст) або None.
+        """
+        pipeline = self.pipelines.get(chat_id)
+        if pipeline is None:
+            self.counts["unknown_channel", chat_id] += 1
+            return None
+        self.counts["messages", chat_id] += 1
+        if not text:
+            return None
+
+        matches = self.matcher.scan(text.lower())
+        for kind, owner, _, pattern in matches.tags:
+            if owner in (None, chat_id):
+                self.hits[kind, owner, pattern] += 1
+
+        keyword = matches.first(KEYWORD, chat_id)
+        if keyword is None:
+            self.counts["no_keyword", chat_id] += 1
+            return None
+
+        if pipeline.is_filter_stop_words and (len(text) > pipeline.stop_length or matches.has(STOP_WORD, chat_id)):
+            stop_word = matches.first(STOP_WORD, chat_id) or f"довжина > {pipeline.stop_length}"
+            self.counts["stop_filtered", chat_id] += 1
+            self.samples.add("stop_filtered", chat_id, stop_word, text)
+            return None
+
+        processed = f"{pipeline.process(text)}\n<i>({pipeline.url})</i>"
+        # Повідомлення без дати стають на початок, щоб порядок не залежав від часу запуску
+        time = datetime.fromisoformat(date).replace(tzinfo=None) if date else datetime.min
+        return time, index, chat_id, message_id, date, keyword, processed, text
+
+
+class Timeline:
+    """
+    Впорядкований прохід по кандидатах усіх процесів у батьківському процесі.
+
+    Стан тривоги, is_read_only_when_alarm і пошук дублікатів залежать від
+    попередніх повідомлень усіх каналів, тож вони проганяються тут одним
+    потоком за часом публікації (за однакового часу - в порядку експорту),
+    і результат не залежить від --workers.
+    """
+
+    def __init__(self, config_dir: str, samples: int):
+        settings, self.pipelines, matcher = load_config(config_dir)
+        self.dedup = DedupIndex(
+            settings["dedup_ttl"],
+            matcher,
+            settings["dedup_locality_threshold"],
+            settings["dedup_text_threshold"],
+        )
+        self.alarm_start_keyword = settings["alarm_start_keyword"]
+        self.alarm_end_keyword = settings["alarm_end_keyword"]
+        self.is_alarm = False  # Як у бота без збереженого стану: на початку експорту тривоги немає
+        self.samples = Samples(samples)
+        self.counts = Counter()
+
+    def process(self, candidate: tuple):
+        """
+        Застосовує до кандидата правила, що залежать від стану, як handler бота.
+
+        Args:
+            candidate (tuple): Результат Shard.process.
+
+        Returns:
+            dict | None: Повідомлення, яке бот надіслав би, або None.
+        """
+        time, _, chat_id, message_id, date, keyword, processed, text = candidate
+        pipeline = self.pipelines[chat_id]
+        if pipeline.is_read_only_when_alarm and not self.is_alarm:
+            self.counts["read_only_skipped", chat_id] += 1
+            return None
+
+        if pipeline.is_alarm_source:
+            if keyword == self.alarm_start_keyword:
+                self.is_alarm = True
+            elif keyword == self.alarm_end_keyword:
+                self.is_alarm = False
+
+        features = self.dedup.describe(processed)
+        if self.dedup.find(features, time) is not None:
+            self.counts["duplicate", chat_id] += 1
+            return None
+        if not pipeline.is_alarm_source:
+            self.dedup.add(processed, features, time)
+
+        self.counts["forwarded", chat_id] += 1
+        self.samples.add("forwarded", chat_id, keyword, text)
+        return {"chat_id": chat_id, "id": message_id, "date": date, "keyword": keyword, "text": processed}
+
+
+def worker(config_dir: str, samples: int, inbox, outbox) -> None:
+    shard = Shard(config_dir, samples)
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        candidates = [result for result in (shard.process(*message) for message in batch) if result]
+        if candidates:
+            outbox.put(("candidates", candidates))
+    outbox.put(("done", (shard.counts, shard.hits, shard.samples.texts())))
+
+
+def run(export_path: str, config_dir: str, workers: int, channel_id, output_path: str, samples: int) -> tuple:
+    """
+    Розподіляє повідомлення між процесами, а потім проганяє їхніх кандидатів
+    через Timeline за часом.
+
+    Returns:
+        tuple: Лічильники подій, лічильники правил, вибірки текстів.
+    """
+    outbox = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue(QUEUE_BATCHES) for _ in range(workers)]
+    processes = [
+        multiprocessing.Process(target=worker, args=(config_dir, samples, inbox, outbox), daemon=True)
+        for inbox in inboxes
+    ]
+    for process in processes:
+        process.start()
+
+    counts, hits, reservoirs = Counter(), Counter(), {}
+    candidates = []  # Лише повідомлення з ключовими словами після стоп-слів
+    finished = 0
+
+    def drain(block: bool) -> None:
+        nonlocal finished
+        while not outbox.empty() or (block and finished < workers):
+            kind, payload = outbox.get()
+            if kind == "candidates":
+                candidates.extend(payload)
+            else:
+                finished += 1
+                shard_counts, shard_hits, shard_reservoirs = payload
+                counts.update(shard_counts)
+                hits.update(shard_hits)
+                reservoirs.update(shard_reservoirs)  # Канали не перетинаються між процесами
+
+    batches = [[] for _ in range(workers)]
+    for index, message in enumerate(iter_messages(export_path, channel_id)):
+        shard = hash(message[0]) % workers  # Один канал - завжди один процес
+        batches[shard].append((index, *message))
+        if len(batches[shard]) >= BATCH_SIZE:
+            inboxes[shard].put(batches[shard])
+            batches[shard] = []
+            drain(block=False)
+
+    for inbox, batch in zip(inboxes, batches):
+        if batch:
+            inbox.put(batch)
+        inbox.put(None)
+    drain(block=True)
+    for process in processes:
+        process.join()
+
+    # Номер в експорті унікальний, тож кортежі порівнюються лише за часом і номером
+    candidates.sort()
+    timeline = Timeline(config_dir, samples)
+    output = open(output_path, "w", encoding="utf-8") if output_path else None
+    for candidate in candidates:
+        forwarded = timeline.process(candidate)
+        if forwarded and output:
+            output.write(json.dumps(forwarded, ensure_ascii=False) + "\n")
+    if output:
+        output.close()
+    counts.update(timeline.counts)
+    reservoirs.update(timeline.samples.texts())
+    return counts, hits, reservoirs
+
+
+def report(counts: Counter, hits: Counter, reservoirs: dict, top: int) -> None:
+    totals = Counter()
+    for (event, _), count in counts.items():
+        totals[event] += count
+    print("Підсумок: " + ", ".join(f"{event} {count}" for event, count in totals.most_common()))
+
+    per_channel = {}
+    for (event, channel_id), count in counts.items():
+        per_channel.setdefault(channel_id, Counter())[event] = count
+    for channel_id, channel_counts in sorted(per_channel.items(), key=lambda item: str(item[0])):
+        print(f"  {channel_id}: " + ", ".join(f"{event} {count}" for event, count in channel_counts.most_common()))
+
+    for kind in (KEYWORD, STOP_WORD, NOT_A_REASON, REGION):
+        rule_hits = [(key, count) for key, count in hits.items() if key[0] == kind]
+        if not rule_hits:
+            continue
+        print(f"\nСпрацювання {kind} (топ {top}):")
+        for (_, owner, pattern), count in sorted(rule_hits, key=lambda item: -item[1])[:top]:
+            print(f"  {count:>8}  {pattern!r}" + (f" [{owner}]" if owner is not None else ""))
+
+    for sample_kind, title in (("forwarded", "Надіслано б (перевірте хибні спрацювання)"), ("stop_filtered", "Відфільтровано стоп-словами")):
+        groups = [(key, texts) for key, texts in reservoirs.items() if key[0] == sample_kind]
+        if not groups:
+            continue
+        print(f"\n{title}:")
+        for (_, channel_id, rule), texts in sorted(groups, key=lambda item: (str(item[0][1]), item[0][2])):
+            print(f"  [{channel_id}] {rule!r}:")
+            for text in texts:
+                print("    > " + text.replace("\n", " ")[:200])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перевірка фільтрів бота на експорті каналів.")
+    parser.add_argument("export", help="json експорт Telegram Desktop або jsonl")
+    parser.add_argument("--config-dir", default=path.dirname(path.abspath(__file__)), help="тека з channels/settings/translate.json")
+    parser.add_argument("--channel-id", type=int, default=None, help="id каналу для json експорту")
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1, help="кількість процесів")
+    parser.add_argument("--output", default="", help="записати повідомлення, які бот надіслав би, у jsonl")
+    parser.add_argument("--samples", type=int, default=5, help="прикладів текстів на правило")
+    parser.add_argument("--top", type=int, default=20, help="скільки найчастіших правил показувати")
+    args = parser.parse_args()
+
+    counts, hits, reservoirs = run(
+        path.abspath(args.export),
+        path.abspath(args.config_dir),
+        max(1, args.workers),
+        args.channel_id,
+        path.abspath(args.output) if args.output else "",
+        args.samples,
+    )
+    report(counts, hits, reservoirs, args.top)
+
+
+if __name__ == "__main__":
+    main()
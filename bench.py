@@ -0,0 +1,290 @@
+"""
+Мікробенчмарки функцій обробки тексту з порогом регресії.
+
+Кожна функція проганяється на згенерованих (відтворюваних) корпусах кількох
+розмірів: довжина повідомлення, розмір словника перекладу, кількість
+населених пунктів, кількість записів у вікні дублікатів і сховищі причин.
+Для кожного випадку вимірюється час одного виклику (нс) і пік пам'яті,
+виділеної за виклик (tracemalloc).
+
+Результати порівнюються з bench_baseline.json; якщо час або пам'ять
+випадку гірші за базові більше ніж на --threshold відсотків і після
+перевимірювань (--confirm), код виходу 1.
+
+    python bench.py                      # порівняти з базою
+    python bench.py --filter make_set    # лише випадки, що містять підрядок
+    python bench.py --update             # записати поточні результати як базу
+
+База залежить від машини: разом з нею записується середовище (версія
+Python, архітектура, ОС). Якщо поточне середовище інше, регресії лише
+виводяться як попередження, а код виходу 0 - інакше інша версія Python
+видавалася б за регресію коду. Щоб порівнювати у своєму середовищі,
+запишіть локальну базу на коміті без змін і вже потім міряйте зміну:
+
+    git stash                            # або git checkout <базовий коміт>
+    python bench.py --update
+    git stash pop
+    python bench.py
+
+Локальну базу не комітять, якщо вона не знята в середовищі, записаному
+в bench_baseline.json.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from os import path
+
+from dedup import DedupIndex
+from matcher import MultiMatcher, REGION, make_set
+from pipeline import MultiReplacer, correct_punctuation, replace_text, trunc_message
+from reasons import ReasonStore, format_other_reasons
+from translator import TranslationEngine, translate_text
+
+
+BASELINE_JSON = path.join(path.dirname(path.abspath(__file__)), "bench_baseline.json")
+
+MESSAGE_LENGTHS = (100, 1000, 10000)
+DICT_SIZES = (100, 1000, 10000)
+REGION_SIZES = (50, 500, 5000)
+WINDOW_SIZES = (10, 100, 1000)
+
+CONTINUE_SYMBOLS = frozenset(["д", "◦", "-", "Б", "1", "2", "3", "Г", "~"])
+MAX_MESSAGE_ROWS = 3
+MESSAGE_TTL = 600
+ALLOCATION_SLACK = 1024  # Байтів: дрібні зміни піку пам'яті не вважаються регресією
+
+ALPHABET = "абвгдеєжзиіїйклмнопрстуфхцчшщьюя"
+RU_ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+NOISE = ("🚨", "🟢", "‼️", "❗", ",", ".", " ,", " !", "?", "...", ";")
+
+
+class Corpus:
+    """Відтворювані тексти, словники і списки населених пунктів для бенчмарків."""
+
+    def __init__(self, seed=1):
+        self.random = random.Random(seed)
+
+    def word(self, alphabet=ALPHABET, low=3, high=10) -> str:
+        return "".join(self.random.choice(alphabet) for _ in range(self.random.randint(low, high)))
+
+    def regions(self, size: int) -> list:
+        # Основи назв, як у settings.json: "кременчук" знаходиться за "кременч"
+        return sorted({self.word(low=4, high=8) for _ in range(size * 2)})[:size]
+
+    def dictionary(self, size: int) -> dict:
+        mapping = {}
+        while len(mapping) < size:
+            key = self.word(RU_ALPHABET)
+            if self.random.random() < 0.2:
+                key = f"{key} {self.word(RU_ALPHABET)}"  # Фрази з кількох слів, як "не много"
+            mapping[key] = self.word()
+        return mapping
+
+    def message(self, length: int, vocabulary=(), trunc_word="") -> str:
+        """
+        Повідомлення на кшталт постів каналів: рядки по 40-80 символів, частина
+        рядків починається з символів продовження, зайві пробіли перед
+        розділовими знаками, емодзі і слова зі словника.
+        """
+        lines, size = [], 0
+        while size < length:
+            words = []
+            for _ in range(self.random.randint(5, 10)):
+                if vocabulary and self.random.random() < 0.3:
+                    words.append(self.random.choice(vocabulary))
+                else:
+                    words.append(self.word())
+                if self.random.random() < 0.15:
+                    words.append(self.random.choice(NOISE))
+            line = " ".join(words)
+            if lines and self.random.random() < 0.3:
+                line = f"{self.random.choice(sorted(CONTINUE_SYMBOLS))} {line}"
+            lines.append(line)
+            size += len(line) + 1
+        if trunc_word:
+            lines[len(lines) // 2] = f"{trunc_word}щина: {lines[len(lines) // 2]}"
+        return "\n".join(lines)[:length]
+
+
+def build_cases(corpus: Corpus) -> dict:
+    """
+    Готує всі випадки бенчмарку.
+
+    Args:
+        corpus (Corpus): Генератор даних.
+
+    Returns:
+        dict: Назва випадку -> функція без аргументів.
+    """
+    cases = {}
+
+    for length in MESSAGE_LENGTHS:
+        text = corpus.message(length)
+        cases[f"correct_punctuation/len={length}"] = lambda text=text: correct_punctuation(text)
+        text = corpus.message(length, trunc_word="полтав")
+        cases[f"trunc_message/len={length}"] = lambda text=text: trunc_message(
+            text, "полтав", CONTINUE_SYMBOLS, MAX_MESSAGE_ROWS
+        )
+
+    for size in DICT_SIZES:
+        mapping = corpus.dictionary(size)
+        engine = TranslationEngine(mapping)
+        replacer = MultiReplacer(mapping)
+        vocabulary = list(mapping)
+        for length in MESSAGE_LENGTHS:
+            text = corpus.message(length, vocabulary)
+            cases[f"translate_text/dict={size},len={length}"] = lambda text=text, engine=engine: translate_text(text, engine)
+            cases[f"replace_text/dict={size},len={length}"] = lambda text=text, replacer=replacer: replace_text(text, replacer)
+
+    for size in REGION_SIZES:
+        regions = corpus.regions(size)
+        matcher = MultiMatcher((locality, (REGION, None, index, locality)) for index, locality in enumerate(regions))
+        for length in MESSAGE_LENGTHS:
+            text = corpus.message(length, regions)
+            cases[f"make_set/regions={size},len={length}"] = lambda text=text, matcher=matcher: make_set(text, matcher)
+
+    regions = corpus.regions(REGION_SIZES[1])
+    matcher = MultiMatcher((locality, (REGION, None, index, locality)) for index, locality in enumerate(regions))
+    now = datetime(2025, 5, 1, 12, 0)
+    for size in WINDOW_SIZES:
+        # Повідомлення рівномірно в межах вікна, щоб жодне не застаріло під час вимірювання
+        times = [now - timedelta(seconds=MESSAGE_TTL * (size - i) / size) for i in range(size)]
+        texts = [corpus.message(corpus.random.randint(40, 150), regions) for _ in range(size)]
+
+        dedup = DedupIndex(2 * MESSAGE_TTL, matcher)
+        for time, text in zip(times, texts):
+            dedup.add(text, dedup.describe(text), time)
+        probe = corpus.message(120, regions)
+        cases[f"dedup_find/window={size}"] = lambda dedup=dedup, probe=probe: dedup.find(dedup.describe(probe), now)
+
+        store = ReasonStore(2 * MESSAGE_TTL, size, matcher, zip(times, texts))
+        localities = frozenset(make_set(probe, matcher))
+        cases[f"select_reason/stack={size}"] = lambda store=store, localities=localities: store.select(
+            now, MESSAGE_TTL, localities
+        )
+        cases[f"format_other_reasons/stack={size}"] = lambda store=store: format_other_reasons(
+            store, "", now, MAX_MESSAGE_ROWS, MESSAGE_TTL
+        )
+
+    return cases
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Вимірює час одного виклику і пік пам'яті, виділеної за виклик.
+
+    Args:
+        func (callable): Функція без аргументів.
+        repeat (int): Скільки серій вимірювань робити (береться найшвидша).
+
+    Returns:
+        dict: {"ns": наносекунд на виклик, "peak_bytes": пік виділеної пам'яті за виклик}.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    # Окремий виклик під tracemalloc: під ним код повільніший, тому час міряється без нього
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {"ns": round(best * 1e9, 1), "peak_bytes": max(peak, 0)}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Порівнює результати з базою.
+
+    Args:
+        results (dict): Назва випадку -> результат measure.
+        baseline (dict): Те саме з bench_baseline.json.
+        threshold (float): Допустиме погіршення у відсотках.
+
+    Returns:
+        list: Описи регресій.
+    """
+    regressions = []
+    limit = 1 + threshold / 100
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["ns"] > base["ns"] * limit:
+            regressions.append(f"{name}: {base['ns']:.0f} -> {result['ns']:.0f} нс/виклик")
+        if result["peak_bytes"] > base["peak_bytes"] * limit + ALLOCATION_SLACK:
+            regressions.append(f"{name}: {base['peak_bytes']} -> {result['peak_bytes']} Б пам'яті/виклик")
+    return regressions
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()}
+
+
+def read_baseline() -> dict:
+    if not path.exists(BASELINE_JSON):
+        return {}
+    with open(BASELINE_JSON, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Мікробенчмарки функцій обробки тексту.")
+    parser.add_argument("--filter", default="", help="лише випадки, назва яких містить цей підрядок")
+    parser.add_argument("--threshold", type=float, default=25, help="допустиме погіршення, відсотків")
+    parser.add_argument("--repeat", type=int, default=5, help="кількість серій вимірювань")
+    parser.add_argument("--confirm", type=int, default=2, help="скільки разів перевимірювати випадок, перш ніж визнати регресію")
+    parser.add_argument("--update", action="store_true", help="записати результати в bench_baseline.json")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора корпусів")
+    args = parser.parse_args()
+
+    cases = {name: func for name, func in build_cases(Corpus(args.seed)).items() if args.filter in name}
+    stored = read_baseline()
+    baseline = stored.get("cases", {})
+
+    results = {}
+    for name, func in cases.items():
+        results[name] = result = measure(func, args.repeat)
+        base = baseline.get(name)
+        change = f"{(result['ns'] / base['ns'] - 1) * 100:+7.1f}%" if base else "    нова"
+        print(f"{name:<44} {result['ns']:>14,.0f} нс/виклик {change}  {result['peak_bytes']:>10,} Б")
+
+    if args.update:
+        stored = {"environment": environment(), "cases": {**baseline, **results}}
+        with open(BASELINE_JSON, "w", encoding="utf-8") as f:
+            json.dump(stored, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print(f"Базу записано у {BASELINE_JSON}")
+        return 0
+
+    is_other_environment = bool(stored) and stored.get("environment") != environment()
+    if is_other_environment:
+        print(
+            f"Увага: база знята в іншому середовищі ({stored.get('environment')}, зараз {environment()}), "
+            "тож регресії - лише попередження. Локальна база: python bench.py --update на коміті без змін."
+        )
+    # Час на спільних машинах шумить: регресією вважається лише те, що повторюється
+    for _ in range(args.confirm):
+        suspects = [name for name in results if compare({name: results[name]}, baseline, args.threshold)]
+        for name in suspects:
+            result = measure(cases[name], args.repeat)
+            results[name] = {key: min(value, result[key]) for key, value in results[name].items()}
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"{'Можлива регресія' if is_other_environment else 'Регресія'}: {regression}")
+    return 1 if regressions and not is_other_environment else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
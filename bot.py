@@ -1,63 +1,213 @@
 import asyncio
 import json
 import logging
-from os import getenv, path, makedirs
+from os import getenv
 from dotenv import load_dotenv
-from re import sub, escape
-from copy import deepcopy
-from collections import deque
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from telethon import TelegramClient, events
-from logging.handlers import TimedRotatingFileHandler
+from logging_setup import configure_logging
+from pipeline import compile_pipelines, replace_text
+from translator import TranslationEngine
+from sender import SendQueue
+from scheduler import HIGH_PRIORITY, NORMAL_PRIORITY, IngestScheduler
+from state_store import StateStore
+from message_cache import RecentMessages
+from matcher import KEYWORD, NOT_A_REASON, STOP_WORD, build_matcher, make_set
+from dedup import DedupIndex
+from catch_up import fetch_missed
+from metrics import Metrics
+from coalesce import MAX_MESSAGE_LENGTH, Coalescer
+from forwarded import ForwardedPosts
+from reasons import ReasonStore, format_other_reasons
+from routing import Router, load_profiles
+from history import HistoryStore
+from profiling import Profiler
+from config_watch import ConfigWatcher
+from sessions import SessionPool
 
 
 CHANNELS_JSON = "channels.json"
 SETTINGS_JSON = "settings.json"
 STATE_JSON = "state.json"
+STATE_JOURNAL = "state.journal"
 TRANSLATE_JSON = "translate.json"
+OTHER_REASONS_HEADER = "Інші можливі причини тривоги:\n"
 
 
-class DailyFileHandler(TimedRotatingFileHandler):
-    """Обробник логів, який щодня створює новий файл виду log_yyyy-mm-dd.log"""
+load_dotenv()
+client = TelegramClient("user_session", getenv("API_ID"), getenv("API_HASH"))
+client.parse_mode = "html"
 
-    def __init__(self, log_dir="logs"):
-        self.log_dir = log_dir
-        makedirs(self.log_dir, exist_ok=True)
-        super().__init__(self._build_filename(), when="midnight", interval=1, encoding="utf-8")
+configure_logging()  # Рівні з settings.json застосовуються нижче, після його читання
 
-    def _build_filename(self):
-        return path.join(self.log_dir, f"log_{datetime.now().strftime('%Y-%m-%d')}.log")
+logger = logging.getLogger("bot")
 
-    def doRollover(self):
-        if self.stream:
-            self.stream.close()
-        self.baseFilename = self._build_filename()
-        self.stream = self._open()
+STATE_STORE = StateStore(STATE_JSON, STATE_JOURNAL, compact_every=100)
 
+# Ключі settings.json, зміни яких застосовуються лише після перезапуску
+RESTART_SETTINGS = (
+    "send_rate_per_minute", "send_burst", "send_max_retries", "dead_letter_file",
+    "ingest_max_depth", "ingest_max_age", "ingest_workers", "ingest_sessions",
+    "recent_cache_size", "recent_cache_max_chars",
+    "metrics_port", "metrics_log_interval", "profile_on_start", "profile_seconds", "loop_lag_threshold_ms",
+    "history_db", "history_batch_size", "history_flush_interval",
+    "log_async", "log_level", "log_levels", "config_reload_interval",
+)
 
-load_dotenv()
-client = TelegramClient("user_session", getenv("API_ID"), getenv("API_HASH"))
-client.parse_mode = "html"
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%H:%M:%S",
-    handlers=[DailyFileHandler()],
-)
+def read_config(required_settings=()) -> dict:
+    """
+    Читає, перевіряє і компілює channels.json, settings.json і translate.json.
 
-logger = logging.getLogger(__name__)
+    Не змінює стан бота, тому під час перезавантаження виконується в окремому потоці.
 
-try:
+    Args:
+        required_settings (iterable): Ключі, які мають бути в settings.json.
+
+    Returns:
+        dict: Канали, налаштування, перекладач, ланцюжки обробки, області, матчер і вікна об'єднання.
+
+    Raises:
+        ValueError: Якщо в settings.json бракує ключів або канали, області чи налаштування мають неправильну структуру.
+    """
     with open(CHANNELS_JSON, "r", encoding="utf-8") as f:
-        CHANNELS = {int(k): v for k, v in json.load(f).items()}
+        channels = {int(k): v for k, v in json.load(f).items()}
     with open(SETTINGS_JSON, "r", encoding="utf-8") as f:
-        general_settings = json.load(f)
-    with open(TRANSLATE_JSON, "r", encoding="utf-8") as f:
-        TRANSLATION_DICT = json.load(f)
-    with open(STATE_JSON, "r", encoding="utf-8") as f:
-        client.state = json.load(f)
+        settings = json.load(f)
+    missing = sorted(set(required_settings) - set(settings))
+    if missing:
+        raise ValueError(f"У {SETTINGS_JSON} бракує ключів: {', '.join(missing)}")
+    for key in ("region", "continue_symbols", "not_a_reason"):
+        if not isinstance(settings.get(key), list) or not all(isinstance(word, str) for word in settings[key]):
+            raise ValueError(f"'{key}' у {SETTINGS_JSON} має бути списком рядків.")
+    try:
+        coalesce_windows = {int(k): float(v) for k, v in settings.get("coalesce_windows", {}).items()}
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"'coalesce_windows' у {SETTINGS_JSON} має зіставляти id каналу з числом секунд.") from None
+
+    # Необов'язковий кеш скомпільованого словника пришвидшує старт на великих словниках
+    translator = TranslationEngine.from_json(TRANSLATE_JSON, settings.get("translate_cache", ""))
+    # Налаштування каналів компілюються один раз, а не читаються зі словника на кожну подію
+    pipelines = compile_pipelines(
+        channels,
+        translator,
+        settings["continue_symbols"],
+        settings["max_message_rows"],
+    )
+    # Області з власними каналами тривог і призначення; одна подія передається всім, хто стежить за каналом
+    router = Router(load_profiles(settings), pipelines)
+    # Спільний матчер над ключовими словами, стоп-словами, not_a_reason і населеними пунктами всіх областей
+    matcher = build_matcher(pipelines, settings["not_a_reason"], router.region_lists(), router.keyword_overrides())
+    return {
+        "channels": channels,
+        "settings": settings,
+        "translator": translator,
+        "pipelines": pipelines,
+        "router": router,
+        "matcher": matcher,
+        "coalesce_windows": coalesce_windows,
+    }
+
+
+def apply_config(config: dict) -> None:
+    """
+    Підставляє скомпільовану конфігурацію і прив'язує до областей їхній стан.
+
+    Спершу для всіх областей будуються нові сховища причин, вікна дублікатів
+    і переслані повідомлення, нічого не змінюючи в робочому стані; якщо тут
+    виникає помилка, бот лишається зі старою конфігурацією повністю. Лише
+    потім усе підставляється присвоєннями, без await, тож обробники бачать
+    або стару, або нову конфігурацію. Причини тривоги і вікно дублікатів
+    області переносяться в нову конфігурацію з перерахованими населеними
+    пунктами.
+
+    Args:
+        config (dict): Результат read_config.
+
+    Returns:
+        None.
+    """
+    global CHANNELS, general_settings, TRANSLATOR, PIPELINES, ROUTER, MATCHER
+    global MAX_MESSAGE_ROWS, MESSAGE_TTL, ALARM_START_KEYWORD, ALARM_END_KEYWORD, CONTINUE_SYMBOLS
+    global REGION_LIST, NOT_A_REASON_LIST, MAX_REASON_LENGTH, TARGET_CHANNEL_ID, CATCH_UP_MAX_AGE
+    global REASON_RANK_BY_LOCALITY
+
+    settings = config["settings"]
+    router = config["router"]
+    matcher = config["matcher"]
+    previous = {profile.name: profile for profile in globals().get("ROUTER", ())}
+
+    # Етап 1: нові об'єкти областей; робочий стан лише читається
+    region_states = router.region_states(client.state)
+    prepared = []
+    for profile in router:
+        region_state = region_states[profile.name]
+        # Можливі причини тривоги живуть стільки, скільки їх показують серед інших причин (2 * message_ttl)
+        message_stack = ReasonStore(
+            2 * settings["message_ttl"],
+            settings["reason_max_entries"],
+            matcher,
+            region_state.get("message_stack", []),
+            profile.region_owner,
+        )
+        # Вікно нещодавно надісланих повідомлень для пошуку дублікатів з різних каналів
+        dedup = DedupIndex(
+            settings["dedup_ttl"],
+            matcher,
+            settings["dedup_locality_threshold"],
+            settings["dedup_text_threshold"],
+            region_owner=profile.region_owner,
+        )
+        old = previous.get(profile.name)
+        if old is not None:
+            for entry in old.dedup.entries:
+                dedup.add(entry.text, dedup.describe(entry.text), entry.time)
+        elif region_state.get("last_message"):
+            dedup.add(
+                region_state["last_message"],
+                dedup.describe(region_state["last_message"]),
+                region_state["last_message_time"],
+            )
+        # Наші повідомлення за джерелом, щоб редагування джерела редагувало й нашу копію
+        forwarded = ForwardedPosts(region_state.get("forwarded", {}), settings["forwarded_max_entries"])
+        if old is not None:
+            forwarded.queued = old.forwarded.queued  # Повідомлення, що ще в черзі на надсилання
+            forwarded.digested = old.forwarded.digested
+        prepared.append((profile, message_stack, dedup, forwarded))
+
+    # Етап 2: лише присвоєння
+    router.bind_state(client.state, region_states)
+    for profile, message_stack, dedup, forwarded in prepared:
+        profile.state["message_stack"] = message_stack
+        profile.state["forwarded"] = forwarded.entries
+        profile.dedup = dedup
+        profile.forwarded = forwarded
+
+    CHANNELS = config["channels"]
+    general_settings = settings
+    TRANSLATOR = config["translator"]
+    PIPELINES = config["pipelines"]
+    ROUTER = router
+    MATCHER = matcher
+
+    MAX_MESSAGE_ROWS = settings["max_message_rows"]
+    MESSAGE_TTL = settings["message_ttl"]
+    ALARM_START_KEYWORD = settings["alarm_start_keyword"]
+    ALARM_END_KEYWORD = settings["alarm_end_keyword"]
+    CONTINUE_SYMBOLS = settings["continue_symbols"]
+    REGION_LIST = settings["region"]
+    NOT_A_REASON_LIST = settings["not_a_reason"]
+    MAX_REASON_LENGTH = settings["max_reason_length"]
+    TARGET_CHANNEL_ID = settings["target_channel_id"]  # Канал призначення області за замовчуванням
+    CATCH_UP_MAX_AGE = settings["catch_up_max_age"]  # Старші пропущені повідомлення лише оновлюють стан
+    REASON_RANK_BY_LOCALITY = settings["reason_rank_by_locality"]
+
+
+try:
+    config = read_config()
+    # Знімок стану + журнал змін, записаних після нього
+    client.state = STATE_STORE.load(stack_maxlen=None)  # Обмеження - у ReasonStore
 except FileNotFoundError:
     logger.error("Файл json не знайдено.")
     raise
@@ -65,558 +215,888 @@ except json.JSONDecodeError:
     logger.error("Помилка формату json.")
     raise
 
-# Блок відновлення типу змінних після читання з json
-for key in ("alarm_start_time", "last_message_time"):
-    # for key in ("last_message_time"):
-    if isinstance(client.state.get(key), str):
-        client.state[key] = datetime.fromisoformat(client.state[key])
-
-for i in client.state["message_stack"]:
-    if isinstance(i[0], str):
-        i[0] = datetime.fromisoformat(i[0])
-client.state["message_stack"] = deque(client.state["message_stack"], maxlen=4)
-
-if isinstance(client.state["message_count"], str):
-    client.state["message_count"] = int(client.state["message_count"])
-# Кінець блоку відновлення типу змінних після читання з json
-
-MAX_MESSAGE_ROWS = general_settings["max_message_rows"]
-MESSAGE_TTL = general_settings["message_ttl"]
-ALARM_START_KEYWORD = general_settings["alarm_start_keyword"]
-ALARM_END_KEYWORD = general_settings["alarm_end_keyword"]
-CONTINUE_SYMBOLS = general_settings["continue_symbols"]
-REGION_LIST = general_settings["region"]
-NOT_A_REASON_LIST = general_settings["not_a_reason"]
-MAX_REASON_LENGTH = general_settings["max_reason_length"]
-TARGET_CHANNEL_ID = general_settings["target_channel_id"]  # Канал призначення
-ALARM_CHANNEL_ID = general_settings["alarm_channel_id"]
+configure_logging(
+    config["settings"]["log_async"],
+    config["settings"]["log_level"],
+    config["settings"]["log_levels"],
+)
+apply_config(config)
+
+# Гістограми тривалості етапів обробки; лічильники і глибина черг - у METRICS
+METRICS = Metrics("telebot")
+INGEST_LAG = METRICS.histogram("ingest_lag", "Час від публікації повідомлення до початку обробки.")
+PROCESS_TIME = METRICS.histogram("process_text", "Обробка тексту каналу.")
+MATCH_TIME = METRICS.histogram("matching", "Пошук ключових слів і стоп-слів.")
+DEDUP_TIME = METRICS.histogram("dedup", "Пошук дубліката у вікні.")
+REPLY_FETCH_TIME = METRICS.histogram("reply_fetch", "Отримання цитованого повідомлення з Telegram.")
+SEND_TIME = METRICS.histogram("send", "Виклик API надсилання.")
+DELIVERY_LAG = METRICS.histogram("delivery_lag", "Час від публікації джерела до надсилання в канал призначення.")
+SAVE_STATE_TIME = METRICS.histogram("save_state", "Збереження стану.")
+LOOP_LAG = METRICS.histogram("loop_lag", "Запізнення циклу подій відносно запланованого.")
+
+# Профілювання за SIGUSR1 або прапорцем profile_on_start
+PROFILER = Profiler(
+    general_settings["profile_seconds"],
+    general_settings["loop_lag_threshold_ms"] / 1000,
+    on_lag=LOOP_LAG.observe,
+)
 
 # client.state["is_alarm"] = ""
 # client.state["alarm_start_time"] = ""
 
 
-def correct_punctuation(text: str) -> str:
+def calculate_length_hm(diff: datetime) -> tuple:
     """
-    Виправляє пунктуацію в повідомленні.
+    Перетворює секунди на години і хвилини.
 
     Args:
-        text (str): Вхідний текст для обробки.
+        diff (datetime): Різниця між двома datetime.
 
     Returns:
-        str: Виправлений текст.
+        tuple: Повертає години і хвилини.
     """
-    if text:
-        text = sub(r"([.!?,;])", r"\1 ", text)
-        text = sub(r"\s+([.!?,;])", r"\1", text)
-        text = sub(r"\s+", " ", text)
-
-    return text
+    total_secs = int(diff.total_seconds())
+    return total_secs // 3600, (total_secs % 3600) // 60
 
 
-def trunc_message(
-    text: str, trunc_word: str, continue_symbols: set, max_message_rows=MAX_MESSAGE_ROWS
-) -> str:
+def select_reason(message_stack: ReasonStore, time_now: datetime, localities=frozenset(), message_ttl=MESSAGE_TTL):
     """
-    Обрізає текст, починаючи з рядка, що містить trunc_word, і до рядка,
-    який не починається з символів із continue_symbols.
+    Обирає причину тривоги зі сховища можливих причин.
 
     Args:
-        text (str): Вхідний текст для обробки.
-        trunc_word (str): Слово, з якого починається обрізка.
-        continue_symbols (set): Набір символів, які дозволяють продовжувати обробку.
+        message_stack (ReasonStore): Сховище можливих причин.
+        time_now (datetime): Поточний час.
+        localities (frozenset): Населені пункти з повідомлення про тривогу (порожня множина - найкоротша причина).
 
     Returns:
-        str: Обрізаний текст, без завершальних пробілів.
-    """
-    if not text:
-        return ""
-    if (
-        not trunc_word
-        or len(text.split("\n")) <= max_message_rows
-        or trunc_word not in text.lower()
-    ):
-        return text
+        ReasonCandidate | None: Обрана причина (текст і канал) або None.
+    """
+    return message_stack.select(time_now, message_ttl, localities)
 
-    result_lines = []
-    is_processing = False
-    lines = text.split("\n")
 
-    for line in lines:
-        if is_processing:
-            if line.strip() and line.strip()[0] not in continue_symbols:
-                break
-            result_lines.append(line)
+async def send_message(message: dict) -> None:
+    """
+    Надсилає одне повідомлення. Викликається тільки відправником черги SEND_QUEUE.
 
-        elif trunc_word in line.lower():
-            result_lines.append(line)
-            is_processing = True
+    Args:
+        message (dict): Словник з даними повідомлення.
 
-    return "\n".join(result_lines).strip()
+    Returns:
+        None.
+    """
+    target_channel_id = message.get("target_channel_id", TARGET_CHANNEL_ID)
+    file = message.get("file", None)
+    message_text = message.get(
+        "message_text", "<i>Помилка надсилання повідомлення</i>"
+    )
+    silent = message.get("silent", False)
+    edit_id = message.get("edit_id")
+
+    with SEND_TIME.time():
+        if edit_id:
+            await client.edit_message(target_channel_id, edit_id, message_text)
+            logger.debug("Було відредаговане повідомлення %s:\n>>> %s <<<", edit_id, message_text)
+            return
+        if file:
+            sent = await client.send_file(
+                target_channel_id, file=file, caption=message_text, silent=silent
+            )
+        else:
+            sent = await client.send_message(
+                target_channel_id, message_text, silent=silent
+            )
+    source = message.get("source")
+    profile = ROUTER.by_target.get(target_channel_id)
+    if source and sent is not None and profile is not None:
+        profile.forwarded.remember(source, target_channel_id, sent.id, message_text)
+        if message["message_text"] != message_text:
+            # Джерело відредагували, поки повідомлення надсилалося
+            profile.forwarded.update_text(*source, message["message_text"])
+            SEND_QUEUE.put({"target_channel_id": target_channel_id, "edit_id": sent.id, "message_text": message["message_text"]})
+    event_date = message.get("event_date")
+    delivery_lag = None
+    if event_date is not None:
+        delivery_lag = (datetime.now(event_date.tzinfo) - event_date).total_seconds()
+        DELIVERY_LAG.observe(delivery_lag)
+    if sent is not None:
+        HISTORY.forwarded(
+            datetime.now(),
+            profile.name if profile is not None else "",
+            source,
+            target_channel_id,
+            sent.id,
+            delivery_lag,
+            message_text,
+        )
+    logger.debug("Було надіслане повідомлення:\n>>> %s <<<", message_text)
 
 
-def translate_text(text: str, translate_dict: dict) -> str:
+def send_messages(messages_to_send: list, priority=NORMAL_PRIORITY, event_date=None) -> None:
     """
-    Перекладає повідомлення на українську, використовуючи словник.
+    Ставить повідомлення в чергу на надсилання відповідно до отриманого списку.
 
     Args:
-        text (str): Вхідний текст для обробки.
-        translate_dict (dict): Словник з парами слів.
+        messages_to_send (list): Список словників з даними повідомлень.
+        priority (int): Пріоритет повідомлень у черзі (HIGH_PRIORITY для тривоги/відбою).
+        event_date (datetime): Час публікації повідомлення-джерела, для метрики delivery_lag.
 
     Returns:
-        str: Перекладений текст.
+        None.
     """
-    pattern = r"\b(" + "|".join(escape(key) for key in translate_dict.keys()) + r")\b"
-    return sub(pattern, lambda m: translate_dict[m.group()], text.lower()).capitalize()
+    for message in messages_to_send:
+        message.setdefault("target_channel_id", TARGET_CHANNEL_ID)
+        message.setdefault("priority", priority)
+        message.setdefault("event_date", event_date)
+        if message.get("source"):
+            profile = ROUTER.by_target.get(message["target_channel_id"])
+            if profile is not None:
+                # До надсилання редагування джерела змінює текст просто в черзі
+                profile.forwarded.expect(message["source"], message)
+        if priority == HIGH_PRIORITY:
+            SEND_QUEUE.put(message)  # Тривога і відбій не чекають вікна об'єднання
+        else:
+            COALESCER.add(message)
 
 
-def replace_text(text: str, replace_dict) -> str:
+def forget_queued(message: dict, is_digested=False) -> None:
     """
-    Замінює символи в повідомленні, використовуючи словник.
+    Прибирає повідомлення з черги очікування його області, коли воно вже
+    не буде надіслане окремо: його об'єднано в дайджест або записано в
+    dead letter файл.
 
     Args:
-        text (str): Вхідний текст для обробки.
-        replace_dict (dict): Словник з парами слів/символів.
+        message (dict): Словник повідомлення.
+        is_digested (bool): Чи об'єднано повідомлення в дайджест.
 
     Returns:
-        str: Опрацьований текст.
+        None.
     """
-    if replace_dict:
-        for key, value in replace_dict.items():
-            if key in text:
-                text = text.replace(key, value)
+    source = message.get("source")
+    if not source:
+        return
+    profile = ROUTER.by_target.get(message.get("target_channel_id"))
+    if profile is not None:
+        profile.forwarded.forget(source, message, is_digested)
 
-    return text
 
+# Історія тривог, надісланих повідомлень і дублікатів; пише окремий потік
+HISTORY = HistoryStore(
+    general_settings["history_db"],
+    general_settings["history_batch_size"],
+    general_settings["history_flush_interval"],
+)
 
-def calculate_length_hm(diff: datetime) -> tuple:
-    """
-    Перетворює секунди на години і хвилини.
+RECENT_MESSAGES = RecentMessages(
+    general_settings["recent_cache_size"],
+    general_settings["recent_cache_max_chars"],
+)
 
-    Args:
-        diff (datetime): Різниця між двома datetime.
+SEND_QUEUE = SendQueue(
+    send_message,
+    general_settings["send_rate_per_minute"],
+    general_settings["send_burst"],
+    general_settings["send_max_retries"],
+    general_settings["dead_letter_file"],
+    forget_queued,
+)
 
-    Returns:
-        tuple: Повертає години і хвилини.
-    """
-    total_secs = int(diff.total_seconds())
-    return total_secs // 3600, (total_secs % 3600) // 60
+# Звичайні повідомлення, що надходять упродовж кількох секунд, надсилаються одним дайджестом
+COALESCER = Coalescer(
+    SEND_QUEUE.put,
+    config["coalesce_windows"],
+    discard=lambda message: forget_queued(message, is_digested=True),
+)
+METRICS.gauge("coalesced", "Надсилань, заощаджених об'єднанням у дайджести.", lambda: COALESCER.merged)
 
 
-def make_set(message: str, region_list=REGION_LIST) -> set:
+async def load_alarm_state_from_channel(profile):
     """
-    Перетворює рядок на множину, використовуючи заданий масив назв населених пунктів.
+    Завантажує статус тривога/відбій області з її каналу тривог.
 
     Args:
-        message (str): Повідомлення.
+        profile (RegionProfile): Область.
 
     Returns:
-        set: Множина з унікальними словами - назвами населених пунктів.
+        None.
     """
-    return {locality for locality in region_list if locality in message.lower()}
+    state = profile.state
+    try:
+        last_msg = await client.get_messages(profile.alarm_channel_id, limit=1)
+        if last_msg and last_msg[0] and last_msg[0].raw_text:
+            msg_text = last_msg[0].raw_text.lower()
 
+            # Час з повідомлення у локальний (Київ)
+            msg_time_utc = last_msg[0].date
+            msg_time = msg_time_utc.astimezone(ZoneInfo("Europe/Kyiv")).replace(
+                tzinfo=None
+            )
 
-def is_similar(message1: str, message2: str, last_message_time: datetime, message_ttl=MESSAGE_TTL) -> bool:
-    """
-    Порівнює два повідомлення.
+            state["is_alarm"] = ALARM_START_KEYWORD in msg_text
+            state["alarm_start_time"] = msg_time
 
-    Args:
-        message1 (str): Повідомлення 1.
-        message1 (str): Повідомлення 2.
-        last_message_time (datetime): Час старішого повідомлення.
+            print(
+                f"[INFO] Поточний статус{f' ({profile.name})' if profile.name else ''}: "
+                f"{'ТРИВОГА' if state['is_alarm'] else 'ВІДБІЙ'} (з {msg_time.strftime('%H:%M:%S')})"
+            )
+            logger.info(
+                "Поточний статус%s: %s (з %s)",
+                f" ({profile.name})" if profile.name else "",
+                "ТРИВОГА" if state["is_alarm"] else "ВІДБІЙ",
+                msg_time.strftime("%H:%M:%S"),
+            )
+        else:
+            logger.warning("Канал не містить текстових повідомлень для перевірки.")
 
-    Returns:
-        bool: Повертає True, якщо співпало 70% слів чи більше.
-    """
-    if (datetime.now() - last_message_time).total_seconds() > 2 * message_ttl:
-        # logger.debug("Попереднє повідомлення старе, тому перевірка на схожість далі не здійснюється.")
-        return False
+    except Exception as e:
+        logger.error("Не вдалося отримати останнє повідомлення з каналу тривоги: %s", e)
 
-    logger.debug(f"Порівнюємо 2 повідомлення:\n1) >>> {message1}\n2) >>> {message2}")
-    set1 = make_set(message1)
-    logger.debug(f"Set 1:\n{set1}")
-    set2 = make_set(message2)
-    logger.debug(f"Set 2:\n{set2}")
-    if not set1 or not set2:
-        logger.debug("Якийсь з set пустий. Зупиняємо порівняння!")
-        return False
 
-    match_rate = len(set1.intersection(set2)) / max(len(set1), len(set2))
+def exception_handler(func):
 
-    return match_rate >= 0.7
+    async def wrapper(event, *args, **kwargs):
+        try:
+            return await func(event, *args, **kwargs)
+        except Exception as e:
+            channel_name = "невідомий канал"
+            if hasattr(event, "chat_id") and event.chat_id in CHANNELS:
+                channel_name = CHANNELS[event.chat_id].get("name", "невідомий канал")
+
+            logger.error("Помилка в обробці повідомлення з '%s': %s", channel_name, e)
+
+    return wrapper
 
 
-def select_reason(message_stack: deque, time_now: datetime, message_ttl=MESSAGE_TTL) -> str:
+async def get_quoted_message(event, channel_id: int, pipeline):
     """
-    Обирає найкоротшу причину зі стеку повідомлень.
+    Повертає опрацьований текст і фото цитованого повідомлення.
+
+    Спершу шукає цитату в RECENT_MESSAGES і лише при промаху звертається до Telegram.
 
     Args:
-        message_stack (deque): Стек повідомлень.
-        time_now (str): Поточний час.
+        event: Подія нового повідомлення, яке є відповіддю.
+        channel_id (int): Id каналу.
+        pipeline (ChannelPipeline): Ланцюжок обробки тексту каналу.
 
     Returns:
-        str: Повертає найкоротше повідомлення.
+        tuple | None: (текст, фото) або None, якщо цитата недоступна.
     """
-    valid_reasons = [
-        m[1] for m in message_stack if (time_now - m[0]).total_seconds() <= message_ttl
-    ]
-    return min(valid_reasons, key=len, default="")
-
-
-async def send_messages(messages_to_send: list) -> None:
+    # Відповідь на повідомлення з іншого чату в кеші цього каналу не шукаємо
+    if getattr(event.reply_to, "reply_to_peer_id", None) is None:
+        entry = RECENT_MESSAGES.get(channel_id, event.reply_to_msg_id)
+        if entry is not None:
+            with PROCESS_TIME.time():
+                processed = entry.process(pipeline)
+            return processed.text, entry.photo
+
+    with REPLY_FETCH_TIME.time():
+        quoted_message = await event.get_reply_message()
+    if not quoted_message:
+        return None
+    with PROCESS_TIME.time():
+        return pipeline.process(quoted_message.raw_text), quoted_message.photo
+
+
+def attach_quote(event, quoted, message_text: str, file) -> tuple:
     """
-    Надсилає повідомлення відповідно до отриманого списку.
+    Додає до повідомлення цитоване повідомлення і його зображення, якщо це відповідь.
 
     Args:
-        messages_to_send (list): Список словників з даними повідомлень.
+        event: Подія або повідомлення каналу-джерела.
+        quoted (tuple | None): Результат get_quoted_message.
+        message_text (str): Вже опрацьований текст повідомлення.
+        file: Власне зображення повідомлення (або None).
 
     Returns:
-        None.
+        tuple: Текст і файл для надсилання.
     """
-    for message in messages_to_send:
-
-        target_channel_id = message.get("target_channel_id", TARGET_CHANNEL_ID)
-        file = message.get("file", None)
-        message_text = message.get(
-            "message_text", "<i>Помилка надсилання повідомлення</i>"
-        )
-        silent = message.get("silent", False)
+    # Перевіряємо, чи є це цитата
+    if not (event.is_reply and event.reply_to):
+        logger.info("Це не цитата")
+        return message_text, file
+
+    if not quoted:
+        logger.info("Цитоване повідомлення недоступне (можливо, видалене)")
+        return message_text, file
+
+    quoted_text, quoted_photo = quoted
+    message_text = f"<blockquote>{quoted_text}</blockquote>\n{message_text}"
+    logger.info("Цитоване повідомлення: %s", quoted_text)
+
+    # Якщо в цитаті є зображення і власного файлу ще немає - додаємо його
+    if quoted_photo and not file:
+        file = quoted_photo
+        message_text += "\n<i>Прикріплене зображення узяте з цитати.</i>"
+        logger.info("У цитаті знайдено зображення - буде додано до повідомлення")
+    return message_text, file
+
+
+async def on_new_message(event):
+    """Лише ставить подію в чергу INGEST; обробка - у handler, який викликає диспетчер."""
+    pipeline = PIPELINES.get(event.chat_id)
+    if pipeline is None:
+        return
 
-        try:
-            if file:
-                await client.send_file(
-                    target_channel_id, file=file, caption=message_text, silent=silent
-                )
-            else:
-                await client.send_message(
-                    target_channel_id, message_text, silent=silent
-                )
-            logger.debug(f"Було надіслане повідомлення:\n>>> {message_text} <<<")
-        except Exception as e:
-            logger.error(f"Помилка надсилання: {e}")
+    if pipeline.is_alarm_source:
+        INGEST.put(event.chat_id, event, HIGH_PRIORITY, sheddable=False)
+    else:
+        INGEST.put(event.chat_id, event, NORMAL_PRIORITY, sheddable=not pipeline.is_silent)
 
 
-def process_text(message_text: str, config: dict) -> str:
+def is_stop_filtered(pipeline, channel_id, message_text: str, matches) -> bool:
     """
-    Редагує текст повідомлення відповідно до прапорців каналу.
+    Чи відфільтровує канал повідомлення за стоп-словом або за довжиною.
 
     Args:
+        pipeline (ChannelPipeline): Налаштування каналу-джерела.
+        channel_id (int): Id каналу-джерела.
         message_text (str): Текст повідомлення.
-        config (dict): Словник з налаштуваннями каналу.
+        matches (MatchResult): Збіги в цьому тексті.
 
     Returns:
-        message_text (str): Текст повідомлення.
+        bool: True, якщо повідомлення не надсилається через стоп-слова.
     """
-    if config.get("is_correct_punctuation", False):  # Корекція пунктуації
-        message_text = correct_punctuation(message_text)
-
-    if config.get("is_translate", False):  # Спеціальна обробка і переклад тексту
-        message_text = translate_text(message_text, TRANSLATION_DICT)
-
-    if config.get("is_delete_words", False):  # Видалення слів відповідно до переліку
-        for delete_word in config.get("delete_words", []):
-            message_text = message_text.replace(delete_word, "")
-        message_text = message_text.strip()
-
-    if (
-        config.get("is_trunc_message", False)
-        and len(message_text.split("\n")) > MAX_MESSAGE_ROWS
-    ):  # Обрізання зайвої інформації
-        message_text = trunc_message(
-            message_text, config.get("trunc_word", ""), CONTINUE_SYMBOLS
-        )
-
-    return message_text
+    return pipeline.is_filter_stop_words and (
+        len(message_text) > pipeline.stop_length or matches.has(STOP_WORD, channel_id)
+    )
 
 
-def format_other_reasons(
-    message_stack,
-    reason,
-    now,
-    max_message_rows=MAX_MESSAGE_ROWS,
-    message_ttl=MESSAGE_TTL,
-):
+def needs_quote(profile, pipeline, channel_id, raw_text: str, matches) -> bool:
     """
-    Формує рядок з іншими причинами, відформатованими як цитати.
+    Чи дійде повідомлення в області до надсилання, тобто чи потрібна йому
+    цитата: ті самі перевірки, що в route_message перед обробкою тексту.
 
     Args:
-        message_stack (list): Список кортежів з часом і текстом повідомлень.
-        reason (str): Причина, яку потрібно виключити.
-        max_message_rows (int): Максимальна кількість рядків у повідомленні.
-        message_ttl (int): Час життя повідомлення в секундах.
-        now (datetime): Поточний час для порівняння.
+        profile (RegionProfile): Область.
+        pipeline (ChannelPipeline): Налаштування каналу-джерела.
+        channel_id (int): Id каналу-джерела.
+        raw_text (str): Текст повідомлення.
+        matches (MatchResult): Збіги в тексті.
 
     Returns:
-        str: Відформатований рядок з іншими причинами.
-    """
-    other_reasons = "\n \n".join(
-        f"<blockquote>{other_reason}</blockquote>"
-        for other_reason in [
-            m[1]
-            for m in message_stack
-            if m[1] != reason
-            and len(m[1].split("\n")) < 2 * max_message_rows
-            and (now - m[0]).total_seconds() <= 2 * message_ttl
-        ]
-    )
-    return other_reasons
+        bool: False, якщо повідомлення точно не надсилається в цю область.
+    """
+    state = profile.state
+    if pipeline.is_read_only_when_alarm and not state["is_alarm"]:
+        return False
+    if pipeline.is_alarm_source and state["is_show_next_event"]:
+        return True  # route_message спершу обріже текст, тож перевірки нижче для нього неточні
+    if matches.first(KEYWORD, profile.keyword_owner(channel_id)) is None:
+        return False
+    return not is_stop_filtered(pipeline, channel_id, raw_text, matches)
 
 
-def save_state(state_copy: dict) -> None:
+def route_message(profile, event, pipeline, raw_text: str, matches, quoted, now: datetime, cached) -> tuple:
     """
-    Зберігає поточний стан скрипта.
+    Обробляє повідомлення каналу-джерела для однієї області.
+
+    Не містить await: стан області читається і змінюється без перемикань
+    на інші обробники.
 
     Args:
-        state_copy (dict): Копія стану скрипта.
+        profile (RegionProfile): Область.
+        event: Подія або повідомлення каналу-джерела.
+        pipeline (ChannelPipeline): Ланцюжок обробки тексту каналу.
+        raw_text (str): Текст повідомлення.
+        matches (MatchResult): Збіги спільного матчера в raw_text.
+        quoted (tuple | None): Результат get_quoted_message.
+        now (datetime): Час обробки (для пропущених повідомлень - час публікації).
+        cached (CachedMessage): Запис кешу повідомлення, спільний для всіх областей.
 
     Returns:
-        None.
+        tuple: Список словників повідомлень, прапорець негайного збереження стану
+            і прапорець, що стан області змінився.
     """
-    for key in ("alarm_start_time", "last_message_time"):
-        if hasattr(state_copy[key], "isoformat"):
-            state_copy[key] = state_copy[key].isoformat()
+    channel_id = event.chat_id
+    url = pipeline.url
+    is_alarm_source = pipeline.is_alarm_source
+    keyword_owner = profile.keyword_owner(channel_id)
+    state = profile.state
+    message_text = raw_text
 
-    if "message_stack" in state_copy:
-        for message in state_copy["message_stack"]:
-            if len(message) > 0 and hasattr(message[0], "isoformat"):
-                message[0] = message[0].isoformat()
+    other_reasons = ""
+    messages_to_send = []
+    is_save_right_now = False  # Прапорець, який каже що треба зберегти стан прямо зараз
+    is_state_changed = False
 
-    state_copy["message_stack"] = list(state_copy["message_stack"])
+    if pipeline.is_read_only_when_alarm and not state["is_alarm"]:
+        logger.info("Пропущене повідомлення з каналу, який відстежується тільки під час тривоги.")
+        return messages_to_send, is_save_right_now, is_state_changed
 
-    with open(STATE_JSON, "w", encoding="utf-8") as f:
-        json.dump(state_copy, f, indent=4)
+    # Зберігаємо можливі причини тривоги в стек
+    if (pipeline.is_save_for_alarm and not state["is_alarm"] and len(message_text) <= MAX_REASON_LENGTH and len(message_text.split()) > 1 and not matches.has(NOT_A_REASON)):
+        with PROCESS_TIME.time():
+            processed = cached.process(pipeline)
+        # Зберігаємо текст, час і канал; кількість рядків береться з того самого LineView
+        state["message_stack"].add(now, processed.text, url, processed.line_count)
 
+    if (state["is_show_next_event"] and is_alarm_source): # Якщо треба обов'язково показати наступне повідомлення
+        state["is_show_next_event"] = False
+        if (now - state["alarm_start_time"]).total_seconds() < MESSAGE_TTL:
+            with PROCESS_TIME.time():
+                message_text = pipeline.trunc(message_text)
+            messages_to_send.append({"message_text": f"<i>Ймовірна причина тривоги:</i>\n{message_text}\n(<i>{url}</i>)", "silent": True,})
 
-async def load_alarm_state_from_channel():
-    """
-    Завантажує статус тривога/відбій з відповідного каналу.
+    # Якщо текст обрізали вище, шукаємо збіги вже в обрізаному тексті
+    if message_text is not raw_text:
+        with MATCH_TIME.time():
+            matches = MATCHER.scan(message_text.lower())
 
-    Args:
-        None.
+    keyword = matches.first(KEYWORD, keyword_owner)  # Перше за порядком у channels.json
 
-    Returns:
-        None.
-    """
-    try:
-        last_msg = await client.get_messages(ALARM_CHANNEL_ID, limit=1)
-        if last_msg and last_msg[0] and last_msg[0].raw_text:
-            msg_text = last_msg[0].raw_text.lower()
+    if keyword is None:
+        logger.info("Ключових слів не знайдено.")
 
-            # Час з повідомлення у локальний (Київ)
-            msg_time_utc = last_msg[0].date
-            msg_time = msg_time_utc.astimezone(ZoneInfo("Europe/Kyiv")).replace(
-                tzinfo=None
-            )
+    elif is_stop_filtered(pipeline, channel_id, message_text, matches):
+        logger.debug("Знайдено ключове слово '%s', але повідомлення відфільтроване по стоп-слову.", keyword)
 
-            client.state["is_alarm"] = ALARM_START_KEYWORD in msg_text
-            client.state["alarm_start_time"] = msg_time
+    else:
+        # Обробка тексту
+        with PROCESS_TIME.time():
+            if message_text is raw_text:
+                message_text = cached.process(pipeline).text
+            else:
+                message_text = pipeline.process(message_text)
 
-            print(
-                f"[INFO] Поточний статус: {'ТРИВОГА' if client.state['is_alarm'] else 'ВІДБІЙ'} "
-                f"(з {msg_time.strftime('%H:%M:%S')})"
-            )
-            logger.info(
-                f"[INFO] Поточний статус: {'ТРИВОГА' if client.state['is_alarm'] else 'ВІДБІЙ'} "
-                f"(з {msg_time.strftime('%H:%M:%S')})"
-            )
-        else:
-            logger.warning("Канал не містить текстових повідомлень для перевірки.")
+        additional_message = ""
+        file = event.photo
 
-    except Exception as e:
-        logger.error(f"Не вдалося отримати останнє повідомлення з каналу тривоги: {e}")
+        # Блок опрацювання тривоги і відбою. Винести у функцію
+        if is_alarm_source:
 
+            if keyword == ALARM_START_KEYWORD:
+                message_text = replace_text(message_text, pipeline.replace_words)
+                state["is_alarm"] = True
+                state["alarm_start_time"] = now
+                # logger.debug(f"Початок тривоги о {now.strftime('%H:%M:%S')}")
 
-def exception_handler(func):
+                alarm_localities = (
+                    frozenset(make_set(raw_text, MATCHER, profile.region_owner)) if REASON_RANK_BY_LOCALITY else frozenset()
+                )
+                candidate = select_reason(state["message_stack"], now, alarm_localities, MESSAGE_TTL)
+                reason = candidate.text if candidate is not None else ""
+                HISTORY.alarm_started(profile.name, now, reason, candidate.source if candidate is not None else "")
+                if reason:
+                    additional_message = (f"\n<i>Ймовірна причина тривоги:\n{reason}</i>")
+                    other_reasons = format_other_reasons(
+                        state["message_stack"],
+                        reason,
+                        now,
+                        MAX_MESSAGE_ROWS,
+                        MESSAGE_TTL,
+                        general_settings["max_other_reasons"],
+                        MAX_MESSAGE_LENGTH - len(OTHER_REASONS_HEADER),
+                    )
+                else:
+                    state["is_show_next_event"] = True
+                    additional_message = f"\n<i>Ймовірна причина тривоги не визначена.\nОчікуйте на причину в наступних повідомленнях.</i>"
 
-    async def wrapper(event):
-        try:
-            return await func(event)
-        except Exception as e:
-            channel_name = "невідомий канал"
-            if hasattr(event, "chat_id") and event.chat_id in CHANNELS:
-                channel_name = CHANNELS[event.chat_id].get("name", "невідомий канал")
+            elif keyword == ALARM_END_KEYWORD:
+                message_text = replace_text(message_text, pipeline.replace_words)
+                state["is_alarm"] = False
+                HISTORY.alarm_ended(profile.name, state["alarm_start_time"], now)
+                hours, minutes = calculate_length_hm(now - state["alarm_start_time"])
+                additional_message = (f"\n<i>Тривалість: {hours} г. {minutes} хв.</i>")
 
-            logger.error(f"[{datetime.now().strftime('%H:%M:%S')}] Помилка в обробці повідомлення з '{channel_name}': {e}")
+            message_text = f"<b>{message_text}</b>"
+            is_save_right_now = True  # Терміново зберігаємо стан, якщо ключове слово з каналу-джерела тривоги
+        # Кінець блоку опрацювання тривоги і відбою
 
-    return wrapper
+        # Додаємо мітку каналу-джерела
+        message_text += f"\n<i>({url})</i>"
+
+        message_text, file = attach_quote(event, quoted, message_text, file)
+
+        with DEDUP_TIME.time():
+            dedup_features = profile.dedup.describe(message_text)
+            duplicate = profile.dedup.find(dedup_features, now)
+        if duplicate is None:
+            if not is_alarm_source:
+                profile.dedup.add(message_text, dedup_features, now)
+
+            forward = {
+                "message_text": f"{message_text}{additional_message}",
+                "silent": pipeline.is_silent,
+            }
+            if pipeline.is_forward_images and file:
+                forward["file"] = file
+            if not is_alarm_source:
+                forward["source"] = (channel_id, event.id)  # Для редагування при зміні джерела
+            messages_to_send.append(forward)
+            logger.debug(
+                "Знайдено ключове слово '%s' — повідомлення надіслане.", keyword
+            )
+
+            if other_reasons:
+                messages_to_send.append(
+                    {
+                        "message_text": f"{OTHER_REASONS_HEADER}{other_reasons}",
+                        "silent": True,
+                    }
+                )
+
+        else:
+            METRICS.inc("duplicates", profile.name)
+            HISTORY.duplicate(now, profile.name, channel_id, event.id, message_text, duplicate.time, duplicate.text)
+            logger.info(
+                "Повідомлення пропущене: '%s' схоже на надіслане о %s '%s'.",
+                message_text,
+                duplicate.time.strftime("%H:%M:%S"),
+                duplicate.text,
+            )
+
+        if not is_alarm_source:
+            state["last_message"] = (
+                message_text  # Зберігаємо текст останнього надісланого повідомлення для майбутньої перевірки
+            )
+            state["last_message_time"] = now
+        is_state_changed = True
+
+    for message in messages_to_send:
+        message["target_channel_id"] = profile.target_channel_id
+    return messages_to_send, is_save_right_now, is_state_changed
 
 
-@client.on(events.NewMessage(chats=list(CHANNELS.keys())))
 @exception_handler
-async def handler(event):
+async def handler(event, is_catch_up=False):
 
-    message_text = event.raw_text
+    raw_text = event.raw_text
     channel_id = event.chat_id
 
-    config = CHANNELS.get(channel_id, {})
-
-    keywords = config.get("keywords", [])
-    trunc_word = config.get("trunc_word", "")
-    name = config.get("name", "невідомий")
-    url = config.get("url", "")
-    is_filter_stop_words = config.get("is_filter_stop_words", False)
-    stop_length = config.get("stop_length", 0)
-    stop_words = config.get("stop_words", [])
-    is_silent = config.get("is_silent", False)
-    is_save_for_alarm = config.get("is_save_for_alarm", False)
-    is_forward_images = config.get("is_forward_images", False)
-    is_alarm_source = config.get("is_alarm_source", False)
-    is_read_only_when_alarm = config.get("is_read_only_when_alarm", False)
-
-    state = client.state
-    now = datetime.now()
-    other_reasons = ""
-    messages_to_send = []
-    is_save_right_now = False  # Прапорець, який каже що треба зберегти стан прямо зараз
+    pipeline = PIPELINES.get(channel_id)
+    if pipeline is None:
+        return
 
-    logger.debug(f"\n[{now.strftime('%H:%M:%S')}] Повідомлення з '{name}':\n{message_text or "* EMPTY *"}\n")
+    # Позначка останнього обробленого повідомлення каналу для відновлення після перезапуску
+    last_seen = client.state.setdefault("last_seen", {})
+    previous_id = last_seen.get(str(channel_id))
+    if previous_id is not None and event.id <= previous_id:
+        logger.debug("Повідомлення %s з каналу %s уже оброблене.", event.id, channel_id)
+        return
+    last_seen[str(channel_id)] = event.id
+    if not is_catch_up:
+        INGEST_LAG.observe((datetime.now(event.date.tzinfo) - event.date).total_seconds())
+
+    name = pipeline.name
+    # Запам'ятовуємо повідомлення, щоб відповіді на нього не потребували запиту до Telegram
+    cached = RECENT_MESSAGES.put(channel_id, event.id, raw_text, event.photo)
 
-    if not message_text and not is_forward_images:
+    logger.debug("\nПовідомлення з '%s':\n%s\n", name, raw_text or "* EMPTY *")
+
+    if not raw_text and not pipeline.is_forward_images:
         return
-    if is_read_only_when_alarm and not state["is_alarm"]:
-        logger.info("Пропущене повідомлення з каналу, який відстежується тільки під час тривоги.")
+
+    profiles = ROUTER.profiles_for(channel_id)
+    if not profiles:
         return
 
-    # Зберігаємо можливі причини тривоги в стек
-    if (is_save_for_alarm and not state["is_alarm"] and len(message_text) <= MAX_REASON_LENGTH and len(message_text.split()) > 1 and not any(not_a_reason in message_text.lower() for not_a_reason in NOT_A_REASON_LIST)):
-        state["message_stack"].append([now, process_text(message_text, config)])  # Зберігаємо текст і час
+    # Один прохід по тексту знаходить ключові слова всіх областей, стоп-слова і not_a_reason одразу
+    with MATCH_TIME.time():
+        matches = MATCHER.scan(raw_text.lower())
+
+    # Цитата завантажується заздалегідь і одна на всі області: це єдиний await у handler.
+    # Увесь код нижче читає і змінює стан без await, тож обробники різних каналів, що
+    # виконуються паралельно, не можуть перемежуватися посеред оновлення стану.
+    # Завантажується лише тоді, коли повідомлення пройде стоп-слова хоч в одній області.
+    quoted = None
+    if event.is_reply and event.reply_to and any(
+        needs_quote(profile, pipeline, channel_id, raw_text, matches) for profile in profiles
+    ):
+        quoted = await get_quoted_message(event, channel_id, pipeline)
 
-    if (state["is_show_next_event"] and is_alarm_source): # Якщо треба обов'язково показати наступне повідомлення
-        state["is_show_next_event"] = False
-        if (now - state["alarm_start_time"]).total_seconds() < MESSAGE_TTL:
-            message_text = trunc_message(message_text, trunc_word, CONTINUE_SYMBOLS)
-            messages_to_send.append({"message_text": f"<i>Ймовірна причина тривоги:</i>\n{message_text}\n(<i>{url}</i>)", "silent": True,})
+    now = datetime.now()
+    is_stale = False  # Пропущене надто давно: лише оновлює стан, нічого не надсилає
+    if is_catch_up:
+        # Час події в тій самій системі відліку, що й datetime.now()
+        now = event.date.astimezone().replace(tzinfo=None)
+        is_stale = (datetime.now(event.date.tzinfo) - event.date).total_seconds() > CATCH_UP_MAX_AGE
+
+    messages_to_send = []
+    is_save_right_now = False
+    is_state_changed = False
+    for profile in profiles:
+        routed, save_now, changed = route_message(profile, event, pipeline, raw_text, matches, quoted, now, cached)
+        if routed:
+            METRICS.inc("routed", profile.name)
+        messages_to_send.extend(routed)
+        is_save_right_now = is_save_right_now or save_now
+        is_state_changed = is_state_changed or changed
+
+    # Лічильник змін - один на подію, а не на кожну область, що її обробила
+    if is_state_changed:
+        client.state["message_count"] += 1
+        logger.debug("message_count = %s", client.state["message_count"])
+
+    if client.state["message_count"] >= 10 or is_save_right_now:
+        with SAVE_STATE_TIME.time():
+            STATE_STORE.save(client.state)
+        client.state["message_count"] = 0
+
+    if messages_to_send and is_stale:
+        logger.info("Застаріле пропущене повідомлення з '%s' не надсилається.", name)
+    elif messages_to_send:
+        send_messages(messages_to_send, HIGH_PRIORITY if pipeline.is_alarm_source else NORMAL_PRIORITY, event.date)
+
+
+async def on_message_edited(event):
+    """
+    Ставить редагування в чергу INGEST разом з новими повідомленнями каналу,
+    щоб воно оброблялося після самого повідомлення, а не обганяло його.
+    """
+    pipeline = PIPELINES.get(event.chat_id)
+    if pipeline is None or pipeline.is_alarm_source:
+        return
+    INGEST.put(event.chat_id, event, NORMAL_PRIORITY, sheddable=False, process=edit_handler)
+
+
+@exception_handler
+async def edit_handler(event):
+    """
+    Редагує наші повідомлення, якщо відредаговане повідомлення джерела вже було переслане.
+
+    Текст проходить ту саму обробку, що й у handler, але без перевірки на
+    схожість, стеку причин і нових надсилань. Редагування відбувається в
+    кожній області, куди повідомлення було переслане, лише якщо отриманий
+    текст відрізняється від надісланого. Якщо наше повідомлення ще в черзі
+    на надсилання, у черзі замінюється його текст. Повідомлення, об'єднане
+    в дайджест, не редагується - це лише записується в лог.
+    """
+    channel_id = event.chat_id
+    pipeline = PIPELINES.get(channel_id)
+    if pipeline is None or pipeline.is_alarm_source:
+        return
 
-    for keyword in keywords:
+    cached = RECENT_MESSAGES.put(channel_id, event.id, event.raw_text, event.photo)
+    profiles = []
+    for profile in ROUTER.profiles_for(channel_id):
+        if profile.forwarded.is_digested(channel_id, event.id):
+            logger.info("Повідомлення з '%s' відредаговане, але воно надіслане в дайджесті - дайджест не редагуємо.", pipeline.name)
+        elif (
+            profile.forwarded.get(channel_id, event.id) is not None
+            or profile.forwarded.pending(channel_id, event.id) is not None
+        ):
+            profiles.append(profile)
+    if not profiles:
+        return
 
-        if keyword in message_text.lower():
+    message_text = event.raw_text or ""
+    with MATCH_TIME.time():
+        matches = MATCHER.scan(message_text.lower())
+    is_stopped = is_stop_filtered(pipeline, channel_id, message_text, matches)
+    matching = [
+        profile for profile in profiles
+        if not is_stopped and matches.first(KEYWORD, profile.keyword_owner(channel_id)) is not None
+    ]
+    if len(matching) < len(profiles):
+        logger.info("Відредаговане повідомлення з '%s' більше не підходить - нашу копію не змінюємо.", pipeline.name)
+    if not matching:
+        return
 
-            if is_filter_stop_words:
-                if len(message_text) > stop_length or any(stop_word in message_text.lower() for stop_word in stop_words):
-                    logger.debug(f"Знайдено ключове слово '{keyword}', але повідомлення відфільтроване по стоп-слову.")
-                    break
+    with PROCESS_TIME.time():
+        message_text = cached.process(pipeline).text or ""
+    message_text += f"\n<i>({pipeline.url})</i>"
+    quoted = await get_quoted_message(event, channel_id, pipeline) if event.is_reply and event.reply_to else None
+    message_text, _ = attach_quote(event, quoted, message_text, event.photo)
+
+    # Відповідності перечитуються після await: поки завантажувалася цитата, повідомлення могло надіслатися
+    for profile in matching:
+        queued = profile.forwarded.pending(channel_id, event.id)
+        if queued is not None:
+            if queued["message_text"] != message_text:
+                logger.info("Повідомлення з '%s' відредаговане до надсилання - надішлемо новий текст.", pipeline.name)
+                METRICS.inc("edits", profile.name)
+                queued["message_text"] = message_text
+            continue
+        entry = profile.forwarded.get(channel_id, event.id)
+        if entry is None:
+            if profile.forwarded.is_digested(channel_id, event.id):
+                logger.info("Повідомлення з '%s' відредаговане, але воно надіслане в дайджесті - дайджест не редагуємо.", pipeline.name)
+            continue
+        target_channel_id, message_id, _ = entry
+        if not profile.forwarded.update_text(channel_id, event.id, message_text):
+            logger.debug("Редагування з '%s' не змінює нашого повідомлення.", pipeline.name)
+            continue
+
+        logger.info("Повідомлення з '%s' відредаговане - редагуємо наше %s.", pipeline.name, message_id)
+        METRICS.inc("edits", profile.name)
+        SEND_QUEUE.put({"target_channel_id": target_channel_id, "edit_id": message_id, "message_text": message_text})
+
+
+INGEST = IngestScheduler(
+    handler,
+    general_settings["ingest_max_depth"],
+    general_settings["ingest_max_age"],
+    general_settings["ingest_workers"],
+)
 
-            # Обробка тексту
-            message_text = process_text(message_text, config)
+METRICS.gauge("ingest_queue_depth", "Подій у черзі INGEST.", INGEST.qsize)
+METRICS.gauge("send_queue_depth", "Повідомлень у черзі SEND_QUEUE.", SEND_QUEUE.qsize)
+METRICS.gauge(
+    "shed",
+    "Подій, скинутих через перевантаження (вид:канал).",
+    lambda: {f"{kind}:{channel_id}": count for (kind, channel_id), count in INGEST.shed.items()},
+)
 
-            additional_message = ""
-            file = event.photo
+# Додаткові сесії Telegram, між якими розподіляються канали-джерела; None - усі канали слухає client
+SESSIONS = None
+if general_settings["ingest_sessions"]:
+    SESSIONS = SessionPool(
+        {
+            "user_session": client,
+            **{name: TelegramClient(name, getenv("API_ID"), getenv("API_HASH")) for name in general_settings["ingest_sessions"]},
+        },
+        ((on_new_message, events.NewMessage), (on_message_edited, events.MessageEdited)),
+    )
+    METRICS.gauge("session_channels", "Каналів-джерел на сесію.", SESSIONS.counts)
+    METRICS.gauge("unassigned_channels", "Каналів, на які не підписана жодна підключена сесія.", lambda: len(SESSIONS.unassigned))
 
-            # Блок опрацювання тривоги і відбою. Винести у функцію
-            if is_alarm_source:
 
-                if keyword == ALARM_START_KEYWORD:
-                    message_text = replace_text(message_text, config.get("replace_words", {}))
-                    state["is_alarm"] = True
-                    state["alarm_start_time"] = now
-                    # logger.debug(f"Початок тривоги о {now.strftime('%H:%M:%S')}")
+def subscribe(chats: list) -> None:
+    """
+    Перереєстровує обробники нових і відредагованих повідомлень на новий список каналів.
 
-                    reason = select_reason(state["message_stack"], now)
-                    if reason:
-                        additional_message = (f"\n<i>Ймовірна причина тривоги:\n{reason}</i>")
-                        other_reasons = format_other_reasons(state["message_stack"], reason, now)
-                    else:
-                        state["is_show_next_event"] = True
-                        additional_message = f"\n<i>Ймовірна причина тривоги не визначена.\nОчікуйте на причину в наступних повідомленнях.</i>"
+    Args:
+        chats (list): Id каналів-джерел.
 
-                elif keyword == ALARM_END_KEYWORD:
-                    message_text = replace_text(message_text, config.get("replace_words", {}))
-                    state["is_alarm"] = False
-                    hours, minutes = calculate_length_hm(now - state["alarm_start_time"])
-                    additional_message = (f"\n<i>Тривалість: {hours} г. {minutes} хв.</i>")
+    Returns:
+        None.
+    """
+    if SESSIONS is not None:
+        SESSIONS.set_channels(chats)
+        return
+    client.remove_event_handler(on_new_message)
+    client.remove_event_handler(on_message_edited)
+    client.add_event_handler(on_new_message, events.NewMessage(chats=chats))
+    client.add_event_handler(on_message_edited, events.MessageEdited(chats=chats))
 
-                message_text = f"<b>{message_text}</b>"
-                is_save_right_now = True  # Терміново зберігаємо стан, якщо ключове слово з каналу-джерела тривоги
-            # Кінець блоку опрацювання тривоги і відбою
 
-            # Додаємо мітку каналу-джерела
-            message_text += f"\n<i>({url})</i>"
+# Обробники реєструються лише через subscribe() або SessionPool, а не декоратором при імпорті,
+# інакше основна сесія слухала б усі канали поряд із сесіями, яким вони призначені
+if SESSIONS is None:
+    subscribe(list(CHANNELS))
 
-            # Перевіряємо, чи є це цитата
-            if event.is_reply and event.reply_to:
-                # Отримуємо цитоване повідомлення
-                quoted_message = await event.get_reply_message()
 
-                if quoted_message:
-                    quoted_text = process_text(quoted_message.raw_text, config)
-                    message_text = (
-                        f"<blockquote>{quoted_text}</blockquote>\n{message_text}"
-                    )
-                    logger.info(f"Цитоване повідомлення: {quoted_text}")
+def reload_config(config: dict) -> None:
+    """
+    Застосовує перезавантажену конфігурацію до працюючого бота.
 
-                    # Якщо в цитаті є зображення і власного файлу ще немає - додаємо його
-                    if quoted_message.photo and not file:
-                        file = quoted_message.photo
-                        message_text += "\n<i>Прикріплене зображення узяте з цитати.</i>"
-                        logger.info("У цитаті знайдено зображення - буде додано до повідомлення")
-                else:
-                    logger.info("Цитоване повідомлення недоступне (можливо, видалене)")
-            else:
-                logger.info("Це не цитата")
-
-            if not is_similar(
-                message_text, state["last_message"], state["last_message_time"]
-            ):
-
-                if is_forward_images and file:
-                    messages_to_send.append(
-                        {
-                            "file": file,
-                            "message_text": f"{message_text}{additional_message}",
-                            "silent": is_silent,
-                        }
-                    )
-                else:
-                    messages_to_send.append(
-                        {
-                            "message_text": f"{message_text}{additional_message}",
-                            "silent": is_silent,
-                        }
-                    )
-                logger.debug(
-                    f"Знайдено ключове слово '{keyword}' — повідомлення надіслане."
-                )
+    Args:
+        config (dict): Результат read_config.
 
-                if other_reasons:
-                    messages_to_send.append(
-                        {
-                            "message_text": f"Інші можливі причини тривоги:\n{other_reasons}",
-                            "silent": True,
-                        }
-                    )
+    Returns:
+        None.
+    """
+    old_settings = general_settings
+    old_chats = set(CHANNELS)
+    apply_config(config)
+
+    COALESCER.windows = config["coalesce_windows"]
+    if set(CHANNELS) != old_chats:
+        subscribe(list(CHANNELS))
+        logger.info("Список каналів-джерел оновлено: %s.", len(CHANNELS))
+    changed = [key for key in RESTART_SETTINGS if old_settings.get(key) != general_settings.get(key)]
+    if changed:
+        logger.warning("Зміни в %s набудуть чинності після перезапуску.", ", ".join(changed))
+
+
+CONFIG_WATCHER = ConfigWatcher(
+    (CHANNELS_JSON, SETTINGS_JSON, TRANSLATE_JSON),
+    lambda: read_config(general_settings.keys()),
+    reload_config,
+    general_settings["config_reload_interval"] or 5,
+)
+METRICS.gauge("config_reloads", "Успішних перезавантажень конфігурації.", lambda: CONFIG_WATCHER.reloads)
+METRICS.gauge("config_rejected", "Відхилених конфігурацій.", lambda: CONFIG_WATCHER.rejected)
 
-            else:
-                logger.debug(f"Повідомлення пропущене: '{message_text}' схоже на '{state["last_message"]}'.")
 
-            if not is_alarm_source:
-                state["last_message"] = (
-                    message_text  # Зберігаємо текст останнього надісланого повідомлення для майбутньої перевірки
-                )
-                state["last_message_time"] = now
-            state["message_count"] += 1
-            logger.debug(f"message_count = {state["message_count"]}")
+async def catch_up():
+    """
+    Обробляє повідомлення каналів, опубліковані поки бот не працював.
 
-            if state["message_count"] >= 10 or is_save_right_now:
-                save_state(deepcopy(client.state))
-                is_save_right_now = False
-                state["message_count"] = 0
+    Повідомлення всіх каналів завантажуються одночасно і проходять через
+    handler у порядку часу. Нові події, що надходять тим часом, чекають у
+    INGEST, а вже оброблені відсіюються за позначками last_seen.
 
-            break  # Зупиняє перебір ключових слів, якщо було хоч одне співпадіння
-    else:
-        logger.info(f"Ключових слів не знайдено.")
+    Returns:
+        None.
+    """
+    high_water = {
+        channel_id: message_id
+        for channel_id, message_id in client.state.get("last_seen", {}).items()
+        if int(channel_id) in PIPELINES
+    }
+    missed = await fetch_missed(
+        client,
+        high_water,
+        general_settings["catch_up_concurrency"],
+        general_settings["catch_up_limit"],
+        SESSIONS.client_for if SESSIONS is not None else None,
+    )
+    if not missed:
+        return
 
-    if messages_to_send:
-        await send_messages(messages_to_send)
+    logger.info("Пропущених повідомлень: %s. Обробляємо.", len(missed))
+    for message in missed:
+        await handler(message, is_catch_up=True)
+    STATE_STORE.save(client.state)
 
 
 async def main():
     await client.start()
     print(f"[INFO] [{datetime.now().strftime('%H:%M:%S')}] Бот запущений.")
-    logger.info(f"[{datetime.now().strftime('%H:%M:%S')}] Бот запущений.")
-
-    # Зчитування останнього повідомлення з каналу тривог
-    await load_alarm_state_from_channel()
-
-    await client.run_until_disconnected()
+    logger.info("Бот запущений.")
+
+    # Зчитування останнього повідомлення з каналів тривог усіх областей
+    for profile in ROUTER:
+        await load_alarm_state_from_channel(profile)
+
+    HISTORY.start()
+    sender_task = asyncio.create_task(SEND_QUEUE.run())
+    ingest_task = None
+    background_tasks = [asyncio.create_task(PROFILER.watch_loop_lag())]
+    if SESSIONS is not None:
+        # Канали розподіляються до catch_up, щоб пропущене завантажували їхні сесії
+        await SESSIONS.start()
+        SESSIONS.set_channels(list(CHANNELS))
+        background_tasks.append(asyncio.create_task(SESSIONS.run()))
+    PROFILER.install_signal()
+    if general_settings["profile_on_start"]:
+        PROFILER.trigger()
+    if general_settings["config_reload_interval"]:
+        background_tasks.append(asyncio.create_task(CONFIG_WATCHER.run()))
+    if general_settings["metrics_log_interval"]:
+        background_tasks.append(asyncio.create_task(METRICS.log_periodically(general_settings["metrics_log_interval"])))
+    metrics_server = None
+    if general_settings["metrics_port"]:
+        metrics_server = await METRICS.serve(general_settings["metrics_port"])
+    try:
+        await catch_up()
+        ingest_task = asyncio.create_task(INGEST.run())
+        await client.run_until_disconnected()
+    finally:
+        if ingest_task is not None:
+            ingest_task.cancel()
+        # Дайджести з вікон об'єднання і черга надсилання дописуються перед виходом
+        COALESCER.flush_all()
+        try:
+            await asyncio.wait_for(SEND_QUEUE.join(), general_settings["send_drain_timeout"])
+        except TimeoutError:
+            logger.warning("Не встигли надіслати до зупинки: %s повідомлень.", SEND_QUEUE.qsize())
+        sender_task.cancel()
+        await asyncio.gather(sender_task, return_exceptions=True)
+        SEND_QUEUE.dead_letter_pending()
+        for task in background_tasks:
+            task.cancel()
+        if SESSIONS is not None:
+            await SESSIONS.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        logger.info("Метрики: %s", METRICS.summary())
+        STATE_STORE.save(client.state)  # Щоб позначки каналів пережили перезапуск
+        STATE_STORE.close()
+        HISTORY.close()
+        logger.info("Кеш цитат: %s", RECENT_MESSAGES.stats())
+        if INGEST.shed:
+            logger.info("Скинуто через перевантаження: %s", dict(INGEST.shed))
 
 
 if __name__ == "__main__":
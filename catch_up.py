@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_channel(client, channel_id: int, min_id: int, limit: int, semaphore: asyncio.Semaphore) -> list:
+    """
+    Завантажує повідомлення каналу, новіші за min_id.
+
+    Args:
+        client (TelegramClient): Клієнт Telethon.
+        channel_id (int): Id каналу.
+        min_id (int): Id останнього обробленого повідомлення.
+        limit (int): Максимум повідомлень з одного каналу.
+        semaphore (asyncio.Semaphore): Обмеження кількості одночасних запитів.
+
+    Returns:
+        list: Повідомлення від старіших до новіших (порожній список при помилці).
+    """
+    async with semaphore:
+        try:
+            messages = [
+                message
+                async for message in client.iter_messages(channel_id, limit=limit, min_id=min_id)
+            ]
+        except Exception as e:
+            logger.error("Не вдалося завантажити пропущені повідомлення каналу %s: %s", channel_id, e)
+            return []
+
+    if len(messages) == limit:
+        logger.warning("Канал %s: пропущено більше %s повідомлень, найстаріші не будуть оброблені.", channel_id, limit)
+    messages.reverse()
+    return messages
+
+
+async def fetch_missed(client, high_water: dict, concurrency: int, limit: int, client_for=None) -> list:
+    """
+    Одночасно завантажує з усіх каналів повідомлення, пропущені поки бот не працював.
+
+    Канали без збереженої позначки (перший запуск) пропускаються.
+
+    Args:
+        client (TelegramClient): Клієнт Telethon.
+        high_water (dict): id каналу (str) -> id останнього обробленого повідомлення.
+        concurrency (int): Скільки каналів завантажувати одночасно.
+        limit (int): Максимум повідомлень з одного каналу.
+        client_for (callable): Id каналу -> клієнт сесії, що слухає канал; None - усі канали через client.
+            Ліміт concurrency діє окремо для кожної сесії.
+
+    Returns:
+        list: Пропущені повідомлення всіх каналів, впорядковані за часом.
+    """
+    semaphores = {}  # id клієнта -> семафор
+
+    def fetch(channel_id: int, min_id: int):
+        channel_client = client_for(channel_id) if client_for is not None else client
+        semaphore = semaphores.setdefault(id(channel_client), asyncio.Semaphore(concurrency))
+        return fetch_channel(channel_client, channel_id, min_id, limit, semaphore)
+
+    batches = await asyncio.gather(*(fetch(int(channel_id), min_id) for channel_id, min_id in high_water.items()))
+    missed = [message for batch in batches for message in batch]
+    missed.sort(key=lambda message: (message.date, message.chat_id, message.id))
+    return missed
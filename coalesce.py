@@ -0,0 +1,129 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096  # Ліміт Telegram на текст повідомлення
+DIGEST_SEPARATOR = "\n\n"
+
+
+def build_digests(messages: list, max_length=MAX_MESSAGE_LENGTH) -> list:
+    """
+    Об'єднує тексти повідомлень в один або кілька дайджестів не довших за max_length.
+
+    Повідомлення не розриваються: якщо наступне не вміщується, починається
+    новий дайджест. Дайджест тихий, лише якщо тихі всі його повідомлення.
+
+    Args:
+        messages (list): Словники повідомлень без файлів, з однаковим target_channel_id.
+        max_length (int): Максимальна довжина тексту одного дайджесту.
+
+    Returns:
+        list: Словники повідомлень-дайджестів.
+    """
+    digests = []
+    texts, silent, length = [], True, 0
+
+    for message in messages:
+        text = message["message_text"]
+        added = len(text) + (len(DIGEST_SEPARATOR) if texts else 0)
+        if texts and length + added > max_length:
+            digests.append((texts, silent))
+            texts, silent, length = [], True, 0
+            added = len(text)
+        texts.append(text)
+        silent = silent and message.get("silent", False)
+        length += added
+    if texts:
+        digests.append((texts, silent))
+
+    # Канал, пріоритет і час джерела беруться з першого повідомлення дайджесту;
+    # дайджест не прив'язаний до одного джерела, тож редагування джерел його не змінюють (див. Coalescer.discard)
+    return [
+        dict(messages[0], message_text=DIGEST_SEPARATOR.join(texts), silent=silent, source=None)
+        for texts, silent in digests
+    ]
+
+
+class Coalescer:
+    """
+    Буфер, що збирає звичайні повідомлення каналу призначення протягом
+    вікна і надсилає їх одним дайджестом.
+
+    Вікно відкривається першим повідомленням, тож перше повідомлення серії
+    затримується не більше ніж на ширину вікна. Повідомлення з файлами і
+    повідомлення в канали без вікна не об'єднуються і проходять одразу.
+    """
+
+    def __init__(self, put, windows: dict, max_length=MAX_MESSAGE_LENGTH, discard=None):
+        """
+        Args:
+            put (callable): Функція, що ставить повідомлення в чергу на надсилання.
+            windows (dict): id каналу призначення -> ширина вікна об'єднання, секунди.
+            max_length (int): Максимальна довжина тексту дайджесту.
+            discard (callable): Функція, що викликається з кожним повідомленням, об'єднаним у дайджест.
+        """
+        self.put = put
+        self.discard = discard
+        self.windows = windows
+        self.max_length = max_length
+        self.pending = {}  # id каналу призначення -> список повідомлень
+        self.timers = {}  # id каналу призначення -> asyncio.TimerHandle
+        self.merged = 0  # Скільки надсилань заощаджено
+
+    def add(self, message: dict) -> None:
+        """
+        Додає повідомлення в буфер його каналу призначення.
+
+        Args:
+            message (dict): Словник повідомлення з target_channel_id.
+
+        Returns:
+            None.
+        """
+        target_channel_id = message.get("target_channel_id")
+        window = self.windows.get(target_channel_id)
+        if not window or message.get("file"):
+            self.put(message)
+            return
+
+        self.pending.setdefault(target_channel_id, []).append(message)
+        if target_channel_id not in self.timers:
+            self.timers[target_channel_id] = asyncio.get_running_loop().call_later(
+                window, self.flush, target_channel_id
+            )
+
+    def flush(self, target_channel_id) -> None:
+        """
+        Надсилає накопичені повідомлення каналу призначення.
+
+        Args:
+            target_channel_id (int): Id каналу призначення.
+
+        Returns:
+            None.
+        """
+        timer = self.timers.pop(target_channel_id, None)
+        if timer is not None:
+            timer.cancel()
+        messages = self.pending.pop(target_channel_id, None)
+        if not messages:
+            return
+
+        if len(messages) == 1:
+            self.put(messages[0])
+            return
+
+        digests = build_digests(messages, self.max_length)
+        self.merged += len(messages) - len(digests)
+        if self.discard is not None:
+            for message in messages:
+                self.discard(message)
+        logger.info("Об'єднано %s повідомлень у %s дайджест(и).", len(messages), len(digests))
+        for digest in digests:
+            self.put(digest)
+
+    def flush_all(self) -> None:
+        for target_channel_id in list(self.pending):
+            self.flush(target_channel_id)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from os import stat
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Перезавантаження конфігурації без перезапуску бота.
+
+    Раз на interval секунд порівнює час зміни і розмір файлів конфігурації.
+    Якщо щось змінилося, load() читає, перевіряє і компілює нову конфігурацію
+    в окремому потоці, а apply() підставляє готову конфігурацію в циклі
+    подій одним синхронним викликом, тож обробка подій не зупиняється.
+    Конфігурація, яку не вдалося завантажити або застосувати, відхиляється,
+    а бот працює далі зі старою.
+    """
+
+    def __init__(self, paths, load, apply, interval=5.0):
+        """
+        Args:
+            paths (iterable): Шляхи до файлів конфігурації.
+            load (callable): Читає і компілює конфігурацію; викликається в окремому потоці.
+            apply (callable): Підставляє скомпільовану конфігурацію; викликається в циклі подій.
+            interval (float): Період перевірки файлів у секундах.
+        """
+        self.paths = tuple(paths)
+        self.load = load
+        self.apply = apply
+        self.interval = interval
+        self.stamps = self._stamps()
+        self.reloads = 0  # Успішних перезавантажень
+        self.rejected = 0  # Відхилених конфігурацій
+
+    def _stamps(self) -> tuple:
+        stamps = []
+        for file_path in self.paths:
+            try:
+                file_stat = stat(file_path)
+                stamps.append((file_stat.st_mtime_ns, file_stat.st_size))
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    async def run(self) -> None:
+        """
+        Перевіряє файли, доки корутину не скасують.
+
+        Returns:
+            None.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            stamps = self._stamps()
+            if stamps != self.stamps:
+                self.stamps = stamps
+                await self.reload()
+
+    async def reload(self) -> bool:
+        """
+        Завантажує і застосовує нову конфігурацію.
+
+        Returns:
+            bool: True, якщо нову конфігурацію застосовано.
+        """
+        try:
+            config = await asyncio.to_thread(self.load)
+            self.apply(config)
+        except Exception as e:
+            self.rejected += 1
+            logger.error("Нова конфігурація відхилена, працюємо зі старою: %s: %s", type(e).__name__, e)
+            return False
+
+        self.reloads += 1
+        logger.info("Конфігурацію перезавантажено.")
+        return True
@@ -0,0 +1,262 @@
+import re
+from array import array
+from collections import deque
+from datetime import datetime
+from hashlib import blake2b
+
+from matcher import make_set
+
+
+# Службові частини нашого тексту: курсив (мітка каналу, примітка про зображення) і посилання.
+# Вони однакові в усіх постах каналу, тож лише завищували б схожість непов'язаних повідомлень
+NOISE_RE = re.compile(r"<i>.*?</i>|https?://\S+|www\.\S+|t\.me/\S+|@\w+", re.DOTALL)
+TAG_RE = re.compile(r"<[^>]+>")
+WORD_RE = re.compile(r"\w+")
+
+
+def match_rate(set1: set, set2: set) -> float:
+    """
+    Частка спільних населених пунктів двох повідомлень.
+
+    Args:
+        set1 (set): Населені пункти повідомлення 1.
+        set2 (set): Населені пункти повідомлення 2.
+
+    Returns:
+        float: |set1 ∩ set2| / max(|set1|, |set2|), 0 якщо якась множина порожня.
+    """
+    if not set1 or not set2:
+        return 0.0
+    return len(set1 & set2) / max(len(set1), len(set2))
+
+
+class DedupFeatures:
+    """Ознаки повідомлення: населені пункти і шингли, з яких за потреби рахується MinHash-підпис."""
+
+    __slots__ = ("localities", "shingles", "signature")
+
+    def __init__(self, localities: frozenset, shingles: set):
+        self.localities = localities
+        self.shingles = shingles
+        self.signature = None  # Обчислюється в DedupIndex.sign(), лише коли потрібен
+
+
+class DedupEntry:
+    """Повідомлення у вікні дедуплікації."""
+
+    __slots__ = ("time", "text", "features")
+
+    def __init__(self, time: datetime, text: str, features: DedupFeatures):
+        self.time = time
+        self.text = text
+        self.features = features
+
+
+class DedupIndex:
+    """
+    Індекс схожих повідомлень за останні ttl секунд.
+
+    Повідомлення вважається дублікатом, якщо:
+    - обидва повідомлення містять населені пункти і частка спільних
+      не менша за locality_threshold (як у попередньому is_similar);
+    - або хоч одне не містить населених пунктів, а оцінка схожості
+      Жаккара їхніх MinHash-підписів слів не менша за text_threshold.
+
+    Кандидати шукаються через інвертований індекс населених пунктів і
+    LSH-кошики MinHash, тож пошук не перебирає все вікно. Підпис потрібен
+    лише для пар, де хоч в одного повідомлення немає населених пунктів,
+    тож він обчислюється ледачо: для повідомлення з населеними пунктами -
+    лише коли у вікні є повідомлення без них, а для записів вікна - лише
+    коли надходить повідомлення без населених пунктів.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        region_matcher,
+        locality_threshold=0.7,
+        text_threshold=0.6,
+        num_perm=32,
+        bands=8,
+        region_owner=None,
+    ):
+        """
+        Args:
+            ttl (float): Ширина вікна в секундах.
+            region_matcher (MultiMatcher): Матчер з населеними пунктами області.
+            locality_threshold (float): Поріг частки спільних населених пунктів.
+            text_threshold (float): Поріг схожості тексту за MinHash.
+            num_perm (int): Довжина MinHash-підпису, не більше 32.
+            bands (int): Кількість LSH-смуг (num_perm має ділитися на bands).
+            region_owner: Власник списку населених пунктів області в матчері.
+        """
+        self.ttl = ttl
+        self.region_matcher = region_matcher
+        self.region_owner = region_owner
+        self.locality_threshold = locality_threshold
+        self.text_threshold = text_threshold
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.num_perm = num_perm
+        self.entries = deque()  # У порядку часу додавання
+        self.by_locality = {}  # населений пункт -> set(DedupEntry)
+        self.buckets = {}  # (номер смуги, значення смуги) -> set(DedupEntry)
+        self.unsigned = set()  # Записи з населеними пунктами, чий підпис ще не обчислено і не в кошиках
+        self.plain = 0  # Записів без населених пунктів
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def describe(self, text: str) -> DedupFeatures:
+        """
+        Обчислює ознаки повідомлення для пошуку і додавання.
+
+        Args:
+            text (str): Текст повідомлення (може містити html).
+
+        Returns:
+            DedupFeatures: Населені пункти і шингли тексту без службових частин.
+        """
+        text = NOISE_RE.sub(" ", text or "")
+        localities = frozenset(make_set(text, self.region_matcher, self.region_owner))
+        words = WORD_RE.findall(TAG_RE.sub(" ", text).lower())
+        # Шингли - слова і пари сусідніх слів
+        shingles = set(words)
+        shingles.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+        return DedupFeatures(localities, shingles)
+
+    def sign(self, features: DedupFeatures) -> tuple:
+        """
+        Повертає MinHash-підпис ознак, обчислюючи його при першому зверненні.
+
+        blake2b замість hash(), щоб підписи не залежали від PYTHONHASHSEED.
+
+        Args:
+            features (DedupFeatures): Результат describe().
+
+        Returns:
+            tuple: Підпис або (), якщо в тексті немає слів.
+        """
+        if features.signature is None:
+            # Кожен шингл хешується один раз: дайджест blake2b - це num_perm 16-бітних хешів поспіль,
+            # тож i-й хеш усіх шинглів - зріз масиву з кроком num_perm, і мінімум рахує C-код
+            num_perm = self.num_perm
+            hashes = array("H")
+            for shingle in features.shingles:
+                hashes.frombytes(blake2b(shingle.encode(), digest_size=2 * num_perm).digest())
+            features.signature = tuple([min(hashes[i::num_perm]) for i in range(num_perm)]) if hashes else ()
+        return features.signature
+
+    def _band_keys(self, signature: tuple):
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def _index_signature(self, entry: DedupEntry) -> None:
+        signature = self.sign(entry.features)
+        if signature:
+            for key in self._band_keys(signature):
+                self.buckets.setdefault(key, set()).add(entry)
+
+    def _sign_unsigned(self) -> None:
+        # Повідомлення без населених пунктів порівнюється з усім вікном за підписом
+        for entry in self.unsigned:
+            self._index_signature(entry)
+        self.unsigned.clear()
+
+    def expire(self, now: datetime) -> None:
+        """
+        Видаляє з індексу повідомлення, старші за ttl.
+
+        Args:
+            now (datetime): Поточний час.
+
+        Returns:
+            None.
+        """
+        while self.entries and (now - self.entries[0].time).total_seconds() > self.ttl:
+            entry = self.entries.popleft()
+            features = entry.features
+            for locality in features.localities:
+                bucket = self.by_locality[locality]
+                bucket.discard(entry)
+                if not bucket:
+                    del self.by_locality[locality]
+            if not features.localities:
+                self.plain -= 1
+            if entry in self.unsigned:
+                self.unsigned.discard(entry)
+            elif features.signature:
+                for key in self._band_keys(features.signature):
+                    bucket = self.buckets[key]
+                    bucket.discard(entry)
+                    if not bucket:
+                        del self.buckets[key]
+
+    def find(self, features: tuple, now: datetime):
+        """
+        Шукає у вікні повідомлення, схоже на задане.
+
+        Args:
+            features (DedupFeatures): Результат describe().
+            now (datetime): Поточний час.
+
+        Returns:
+            DedupEntry | None: Найсхожіше повідомлення або None.
+        """
+        self.expire(now)
+        localities = features.localities
+
+        candidates = set()
+        for locality in localities:
+            candidates.update(self.by_locality.get(locality, ()))
+        # Якщо в обох повідомлень є населені пункти, вирішує їхня частка, і підпис не потрібен
+        signature = ()
+        if not localities:
+            self._sign_unsigned()
+            signature = self.sign(features)
+        elif self.plain:
+            signature = self.sign(features)
+        if signature:
+            for key in self._band_keys(signature):
+                candidates.update(self.buckets.get(key, ()))
+
+        best, best_score = None, 0.0
+        for entry in candidates:
+            entry_features = entry.features
+            if localities and entry_features.localities:
+                score = match_rate(localities, entry_features.localities)
+                threshold = self.locality_threshold
+            elif signature and entry_features.signature:
+                score = sum(x == y for x, y in zip(signature, entry_features.signature)) / len(signature)
+                threshold = self.text_threshold
+            else:
+                continue
+            if score >= threshold and score > best_score:
+                best, best_score = entry, score
+
+        return best
+
+    def add(self, text: str, features: tuple, now: datetime) -> None:
+        """
+        Додає повідомлення у вікно.
+
+        Args:
+            text (str): Текст повідомлення.
+            features (DedupFeatures): Результат describe() для цього тексту.
+            now (datetime): Час повідомлення.
+
+        Returns:
+            None.
+        """
+        entry = DedupEntry(now, text, features)
+        self.entries.append(entry)
+        for locality in features.localities:
+            self.by_locality.setdefault(locality, set()).add(entry)
+        if not features.localities:
+            self.plain += 1
+            self._index_signature(entry)
+        elif features.signature is None:
+            self.unsigned.add(entry)
+        else:
+            self._index_signature(entry)
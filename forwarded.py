@@ -0,0 +1,158 @@
+import hashlib
+
+
+def fingerprint(text: str) -> str:
+    """
+    Короткий відбиток тексту, щоб не зберігати в стані самі тексти.
+
+    Args:
+        text (str): Текст повідомлення.
+
+    Returns:
+        str: 16 шістнадцяткових символів.
+    """
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class ForwardedPosts:
+    """
+    Відповідність повідомлень каналів-джерел нашим надісланим повідомленням.
+
+    Записи зберігаються в словнику стану (тому переживають перезапуск) у
+    порядку додавання; понад max_entries витісняються найстаріші. Кожен
+    запис - [id каналу призначення, id нашого повідомлення, відбиток тексту].
+    Записи лише замінюються, а не змінюються на місці, бо StateStore
+    порівнює поверхневі копії.
+    """
+
+    def __init__(self, entries: dict, max_entries: int):
+        """
+        Args:
+            entries (dict): Словник зі стану: "id каналу:id повідомлення" -> запис.
+            max_entries (int): Максимальна кількість записів.
+        """
+        self.entries = entries
+        self.max_entries = max_entries
+        # Поставлені в чергу, але ще не надіслані повідомлення: "id каналу:id повідомлення" -> словник
+        # повідомлення. Лише в пам'яті: після перезапуску черги надсилання вже немає
+        self.queued = {}
+        # Повідомлення, об'єднані в дайджест: "id каналу:id повідомлення" -> None. Дайджест не
+        # редагується, тож ці ключі потрібні лише, щоб чесно записати в лог, чому редагування пропущене
+        self.digested = {}
+
+    @staticmethod
+    def _key(chat_id, message_id) -> str:
+        return f"{chat_id}:{message_id}"
+
+    def remember(self, source: tuple, target_channel_id, message_id, text: str) -> None:
+        """
+        Запам'ятовує наше повідомлення, надіслане у відповідь на повідомлення джерела.
+
+        Args:
+            source (tuple): (id каналу-джерела, id повідомлення джерела).
+            target_channel_id (int): Id каналу призначення.
+            message_id (int): Id нашого повідомлення.
+            text (str): Надісланий текст.
+
+        Returns:
+            None.
+        """
+        key = self._key(*source)
+        self.queued.pop(key, None)
+        self.entries.pop(key, None)
+        self.entries[key] = [target_channel_id, message_id, fingerprint(text)]
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def expect(self, source: tuple, message: dict) -> None:
+        """
+        Запам'ятовує повідомлення, поставлене в чергу у відповідь на повідомлення
+        джерела, щоб редагування джерела до надсилання змінило текст у черзі.
+
+        Args:
+            source (tuple): (id каналу-джерела, id повідомлення джерела).
+            message (dict): Словник повідомлення в черзі.
+
+        Returns:
+            None.
+        """
+        key = self._key(*source)
+        self.queued.pop(key, None)
+        self.queued[key] = message
+        while len(self.queued) > self.max_entries:
+            del self.queued[next(iter(self.queued))]
+
+    def forget(self, source: tuple, message: dict, is_digested=False) -> None:
+        """
+        Прибирає повідомлення з черги очікування, коли воно вже не буде
+        надіслане окремо: його об'єднано в дайджест або відкинуто.
+
+        Args:
+            source (tuple): (id каналу-джерела, id повідомлення джерела).
+            message (dict): Словник повідомлення, переданий у expect.
+            is_digested (bool): Чи об'єднано повідомлення в дайджест.
+
+        Returns:
+            None.
+        """
+        key = self._key(*source)
+        if self.queued.get(key) is message:
+            del self.queued[key]
+        if is_digested:
+            self.digested.pop(key, None)
+            self.digested[key] = None
+            while len(self.digested) > self.max_entries:
+                del self.digested[next(iter(self.digested))]
+
+    def pending(self, chat_id, message_id):
+        """
+        Args:
+            chat_id (int): Id каналу-джерела.
+            message_id (int): Id повідомлення джерела.
+
+        Returns:
+            dict | None: Словник ще не надісланого повідомлення або None.
+        """
+        return self.queued.get(self._key(chat_id, message_id))
+
+    def is_digested(self, chat_id, message_id) -> bool:
+        """
+        Args:
+            chat_id (int): Id каналу-джерела.
+            message_id (int): Id повідомлення джерела.
+
+        Returns:
+            bool: True, якщо повідомлення надіслане в складі дайджесту.
+        """
+        return self._key(chat_id, message_id) in self.digested
+
+    def get(self, chat_id, message_id):
+        """
+        Args:
+            chat_id (int): Id каналу-джерела.
+            message_id (int): Id повідомлення джерела.
+
+        Returns:
+            list | None: [id каналу призначення, id нашого повідомлення, відбиток тексту] або None.
+        """
+        return self.entries.get(self._key(chat_id, message_id))
+
+    def update_text(self, chat_id, message_id, text: str) -> bool:
+        """
+        Оновлює відбиток тексту, якщо він змінився.
+
+        Args:
+            chat_id (int): Id каналу-джерела.
+            message_id (int): Id повідомлення джерела.
+            text (str): Новий текст нашого повідомлення.
+
+        Returns:
+            bool: True, якщо текст змінився і наше повідомлення треба редагувати.
+        """
+        key = self._key(chat_id, message_id)
+        entry = self.entries.get(key)
+        new_fingerprint = fingerprint(text)
+        if entry is None or entry[2] == new_fingerprint:
+            return False
+        self.entries[key] = [entry[0], entry[1], new_fingerprint]
+        return True
@@ -0,0 +1,353 @@
+"""
+Історія подій бота в SQLite: тривоги, переслані повідомлення і відкинуті дублікати.
+
+Бот лише ставить записи в чергу; окремий потік пише їх пачками, по одній
+транзакції на пачку, тож handler не робить синхронного вводу-виводу.
+
+Звіти:
+    python history.py alarms --by week
+    python history.py reasons --top 10
+    python history.py forwarded --by day
+    python history.py duplicates --top 10
+"""
+
+import argparse
+import logging
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from time import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = "history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alarms (
+    id INTEGER PRIMARY KEY,
+    region TEXT NOT NULL,
+    started_at TEXT,
+    ended_at TEXT,
+    duration REAL,
+    reason TEXT,
+    reason_source TEXT
+);
+CREATE INDEX IF NOT EXISTS alarms_region_started ON alarms (region, started_at);
+CREATE INDEX IF NOT EXISTS alarms_started ON alarms (started_at);
+
+CREATE TABLE IF NOT EXISTS forwarded (
+    id INTEGER PRIMARY KEY,
+    sent_at TEXT NOT NULL,
+    region TEXT NOT NULL,
+    source_channel_id INTEGER,
+    source_message_id INTEGER,
+    target_channel_id INTEGER NOT NULL,
+    message_id INTEGER,
+    delivery_lag REAL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS forwarded_sent ON forwarded (sent_at);
+CREATE INDEX IF NOT EXISTS forwarded_source_sent ON forwarded (source_channel_id, sent_at);
+
+CREATE TABLE IF NOT EXISTS duplicates (
+    id INTEGER PRIMARY KEY,
+    seen_at TEXT NOT NULL,
+    region TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER,
+    text TEXT,
+    original_at TEXT,
+    original_text TEXT
+);
+CREATE INDEX IF NOT EXISTS duplicates_seen ON duplicates (seen_at);
+CREATE INDEX IF NOT EXISTS duplicates_channel_seen ON duplicates (channel_id, seen_at);
+"""
+
+INSERT = {
+    "alarm_started": "INSERT INTO alarms (region, started_at, reason, reason_source) VALUES (?, ?, ?, ?)",
+    "forwarded": (
+        "INSERT INTO forwarded (sent_at, region, source_channel_id, source_message_id, target_channel_id, "
+        "message_id, delivery_lag, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    "duplicate": (
+        "INSERT INTO duplicates (seen_at, region, channel_id, message_id, text, original_at, original_text) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)"
+    ),
+}
+
+# Відбій закриває останню відкриту тривогу області; якщо її немає (початок не записано) - додається повний запис
+CLOSE_ALARM = (
+    "UPDATE alarms SET ended_at = ?, duration = ? "
+    "WHERE id = (SELECT max(id) FROM alarms WHERE region = ? AND ended_at IS NULL)"
+)
+INSERT_CLOSED_ALARM = "INSERT INTO alarms (region, started_at, ended_at, duration) VALUES (?, ?, ?, ?)"
+
+
+def isoformat(time) -> str | None:
+    return time.isoformat(timespec="seconds") if time is not None else None
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class HistoryStore:
+    """
+    Запис історії подій у SQLite окремим потоком.
+
+    Методи запису лише ставлять рядок у чергу. Потік запису забирає з черги
+    до batch_size записів (або все, що надійшло за flush_interval секунд) і
+    записує їх однією транзакцією. Порожній шлях до бази вимикає історію.
+    """
+
+    def __init__(self, db_path: str, batch_size=100, flush_interval=2.0):
+        """
+        Args:
+            db_path (str): Шлях до файлу SQLite ("" - не записувати історію).
+            batch_size (int): Максимальна кількість записів в одній транзакції.
+            flush_interval (float): Скільки секунд чекати на наповнення пачки.
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.thread = None
+        self.written = 0  # Записано рядків з моменту старту
+
+    def start(self) -> None:
+        if self.db_path and self.thread is None:
+            self.thread = threading.Thread(target=self._writer, daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        """
+        Дописує чергу і зупиняє потік запису.
+
+        Returns:
+            None.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _put(self, kind: str, params: tuple) -> None:
+        if self.thread is not None:
+            self.queue.put((kind, params))
+
+    def alarm_started(self, region: str, started_at: datetime, reason: str, reason_source: str) -> None:
+        """
+        Args:
+            region (str): Назва області.
+            started_at (datetime): Початок тривоги.
+            reason (str): Обрана причина тривоги ("" - не визначена).
+            reason_source (str): Канал, з якого взято причину.
+        """
+        self._put("alarm_started", (region, isoformat(started_at), reason or None, reason_source or None))
+
+    def alarm_ended(self, region: str, started_at: datetime, ended_at: datetime) -> None:
+        """
+        Args:
+            region (str): Назва області.
+            started_at (datetime): Початок тривоги зі стану бота.
+            ended_at (datetime): Відбій.
+        """
+        duration = (ended_at - started_at).total_seconds()
+        self._put("alarm_ended", (region, isoformat(started_at), isoformat(ended_at), duration))
+
+    def forwarded(
+        self,
+        sent_at: datetime,
+        region: str,
+        source,
+        target_channel_id: int,
+        message_id: int,
+        delivery_lag,
+        text: str,
+    ) -> None:
+        """
+        Args:
+            sent_at (datetime): Час надсилання.
+            region (str): Назва області.
+            source (tuple | None): (id каналу-джерела, id повідомлення джерела) або None для тривог і дайджестів.
+            target_channel_id (int): Канал призначення.
+            message_id (int): Id нашого повідомлення.
+            delivery_lag (float | None): Секунди від публікації джерела до надсилання.
+            text (str): Надісланий текст.
+        """
+        source_channel_id, source_message_id = source or (None, None)
+        self._put(
+            "forwarded",
+            (isoformat(sent_at), region, source_channel_id, source_message_id, target_channel_id, message_id, delivery_lag, text),
+        )
+
+    def duplicate(
+        self,
+        seen_at: datetime,
+        region: str,
+        channel_id: int,
+        message_id: int,
+        text: str,
+        original_at: datetime,
+        original_text: str,
+    ) -> None:
+        """
+        Args:
+            seen_at (datetime): Час обробки дубліката.
+            region (str): Назва області.
+            channel_id (int): Канал-джерело дубліката.
+            message_id (int): Id повідомлення джерела.
+            text (str): Текст дубліката.
+            original_at (datetime): Час надісланого повідомлення, на яке він схожий.
+            original_text (str): Текст надісланого повідомлення.
+        """
+        self._put(
+            "duplicate",
+            (isoformat(seen_at), region, channel_id, message_id, text, isoformat(original_at), original_text),
+        )
+
+    def _next_batch(self) -> list:
+        batch = [self.queue.get()]
+        deadline = monotonic() + self.flush_interval
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer(self) -> None:
+        try:
+            connection = connect(self.db_path)
+        except sqlite3.Error as e:
+            logger.error("Не вдалося відкрити базу історії %s: %s", self.db_path, e)
+            # Черга все одно розбирається, щоб close() не чекав вічно
+            while self.queue.get() is not None:
+                pass
+            return
+
+        while True:
+            batch = self._next_batch()
+            records = [record for record in batch if record is not None]
+            try:
+                with connection:
+                    for kind, params in records:
+                        self._execute(connection, kind, params)
+                self.written += len(records)
+            except sqlite3.Error as e:
+                logger.error("Помилка запису історії (%s записів втрачено): %s", len(records), e)
+            if batch[-1] is None:
+                connection.close()
+                return
+
+    @staticmethod
+    def _execute(connection: sqlite3.Connection, kind: str, params: tuple) -> None:
+        if kind == "alarm_ended":
+            region, started_at, ended_at, duration = params
+            if connection.execute(CLOSE_ALARM, (ended_at, duration, region)).rowcount == 0:
+                connection.execute(INSERT_CLOSED_ALARM, (region, started_at, ended_at, duration))
+            return
+        connection.execute(INSERT[kind], params)
+
+
+# Звіти CLI: strftime-формат групування для --by
+PERIODS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+
+def report_alarms(connection, period: str, region, since) -> list:
+    return connection.execute(
+        f"""
+        SELECT region, strftime('{PERIODS[period]}', started_at) AS period, count(*),
+               round(avg(duration) / 60, 1), round(max(duration) / 60, 1)
+        FROM alarms
+        WHERE duration IS NOT NULL AND (:region IS NULL OR region = :region) AND (:since IS NULL OR started_at >= :since)
+        GROUP BY region, period ORDER BY region, period
+        """,
+        {"region": region, "since": since},
+    ).fetchall()
+
+
+def report_reasons(connection, top: int, region, since) -> list:
+    return connection.execute(
+        """
+        SELECT coalesce(reason_source, '(не визначена)'), count(*)
+        FROM alarms
+        WHERE (:region IS NULL OR region = :region) AND (:since IS NULL OR started_at >= :since)
+        GROUP BY reason_source ORDER BY count(*) DESC LIMIT :top
+        """,
+        {"region": region, "since": since, "top": top},
+    ).fetchall()
+
+
+def report_forwarded(connection, period: str, region, since) -> list:
+    return connection.execute(
+        f"""
+        SELECT strftime('{PERIODS[period]}', sent_at) AS period, source_channel_id, count(*),
+               round(avg(delivery_lag), 2)
+        FROM forwarded
+        WHERE (:region IS NULL OR region = :region) AND (:since IS NULL OR sent_at >= :since)
+        GROUP BY period, source_channel_id ORDER BY period, count(*) DESC
+        """,
+        {"region": region, "since": since},
+    ).fetchall()
+
+
+def report_duplicates(connection, top: int, region, since) -> list:
+    return connection.execute(
+        """
+        SELECT channel_id, count(*)
+        FROM duplicates
+        WHERE (:region IS NULL OR region = :region) AND (:since IS NULL OR seen_at >= :since)
+        GROUP BY channel_id ORDER BY count(*) DESC LIMIT :top
+        """,
+        {"region": region, "since": since, "top": top},
+    ).fetchall()
+
+
+REPORTS = {
+    "alarms": (
+        report_alarms,
+        ("область", "період", "тривог", "сер. хв", "макс. хв"),
+    ),
+    "reasons": (report_reasons, ("канал причини", "тривог")),
+    "forwarded": (report_forwarded, ("період", "канал-джерело", "надіслано", "сер. затримка, с")),
+    "duplicates": (report_duplicates, ("канал", "дублікатів")),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Звіти з історії подій бота.")
+    parser.add_argument("--db", default=HISTORY_DB, help="файл бази історії")
+    parser.add_argument("--region", default=None, help="лише ця область (\"\" - область за замовчуванням)")
+    parser.add_argument("--since", default=None, help="лише події після цієї дати (YYYY-MM-DD)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("alarms", "forwarded"):
+        command = commands.add_parser(name)
+        command.add_argument("--by", choices=sorted(PERIODS), default="week")
+    for name in ("reasons", "duplicates"):
+        command = commands.add_parser(name)
+        command.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    report, header = REPORTS[args.command]
+    grouping = args.by if args.command in ("alarms", "forwarded") else args.top
+    connection = connect(args.db)
+    try:
+        rows = report(connection, grouping, args.region, args.since)
+    finally:
+        connection.close()
+
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+if __name__ == "__main__":
+    main()
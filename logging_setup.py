@@ -0,0 +1,103 @@
+import atexit
+import logging
+import queue
+from datetime import datetime
+from os import path, makedirs
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+LOG_DATEFMT = "%H:%M:%S"
+
+_listener = None
+
+
+class DailyFileHandler(TimedRotatingFileHandler):
+    """Обробник логів, який щодня створює новий файл виду log_yyyy-mm-dd.log"""
+
+    def __init__(self, log_dir="logs"):
+        self.log_dir = log_dir
+        makedirs(self.log_dir, exist_ok=True)
+        super().__init__(self._build_filename(), when="midnight", interval=1, encoding="utf-8")
+
+    def _build_filename(self):
+        return path.join(self.log_dir, f"log_{datetime.now().strftime('%Y-%m-%d')}.log")
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+        self.baseFilename = self._build_filename()
+        self.stream = self._open()
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler, що не форматує запис у потоці, який логує.
+
+    Стандартний prepare() підставляє аргументи в повідомлення ще до черги;
+    тут це робить форматер QueueListener у фоновому потоці. Аргументи логів
+    тому не слід змінювати після виклику logger.*.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(is_async=True, level="DEBUG", levels=None) -> None:
+    """
+    Налаштовує логування у файл logs/log_yyyy-mm-dd.log.
+
+    В асинхронному режимі обробник кореневого логера лише кладе записи в
+    чергу, а форматування і запис у файл виконує QueueListener в окремому
+    потоці, тож затримки диска не блокують цикл подій Telethon. Повторний
+    виклик замінює попередні налаштування.
+
+    Args:
+        is_async (bool): Писати логи через чергу у фоновому потоці.
+        level (str): Рівень кореневого логера.
+        levels (dict): Рівні окремих підсистем, наприклад {"sender": "INFO"}.
+
+    Returns:
+        None.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    file_handler = DailyFileHandler()
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    if is_async:
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(LazyQueueHandler(log_queue))
+    else:
+        root.addHandler(file_handler)
+
+    root.setLevel(level)
+    for name, subsystem_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+
+def stop_logging() -> None:
+    """
+    Дописує в файл усі записи з черги і зупиняє фоновий потік логування.
+
+    Returns:
+        None.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
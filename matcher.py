@@ -0,0 +1,199 @@
+from collections import deque
+
+
+# Види списків, за якими будується спільний матчер
+KEYWORD = "keyword"
+STOP_WORD = "stop_word"
+NOT_A_REASON = "not_a_reason"
+REGION = "region"
+
+
+class MatchResult:
+    """Усі збіги одного проходу по тексту, згруповані за видом списку."""
+
+    __slots__ = ("tags",)
+
+    def __init__(self, tags=()):
+        self.tags = tags  # Набір (вид, власник, порядковий номер, шаблон)
+
+    def has(self, kind: str, owner=None) -> bool:
+        """
+        Перевіряє, чи є хоч один збіг зі списку.
+
+        Args:
+            kind (str): Вид списку (KEYWORD, STOP_WORD, ...).
+            owner: Власник списку (id каналу) або None для загальних списків.
+
+        Returns:
+            bool: True, якщо є збіг.
+        """
+        return any(tag[0] == kind and tag[1] == owner for tag in self.tags)
+
+    def values(self, kind: str, owner=None) -> set:
+        """
+        Повертає множину шаблонів зі списку, знайдених у тексті.
+
+        Args:
+            kind (str): Вид списку.
+            owner: Власник списку (id каналу) або None для загальних списків.
+
+        Returns:
+            set: Знайдені шаблони.
+        """
+        return {tag[3] for tag in self.tags if tag[0] == kind and tag[1] == owner}
+
+    def first(self, kind: str, owner=None):
+        """
+        Повертає знайдений шаблон, що стоїть першим у списку (як при переборі списку по порядку).
+
+        Args:
+            kind (str): Вид списку.
+            owner: Власник списку (id каналу) або None для загальних списків.
+
+        Returns:
+            str | None: Шаблон або None, якщо збігів немає.
+        """
+        found = [tag for tag in self.tags if tag[0] == kind and tag[1] == owner]
+        return min(found, key=lambda tag: tag[2])[3] if found else None
+
+
+class MultiMatcher:
+    """
+    Автомат Ахо-Корасік над усіма списками шаблонів одночасно.
+
+    Один прохід по тексту знаходить усі входження всіх шаблонів, тому
+    вартість пошуку залежить від довжини тексту, а не від кількості
+    ключових слів, стоп-слів і населених пунктів. Шаблони шукаються як
+    підрядки, так само як `шаблон in text`.
+    """
+
+    __slots__ = ("goto", "fail", "outputs", "always", "size")
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (iterable): Пари (шаблон, тег), тег - кортеж (вид, власник, номер, шаблон).
+        """
+        self.goto = [{}]  # Переходи вузлів бору
+        self.fail = [0]  # Найдовший власний суфікс вузла, що теж є вузлом бору
+        self.outputs = [()]  # Теги шаблонів, що закінчуються у вузлі (разом з суфіксами)
+        always = []  # Порожній шаблон входить у будь-який текст
+        self.size = 0
+
+        for pattern, tag in patterns:
+            self.size += 1
+            if not pattern:
+                always.append(tag)
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                node = next_node
+            self.outputs[node] += (tag,)
+
+        self.always = tuple(always)
+        self._build()
+
+    def _build(self) -> None:
+        fail = self.fail
+        queue = deque(self.goto[0].values())
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in self.goto[state]:
+                    state = fail[state]
+                fail[child] = self.goto[state].get(char, 0)
+                self.outputs[child] += self.outputs[fail[child]]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def scan(self, text: str) -> MatchResult:
+        """
+        Знаходить усі шаблони, що входять у текст.
+
+        Args:
+            text (str): Текст (вже в нижньому регістрі, якщо шаблони в нижньому регістрі).
+
+        Returns:
+            MatchResult: Збіги, згруповані за тегами.
+        """
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        tags = set(self.always)
+        node = 0
+
+        for char in text or "":
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                tags.update(outputs[node])
+
+        return MatchResult(tags)
+
+
+def build_matcher(channels: dict, not_a_reason_list, region_list, keyword_overrides=None) -> MultiMatcher:
+    """
+    Будує один матчер над ключовими словами і стоп-словами всіх каналів,
+    а також над списками not_a_reason і region.
+
+    Args:
+        channels (dict): Словник id каналу -> ChannelPipeline.
+        not_a_reason_list (list): Слова, що виключають повідомлення з причин тривоги.
+        region_list (list | dict): Назви населених пунктів області або словник
+            власник -> назви населених пунктів (по одному списку на область).
+        keyword_overrides (dict): Власник -> ключові слова, що замінюють ключові
+            слова каналу для однієї області.
+
+    Returns:
+        MultiMatcher: Готовий матчер.
+    """
+    region_lists = region_list if isinstance(region_list, dict) else {None: region_list}
+
+    def patterns():
+        for channel_id, pipeline in channels.items():
+            for index, keyword in enumerate(pipeline.keywords):
+                yield keyword, (KEYWORD, channel_id, index, keyword)
+            for index, stop_word in enumerate(pipeline.stop_words):
+                yield stop_word, (STOP_WORD, channel_id, index, stop_word)
+        for owner, keywords in (keyword_overrides or {}).items():
+            for index, keyword in enumerate(keywords):
+                yield keyword, (KEYWORD, owner, index, keyword)
+        for index, word in enumerate(not_a_reason_list):
+            yield word, (NOT_A_REASON, None, index, word)
+        for owner, localities in region_lists.items():
+            for index, locality in enumerate(localities):
+                yield locality, (REGION, owner, index, locality)
+
+    return MultiMatcher(patterns())
+
+
+def make_set(message: str, region_list, owner=None) -> set:
+    """
+    Перетворює рядок на множину, використовуючи заданий масив назв населених пунктів.
+
+    Args:
+        message (str): Повідомлення.
+        region_list (list | MultiMatcher): Назви населених пунктів або готовий матчер.
+        owner: Власник списку населених пунктів у матчері (None - список за замовчуванням).
+
+    Returns:
+        set: Множина з унікальними словами - назвами населених пунктів.
+    """
+    if not hasattr(region_list, "scan"):
+        region_list = MultiMatcher(
+            (locality, (REGION, owner, index, locality)) for index, locality in enumerate(region_list)
+        )
+
+    return region_list.scan(message.lower()).values(REGION, owner)
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+
+
+class CachedMessage:
+    """Повідомлення каналу, яке бот уже бачив."""
+
+    __slots__ = ("raw_text", "processed", "processed_by", "photo")
+
+    def __init__(self, raw_text: str, photo):
+        self.raw_text = raw_text
+        self.processed = None  # LineView опрацьованого тексту, заповнюється при першій обробці
+        self.processed_by = None  # Конвеєр каналу, яким опрацьовано текст
+        self.photo = photo
+
+    def process(self, pipeline):
+        """
+        Опрацьований текст повідомлення, обчислений один раз для конвеєра каналу.
+
+        Після перезавантаження конфігурації конвеєр каналу - новий об'єкт, тож
+        текст опрацьовується заново з новими замінами і перекладом, навіть якщо
+        старий результат записав обробник, що почався до перезавантаження.
+
+        Args:
+            pipeline (ChannelPipeline): Конвеєр каналу.
+
+        Returns:
+            LineView: Опрацьований текст.
+        """
+        if self.processed is None or self.processed_by is not pipeline:
+            self.processed = pipeline.process_lines(self.raw_text)
+            self.processed_by = pipeline
+        return self.processed
+
+
+class RecentMessages:
+    """
+    LRU-кеш нещодавніх повідомлень кожного каналу за id повідомлення.
+
+    Цитоване повідомлення зазвичай прийшло через той самий обробник кілька
+    секунд тому, тож відповідь на нього можна зібрати без get_reply_message.
+    Кожен канал обмежений кількістю повідомлень і сумарною довжиною тексту.
+    """
+
+    def __init__(self, max_entries: int, max_chars: int):
+        """
+        Args:
+            max_entries (int): Максимум повідомлень у кеші одного каналу.
+            max_chars (int): Максимальна сумарна довжина текстів одного каналу.
+        """
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.channels = {}  # id каналу -> OrderedDict(id повідомлення -> CachedMessage)
+        self.chars = {}  # id каналу -> сумарна довжина текстів
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, channel_id, message_id, raw_text: str, photo) -> CachedMessage:
+        """
+        Додає повідомлення в кеш каналу, витісняючи найстаріші.
+
+        Args:
+            channel_id (int): Id каналу.
+            message_id (int): Id повідомлення в каналі.
+            raw_text (str): Текст повідомлення.
+            photo: Фото повідомлення (або None).
+
+        Returns:
+            CachedMessage: Запис кешу.
+        """
+        messages = self.channels.get(channel_id)
+        if messages is None:
+            messages = self.channels[channel_id] = OrderedDict()
+            self.chars[channel_id] = 0
+
+        previous = messages.pop(message_id, None)
+        if previous is not None:
+            self.chars[channel_id] -= len(previous.raw_text or "")
+
+        entry = messages[message_id] = CachedMessage(raw_text, photo)
+        self.chars[channel_id] += len(raw_text or "")
+
+        while len(messages) > self.max_entries or (self.chars[channel_id] > self.max_chars and len(messages) > 1):
+            _, evicted = messages.popitem(last=False)
+            self.chars[channel_id] -= len(evicted.raw_text or "")
+
+        return entry
+
+    def get(self, channel_id, message_id):
+        """
+        Шукає повідомлення в кеші і рахує влучання/промахи.
+
+        Args:
+            channel_id (int): Id каналу.
+            message_id (int): Id повідомлення в каналі.
+
+        Returns:
+            CachedMessage | None: Запис кешу або None.
+        """
+        messages = self.channels.get(channel_id)
+        entry = messages.get(message_id) if messages is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        messages.move_to_end(message_id)
+        self.hits += 1
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": sum(len(messages) for messages in self.channels.values()),
+        }
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+# Межі кошиків гістограм у секундах: від 100 мкс до 5 хв
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+
+class Histogram:
+    """Гістограма з фіксованими кошиками, як histogram у Prometheus."""
+
+    __slots__ = ("name", "help", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name: str, help_text: str, bounds=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Останній кошик - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """Контекстний менеджер, що записує тривалість блоку."""
+        return _Timer(self)
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Оцінює квантиль за кошиками (верхня межа кошика, в який він потрапляє).
+
+        Args:
+            fraction (float): Квантиль від 0 до 1.
+
+        Returns:
+            float: Оцінка в секундах (0, якщо спостережень немає).
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Реєстр метрик бота.
+
+    Гістограми і лічильники оновлюються прямо в коді обробки (лише кілька
+    арифметичних операцій), а значення gauge (глибина черг, лічильники
+    інших модулів) зчитуються функціями тільки під час показу метрик.
+    """
+
+    def __init__(self, prefix: str):
+        """
+        Args:
+            prefix (str): Префікс імен метрик, наприклад "telebot".
+        """
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}  # назва -> {мітка: значення}
+        self.gauges = {}  # назва -> (опис, функція, що повертає число або {мітка: значення})
+
+    def histogram(self, name: str, help_text: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(f"{self.prefix}_{name}_seconds", help_text)
+        return histogram
+
+    def inc(self, name: str, label="", amount=1) -> None:
+        counter = self.counters.setdefault(name, {})
+        counter[label] = counter.get(label, 0) + amount
+
+    def gauge(self, name: str, help_text: str, read) -> None:
+        self.gauges[name] = (help_text, read)
+
+    def render(self) -> str:
+        """
+        Формує всі метрики в текстовому форматі Prometheus.
+
+        Returns:
+            str: Текст метрик.
+        """
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for name, counter in self.counters.items():
+            full_name = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {full_name} counter")
+            for label, value in counter.items():
+                lines.append(f'{full_name}{{label="{label}"}} {value}' if label else f"{full_name} {value}")
+        for name, (help_text, read) in self.gauges.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} gauge")
+            value = read()
+            if isinstance(value, dict):
+                lines.extend(f'{full_name}{{label="{label}"}} {item}' for label, item in value.items())
+            else:
+                lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        Короткий рядок для логу: p50/p99 гістограм, лічильники і gauge.
+
+        Returns:
+            str: Рядок статистики.
+        """
+        parts = [
+            f"{name} n={histogram.count} p50={histogram.quantile(0.5) * 1e3:g}мс p99={histogram.quantile(0.99) * 1e3:g}мс"
+            for name, histogram in self.histograms.items()
+            if histogram.count
+        ]
+        parts.extend(f"{name}={sum(counter.values())}" for name, counter in self.counters.items())
+        for name, (_, read) in self.gauges.items():
+            value = read()
+            parts.append(f"{name}={sum(value.values()) if isinstance(value, dict) else value}")
+        return "; ".join(parts)
+
+    async def serve(self, port: int, host="127.0.0.1") -> asyncio.AbstractServer:
+        """
+        Запускає HTTP-сервер, що віддає метрики на будь-який GET-запит.
+
+        Args:
+            port (int): Порт.
+            host (str): Адреса (типово лише локальна).
+
+        Returns:
+            asyncio.AbstractServer: Запущений сервер.
+        """
+
+        async def respond(reader, writer):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.render().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(respond, host, port)
+        logger.info("Метрики доступні на http://%s:%s/metrics", host, port)
+        return server
+
+    async def log_periodically(self, interval: float) -> None:
+        """
+        Раз на interval секунд пише в лог рядок зі статистикою, доки корутину не скасують.
+
+        Args:
+            interval (float): Період у секундах.
+
+        Returns:
+            None.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            logger.info("Метрики: %s", self.summary())
@@ -0,0 +1,403 @@
+import re
+from dataclasses import dataclass
+
+
+# Розділові знаки разом з пробілами навколо них, або будь-яка послідовність пробілів.
+# Один прохід замінює три послідовні sub() з попередньої версії correct_punctuation.
+PUNCTUATION_RE = re.compile(r"\s*([.!?,;](?:\s*[.!?,;])*)\s*|\s+")
+
+
+def _punctuation_repl(match: re.Match) -> str:
+    marks = match.group(1)
+    if marks is None:
+        return " "
+    return "".join(marks.split()) + " "
+
+
+def correct_punctuation(text: str) -> str:
+    """
+    Виправляє пунктуацію в повідомленні.
+
+    Args:
+        text (str): Вхідний текст для обробки.
+
+    Returns:
+        str: Виправлений текст.
+    """
+    if text:
+        text = PUNCTUATION_RE.sub(_punctuation_repl, text)
+
+    return text
+
+
+class LineView:
+    """
+    Текст повідомлення з ледачими рядками.
+
+    Кількість рядків і текст у нижньому регістрі обчислюються при першому
+    зверненні і кешуються, а рядки читаються зсувами в тексті без split(),
+    тож довгий пост не розбивається на список рядків цілком.
+    """
+
+    __slots__ = ("text", "_lower", "_line_count")
+
+    def __init__(self, text: str, line_count=None):
+        """
+        Args:
+            text (str): Текст повідомлення.
+            line_count (int): Уже відома кількість рядків, щоб не рахувати її вдруге.
+        """
+        self.text = text
+        self._lower = None
+        self._line_count = line_count
+
+    @property
+    def line_count(self) -> int:
+        if self._line_count is None:
+            self._line_count = self.text.count("\n") + 1
+        return self._line_count
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.text.lower()
+        return self._lower
+
+    def find_line(self, word: str) -> int:
+        """
+        Шукає перший рядок, що містить word без урахування регістру.
+
+        Args:
+            word (str): Слово в нижньому регістрі.
+
+        Returns:
+            int: Зсув початку рядка в тексті або -1, якщо слова немає.
+        """
+        lower = self.lower
+        if len(lower) == len(self.text):
+            position = lower.find(word)
+            return position if position < 0 else self.text.rfind("\n", 0, position) + 1
+        # lower() змінив довжину (наприклад, "İ"), тож зсуви не збігаються - шукаємо по рядках
+        for start, end in self.lines_from(0):
+            if word in self.text[start:end].lower():
+                return start
+        return -1
+
+    def lines_from(self, offset: int):
+        """
+        Args:
+            offset (int): Зсув початку рядка.
+
+        Yields:
+            tuple: (початок, кінець) кожного рядка від offset до кінця тексту.
+        """
+        text = self.text
+        while True:
+            end = text.find("\n", offset)
+            if end < 0:
+                yield offset, len(text)
+                return
+            yield offset, end
+            offset = end + 1
+
+
+def trunc_message(text: str, trunc_word: str, continue_symbols, max_message_rows: int) -> str:
+    """
+    Обрізає текст, починаючи з рядка, що містить trunc_word, і до рядка,
+    який не починається з символів із continue_symbols.
+
+    Args:
+        text (str): Вхідний текст для обробки.
+        trunc_word (str): Слово, з якого починається обрізка.
+        continue_symbols (set): Набір символів, які дозволяють продовжувати обробку.
+        max_message_rows (int): Максимальна кількість рядків без обрізання.
+
+    Returns:
+        str: Обрізаний текст, без завершальних пробілів.
+    """
+    if not text:
+        return ""
+    line_count = text.count("\n") + 1
+    if not trunc_word or line_count <= max_message_rows:
+        return text
+
+    return trunc_lines(LineView(text, line_count), trunc_word, continue_symbols, max_message_rows).text
+
+
+def trunc_lines(view: LineView, trunc_word: str, continue_symbols, max_message_rows: int) -> LineView:
+    """
+    Обрізає текст LineView так само, як trunc_message.
+
+    Кількість рядків для перевірки max_message_rows береться з view, а
+    перегляд рядків починається з рядка з trunc_word і зупиняється на
+    першому рядку після блоку продовження.
+
+    Args:
+        view (LineView): Текст повідомлення.
+        trunc_word (str): Слово, з якого починається обрізка.
+        continue_symbols (set): Набір символів, які дозволяють продовжувати обробку.
+        max_message_rows (int): Максимальна кількість рядків без обрізання.
+
+    Returns:
+        LineView: Той самий view, якщо обрізати нічого, інакше view обрізаного тексту.
+    """
+    text = view.text
+    if not text or not trunc_word or view.line_count <= max_message_rows:
+        return view
+
+    start = view.find_line(trunc_word)
+    if start < 0:
+        return view
+
+    lines = view.lines_from(start)
+    _, end = next(lines)  # Рядок з trunc_word
+    for line_start, line_end in lines:
+        stripped = text[line_start:line_end].lstrip()
+        if stripped and stripped[0] not in continue_symbols:
+            break
+        end = line_end
+
+    return LineView(text[start:end].strip())
+
+
+class MultiReplacer:
+    """Замінює всі ключі словника за один прохід по тексту одним скомпільованим regex."""
+
+    __slots__ = ("mapping", "pattern")
+
+    def __init__(self, mapping: dict):
+        self.mapping = {key: value for key, value in mapping.items() if key}
+        if self.mapping:
+            # Довші ключі першими, щоб "а б" перемагало "а" на тій самій позиції
+            keys = sorted(self.mapping, key=len, reverse=True)
+            self.pattern = re.compile("|".join(re.escape(key) for key in keys))
+        else:
+            self.pattern = None
+
+    def __bool__(self) -> bool:
+        return self.pattern is not None
+
+    def __call__(self, text: str) -> str:
+        if self.pattern is None or not text:
+            return text
+        return self.pattern.sub(lambda m: self.mapping[m.group()], text)
+
+
+def replace_text(text: str, replace_dict) -> str:
+    """
+    Замінює символи в повідомленні, використовуючи словник.
+
+    Args:
+        text (str): Вхідний текст для обробки.
+        replace_dict (dict | MultiReplacer): Словник з парами слів/символів або готовий замінювач.
+
+    Returns:
+        str: Опрацьований текст.
+    """
+    if not replace_dict:
+        return text
+    if not isinstance(replace_dict, MultiReplacer):
+        replace_dict = MultiReplacer(replace_dict)
+
+    return replace_dict(text)
+
+
+# Очікувані типи полів каналу в channels.json; відсутнє поле отримує значення за замовчуванням
+CHANNEL_FIELD_TYPES = {
+    "name": str,
+    "url": str,
+    "keywords": list,
+    "trunc_word": str,
+    "stop_length": int,
+    "stop_words": list,
+    "delete_words": list,
+    "replace_words": dict,
+    "is_filter_stop_words": bool,
+    "is_silent": bool,
+    "is_save_for_alarm": bool,
+    "is_forward_images": bool,
+    "is_alarm_source": bool,
+    "is_read_only_when_alarm": bool,
+    "is_correct_punctuation": bool,
+    "is_translate": bool,
+    "is_trunc_message": bool,
+    "is_delete_words": bool,
+    "is_replace_words": bool,
+}
+
+
+def check_channel_config(config) -> None:
+    """
+    Перевіряє типи полів каналу з channels.json.
+
+    Args:
+        config (dict): Налаштування каналу.
+
+    Raises:
+        ValueError: Якщо налаштування каналу - не словник або поле має не той тип.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("налаштування каналу мають бути словником")
+    for key, expected in CHANNEL_FIELD_TYPES.items():
+        value = config.get(key)
+        if value is None:
+            continue
+        # bool - підклас int, тож прапорець не приймається замість числа
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            raise ValueError(f"поле '{key}' має бути {expected.__name__}, а не {type(value).__name__}")
+    for key in ("keywords", "stop_words", "delete_words"):
+        if not all(isinstance(word, str) for word in config.get(key) or ()):
+            raise ValueError(f"поле '{key}' має містити лише рядки")
+    if not all(isinstance(k, str) and isinstance(v, str) for k, v in (config.get("replace_words") or {}).items()):
+        raise ValueError("поле 'replace_words' має зіставляти рядки з рядками")
+
+
+@dataclass(slots=True)
+class ChannelPipeline:
+    """Скомпільовані налаштування і ланцюжок обробки тексту одного каналу."""
+
+    name: str
+    url: str
+    keywords: tuple
+    trunc_word: str
+    stop_length: int
+    stop_words: tuple
+    is_filter_stop_words: bool
+    is_silent: bool
+    is_save_for_alarm: bool
+    is_forward_images: bool
+    is_alarm_source: bool
+    is_read_only_when_alarm: bool
+    is_correct_punctuation: bool
+    is_translate: bool
+    is_trunc_message: bool
+    is_delete_words: bool
+    delete_words: MultiReplacer
+    replace_words: MultiReplacer
+    translate: object
+    continue_symbols: frozenset
+    max_message_rows: int
+
+    @classmethod
+    def from_config(cls, config: dict, translate, continue_symbols, max_message_rows: int):
+        """
+        Компілює словник налаштувань каналу з channels.json.
+
+        Args:
+            config (dict): Налаштування каналу.
+            translate (callable): Функція перекладу тексту.
+            continue_symbols (list): Символи продовження блоку для обрізання.
+            max_message_rows (int): Максимальна кількість рядків у повідомленні.
+
+        Returns:
+            ChannelPipeline: Готовий до використання ланцюжок обробки.
+
+        Raises:
+            ValueError: Якщо налаштування каналу мають неправильну структуру.
+        """
+        check_channel_config(config)
+        return cls(
+            name=config.get("name", "невідомий"),
+            url=config.get("url", ""),
+            keywords=tuple(config.get("keywords", [])),
+            trunc_word=config.get("trunc_word", ""),
+            stop_length=config.get("stop_length", 0),
+            stop_words=tuple(config.get("stop_words", [])),
+            is_filter_stop_words=config.get("is_filter_stop_words", False),
+            is_silent=config.get("is_silent", False),
+            is_save_for_alarm=config.get("is_save_for_alarm", False),
+            is_forward_images=config.get("is_forward_images", False),
+            is_alarm_source=config.get("is_alarm_source", False),
+            is_read_only_when_alarm=config.get("is_read_only_when_alarm", False),
+            is_correct_punctuation=config.get("is_correct_punctuation", False),
+            is_translate=config.get("is_translate", False),
+            is_trunc_message=config.get("is_trunc_message", False),
+            is_delete_words=config.get("is_delete_words", False),
+            delete_words=MultiReplacer(dict.fromkeys(config.get("delete_words", []), "")),
+            replace_words=MultiReplacer(config.get("replace_words", {})),
+            translate=translate,
+            continue_symbols=frozenset(continue_symbols),
+            max_message_rows=max_message_rows,
+        )
+
+    def process(self, message_text: str) -> str:
+        """
+        Редагує текст повідомлення відповідно до прапорців каналу.
+
+        Args:
+            message_text (str): Текст повідомлення.
+
+        Returns:
+            str: Опрацьований текст повідомлення.
+        """
+        return self.process_lines(message_text).text
+
+    def process_lines(self, message_text: str) -> LineView:
+        """
+        Редагує текст повідомлення, як process, і повертає LineView результату.
+
+        Той самий view використовується для перевірки кількості рядків,
+        обрізання і потім для причин тривоги, тож рядки не рахуються двічі.
+
+        Args:
+            message_text (str): Текст повідомлення.
+
+        Returns:
+            LineView: Опрацьований текст повідомлення.
+        """
+        if not message_text:
+            return LineView(message_text)
+
+        if self.is_correct_punctuation:  # Корекція пунктуації
+            message_text = correct_punctuation(message_text)
+
+        if self.is_translate:  # Спеціальна обробка і переклад тексту
+            message_text = self.translate(message_text)
+
+        if self.is_delete_words:  # Видалення слів відповідно до переліку
+            message_text = self.delete_words(message_text).strip()
+
+        view = LineView(message_text)
+        if self.is_trunc_message:  # Обрізання зайвої інформації
+            view = trunc_lines(view, self.trunc_word, self.continue_symbols, self.max_message_rows)
+
+        return view
+
+    def trunc(self, message_text: str) -> str:
+        """
+        Обрізає текст по trunc_word каналу.
+
+        Args:
+            message_text (str): Текст повідомлення.
+
+        Returns:
+            str: Обрізаний текст.
+        """
+        return trunc_message(
+            message_text, self.trunc_word, self.continue_symbols, self.max_message_rows
+        )
+
+
+def compile_pipelines(channels: dict, translate, continue_symbols, max_message_rows: int) -> dict:
+    """
+    Компілює налаштування всіх каналів один раз при завантаженні.
+
+    Args:
+        channels (dict): Словник каналів з channels.json (ключ - id каналу).
+        translate (callable): Функція перекладу тексту.
+        continue_symbols (list): Символи продовження блоку для обрізання.
+        max_message_rows (int): Максимальна кількість рядків у повідомленні.
+
+    Returns:
+        dict: Словник id каналу -> ChannelPipeline.
+
+    Raises:
+        ValueError: Якщо налаштування якогось каналу мають неправильну структуру.
+    """
+    pipelines = {}
+    for channel_id, config in channels.items():
+        try:
+            pipelines[channel_id] = ChannelPipeline.from_config(config, translate, continue_symbols, max_message_rows)
+        except ValueError as e:
+            raise ValueError(f"Канал {channel_id}: {e}") from e
+    return pipelines
@@ -0,0 +1,188 @@
+"""
+Профілювання бота під навантаженням без перезапуску.
+
+Сесія профілювання (SIGUSR1 або прапорець profile_on_start у settings.json)
+записує cProfile протягом заданої кількості секунд і знімок tracemalloc у
+теку logs/ і пише в лог найбільші зміни виділеної пам'яті за час сесії.
+На час сесії цикл подій працює в режимі налагодження asyncio, тож кожен
+обробник, довший за loop_lag_threshold_ms, записується в лог з назвою.
+Після сесії tracemalloc і режим налагодження вимикаються, якщо не були
+увімкнені до неї. Окремо постійно вимірюється затримка циклу подій.
+
+Перегляд збережених дампів:
+    python profiling.py list
+    python profiling.py report logs/profile_2025-05-01_10-00-00.prof --top 30
+    python profiling.py diff logs/memory_1.snap logs/memory_2.snap
+"""
+
+import argparse
+import asyncio
+import cProfile
+import logging
+import pstats
+import signal
+import tracemalloc
+from datetime import datetime
+from glob import glob
+from os import makedirs, path
+from time import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "logs"
+
+
+class Profiler:
+    """Сесії cProfile/tracemalloc за запитом і вимірювання затримки циклу подій."""
+
+    def __init__(self, seconds: float, lag_threshold: float, frames=10, on_lag=None):
+        """
+        Args:
+            seconds (float): Тривалість запису cProfile.
+            lag_threshold (float): Затримка циклу подій (секунди), після якої пишеться попередження.
+            frames (int): Глибина стеку для tracemalloc.
+            on_lag (callable): Отримує кожне виміряне значення затримки (наприклад, гістограма метрик).
+        """
+        self.seconds = seconds
+        self.lag_threshold = lag_threshold
+        self.frames = frames
+        self.on_lag = on_lag
+        self.session = None  # Поточна сесія профілювання
+
+    def install_signal(self, signum=signal.SIGUSR1) -> None:
+        """
+        Запускає сесію профілювання за сигналом (лише на системах із SIGUSR1).
+
+        Returns:
+            None.
+        """
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, self.trigger)
+        except (NotImplementedError, AttributeError, RuntimeError) as e:
+            logger.warning("Не вдалося підключити сигнал профілювання: %s", e)
+
+    def trigger(self) -> None:
+        if self.session is not None and not self.session.done():
+            logger.info("Профілювання вже триває.")
+            return
+        self.session = asyncio.get_running_loop().create_task(self.profile())
+
+    async def profile(self) -> str:
+        """
+        Записує cProfile протягом self.seconds і знімок пам'яті.
+
+        Returns:
+            str: Шлях до файлу cProfile.
+        """
+        makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        logger.info("Профілювання на %s с.", self.seconds)
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(self.frames)
+        loop = asyncio.get_running_loop()
+        was_debug, slow_callback_duration = loop.get_debug(), loop.slow_callback_duration
+        # У режимі налагодження asyncio сам пише в лог кожен обробник, довший за slow_callback_duration
+        loop.slow_callback_duration = self.lag_threshold
+        loop.set_debug(True)
+        try:
+            baseline = await asyncio.to_thread(tracemalloc.take_snapshot)
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(self.seconds)
+            finally:
+                profiler.disable()
+            profile_path = path.join(PROFILE_DIR, f"profile_{stamp}.prof")
+            await asyncio.to_thread(profiler.dump_stats, profile_path)
+            logger.info("cProfile збережено у %s", profile_path)
+
+            await asyncio.to_thread(self.snapshot_memory, stamp, baseline)
+        finally:
+            loop.set_debug(was_debug)
+            loop.slow_callback_duration = slow_callback_duration
+            # Трасування уповільнює кожне виділення пам'яті, тож після сесії його вимикаємо
+            if not was_tracing:
+                tracemalloc.stop()
+        return profile_path
+
+    def snapshot_memory(self, stamp: str, baseline: tracemalloc.Snapshot) -> None:
+        snapshot = tracemalloc.take_snapshot()
+        snapshot_path = path.join(PROFILE_DIR, f"memory_{stamp}.snap")
+        snapshot.dump(snapshot_path)
+        logger.info("Знімок пам'яті збережено у %s", snapshot_path)
+
+        for stat in snapshot.compare_to(baseline, "lineno")[:10]:
+            logger.info("Пам'ять: %s", stat)
+
+    async def watch_loop_lag(self, interval=0.5) -> None:
+        """
+        Вимірює, наскільки пізніше запланованого прокидається корутина, доки її не скасують.
+
+        Затримка понад lag_threshold означає, що якийсь обробник блокує цикл подій;
+        назву обробника asyncio пише в лог під час сесії профілювання.
+
+        Args:
+            interval (float): Період вимірювання в секундах.
+
+        Returns:
+            None.
+        """
+        while True:
+            started = monotonic()
+            await asyncio.sleep(interval)
+            lag = monotonic() - started - interval
+            if self.on_lag is not None:
+                self.on_lag(lag)
+            if lag > self.lag_threshold:
+                logger.warning(
+                    "Цикл подій заблокований на %.0f мс.%s",
+                    lag * 1e3,
+                    "" if asyncio.get_running_loop().get_debug() else " Сесія профілювання (SIGUSR1) покаже, який обробник.",
+                )
+
+
+def list_dumps() -> None:
+    for dump in sorted(glob(path.join(PROFILE_DIR, "profile_*.prof")) + glob(path.join(PROFILE_DIR, "memory_*.snap"))):
+        print(dump)
+
+
+def report_profile(profile_path: str, top: int, sort: str) -> None:
+    stats = pstats.Stats(profile_path)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def report_memory(old_path: str, new_path: str, top: int) -> None:
+    old = tracemalloc.Snapshot.load(old_path)
+    new = tracemalloc.Snapshot.load(new_path)
+    for stat in new.compare_to(old, "lineno")[:top]:
+        print(stat)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перегляд дампів профілювання бота.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="показати збережені дампи")
+    report = commands.add_parser("report", help="найдорожчі функції з дампу cProfile")
+    report.add_argument("profile")
+    report.add_argument("--top", type=int, default=30)
+    report.add_argument("--sort", default="cumulative", help="поле сортування pstats (cumulative, tottime, ...)")
+    diff = commands.add_parser("diff", help="найбільші зміни пам'яті між двома знімками")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_dumps()
+    elif args.command == "report":
+        report_profile(args.profile, args.top, args.sort)
+    else:
+        report_memory(args.old, args.new, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+from collections import deque
+from datetime import datetime
+
+from coalesce import MAX_MESSAGE_LENGTH
+from matcher import make_set
+
+
+OTHER_REASONS_SEPARATOR = "\n \n"
+
+
+class ReasonCandidate:
+    """Повідомлення, яке може бути причиною наступної тривоги."""
+
+    __slots__ = ("time", "text", "line_count", "localities", "source")
+
+    def __init__(self, time: datetime, text: str, localities: frozenset, source="", line_count=None):
+        self.time = time
+        self.text = text
+        self.line_count = text.count("\n") + 1 if line_count is None else line_count
+        self.localities = localities
+        self.source = source  # Канал, з якого прийшло повідомлення
+
+    def __iter__(self):
+        # Запис у стані - [час, текст, канал], як у колишньому стеку повідомлень плюс канал
+        return iter((self.time, self.text, self.source))
+
+
+class ReasonStore:
+    """
+    Можливі причини тривоги за останні max_age секунд.
+
+    Кандидати впорядковані за часом і видаляються, коли стають старшими за
+    max_age, а не коли надходить кілька нових повідомлень. Кількість записів
+    додатково обмежена max_entries. Кількість рядків і населені пункти
+    кожного кандидата обчислюються один раз при додаванні.
+
+    Ітерування дає записи [час, текст, канал], тож StateStore зберігає
+    сховище так само, як колишній message_stack.
+    """
+
+    def __init__(self, max_age: float, max_entries: int, region_matcher, items=(), region_owner=None):
+        """
+        Args:
+            max_age (float): Скільки секунд кандидат лишається в сховищі.
+            max_entries (int): Максимальна кількість кандидатів.
+            region_matcher (MultiMatcher): Матчер з населеними пунктами області.
+            items (iterable): Записи [час, текст] або [час, текст, канал], наприклад зі збереженого стану.
+            region_owner: Власник списку населених пунктів області в матчері.
+        """
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.region_matcher = region_matcher
+        self.region_owner = region_owner
+        self.candidates = deque()
+        for time, text, *source in items:
+            self.add(time, text, *source)
+
+    def __iter__(self):
+        return iter(self.candidates)
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def add(self, time: datetime, text: str, source="", line_count=None) -> None:
+        """
+        Додає кандидата і видаляє застарілих.
+
+        Args:
+            time (datetime): Час повідомлення.
+            text (str): Опрацьований текст повідомлення.
+            source (str): Канал, з якого прийшло повідомлення.
+            line_count (int): Кількість рядків з LineView тексту, якщо вже відома.
+
+        Returns:
+            None.
+        """
+        localities = frozenset(make_set(text, self.region_matcher, self.region_owner))
+        self.candidates.append(ReasonCandidate(time, text, localities, source, line_count))
+        self.expire(time)
+        while len(self.candidates) > self.max_entries:
+            self.candidates.popleft()
+
+    def expire(self, now: datetime) -> None:
+        while self.candidates and (now - self.candidates[0].time).total_seconds() > self.max_age:
+            self.candidates.popleft()
+
+    def recent(self, now: datetime, ttl: float):
+        """
+        Кандидати, не старші за ttl секунд, від старіших до новіших.
+
+        Args:
+            now (datetime): Поточний час.
+            ttl (float): Максимальний вік кандидата в секундах.
+
+        Returns:
+            generator: Кандидати ReasonCandidate.
+        """
+        return (c for c in self.candidates if (now - c.time).total_seconds() <= ttl)
+
+    def select(self, now: datetime, ttl: float, localities=frozenset()):
+        """
+        Обирає найімовірнішу причину тривоги.
+
+        Якщо відомі населені пункти тривоги, перевага надається кандидату з
+        найбільшою кількістю спільних населених пунктів; серед рівних (або
+        без населених пунктів) - найкоротшому.
+
+        Args:
+            now (datetime): Поточний час.
+            ttl (float): Максимальний вік кандидата в секундах.
+            localities (frozenset): Населені пункти з повідомлення про тривогу.
+
+        Returns:
+            ReasonCandidate | None: Обраний кандидат або None.
+        """
+        return min(
+            self.recent(now, ttl),
+            key=lambda c: (-len(c.localities & localities), len(c.text)),
+            default=None,
+        )
+
+
+def format_other_reasons(
+    message_stack: ReasonStore,
+    reason: str,
+    now: datetime,
+    max_message_rows: int,
+    message_ttl: float,
+    max_reasons=3,
+    max_length=MAX_MESSAGE_LENGTH,
+) -> str:
+    """
+    Формує рядок з іншими причинами, відформатованими як цитати.
+
+    Показуються лише max_reasons найновіших причин, і лише стільки, скільки
+    вміщується в max_length символів, бо повідомлення понад ліміт Telegram
+    не буде надіслане.
+
+    Args:
+        message_stack (ReasonStore): Сховище можливих причин.
+        reason (str): Причина, яку потрібно виключити.
+        now (datetime): Поточний час для порівняння.
+        max_message_rows (int): Максимальна кількість рядків у повідомленні.
+        message_ttl (int): Час життя повідомлення в секундах.
+        max_reasons (int): Максимальна кількість причин.
+        max_length (int): Максимальна довжина рядка.
+
+    Returns:
+        str: Відформатований рядок з іншими причинами.
+    """
+    candidates = [
+        candidate
+        for candidate in message_stack.recent(now, 2 * message_ttl)
+        if candidate.text != reason and candidate.line_count < 2 * max_message_rows
+    ]
+    quotes = []
+    length = 0
+    for candidate in reversed(candidates[-max_reasons:] if max_reasons > 0 else []):
+        quote = f"<blockquote>{candidate.text}</blockquote>"
+        added = len(quote) + (len(OTHER_REASONS_SEPARATOR) if quotes else 0)
+        if length + added > max_length:
+            continue
+        quotes.append(quote)
+        length += added
+    return OTHER_REASONS_SEPARATOR.join(reversed(quotes))
@@ -0,0 +1,576 @@
+"""
+Офлайн-відтворення записаних подій через справжній handler з bot.py.
+
+Кожен рядок файлу подій - json з полями:
+    chat_id (int), raw_text (str), date (iso), photo (bool),
+    reply (null або {"id": int, "raw_text": str, "photo": bool}), id (int, необов'язково),
+    edited (bool, необов'язково - подія редагування повідомлення з тим самим id).
+
+Бот запускається в тимчасовій теці з копіями channels.json, settings.json,
+translate.json і стану, а замість TelegramClient працює FakeClient, який
+лише записує send_message/send_file. Час datetime.now() у bot.py береться з
+дати поточної події, тож результат відтворюваний.
+
+Режим --stress замість файлу подій генерує тисячі перемежованих подій усіх
+каналів і проганяє їх через INGEST з кількома обробниками, перевіряючи, що
+події кожного каналу оброблені по порядку і жодна не загубилася, а наприкінці
+перевіряє, що стан, прочитаний після перезапуску, далі зберігається.
+
+Приклади:
+    python replay.py events.jsonl --write-golden golden.jsonl
+    python replay.py events.jsonl --golden golden.jsonl --max-p99-ms 5
+    python replay.py --stress 5000 --workers 8
+"""
+
+import argparse
+import asyncio
+import difflib
+import importlib
+import json
+import logging
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from os import chdir, environ, getcwd, path
+from time import perf_counter
+
+
+CONFIG_FILES = ("channels.json", "settings.json", "translate.json")
+
+DEFAULT_STATE = {
+    "is_alarm": False,
+    "alarm_start_time": "2000-01-01T00:00:00",
+    "last_message": "",
+    "last_message_time": "2000-01-01T00:00:00",
+    "message_count": 0,
+    "is_show_next_event": False,
+    "message_stack": [],
+    "last_seen": {},
+}
+
+
+class ReplayClock(datetime):
+    """datetime, у якого now() повертає час поточної відтворюваної події."""
+
+    current = datetime(2000, 1, 1)  # UTC без часової зони
+
+    @classmethod
+    def now(cls, tz=None):
+        if tz is None:
+            return cls.current
+        return cls.current.replace(tzinfo=timezone.utc).astimezone(tz)
+
+
+class StageTimer:
+    """Накопичує час виконання окремих етапів обробки."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, perf_counter() - start)
+
+        return timed
+
+
+class TimedProxy:
+    """Обгортка над об'єктом, що заміряє час вибраних методів."""
+
+    def __init__(self, target, timer: StageTimer, methods: dict):
+        self._target = target
+        for method, stage in methods.items():
+            setattr(self, method, timer.wrap(stage, getattr(target, method)))
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class ErrorCounter(logging.Handler):
+    """Рахує помилки, які exception_handler у bot.py лише записує в лог."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+        print(f"Помилка: {record.getMessage()}", file=sys.stderr)
+
+
+class FakeMessage:
+    def __init__(self, raw_text: str, photo, message_id=None):
+        self.raw_text = raw_text
+        self.photo = photo
+        self.id = message_id
+
+
+class FakeEvent:
+    """Мінімальна подія NewMessage, яку використовує handler."""
+
+    def __init__(self, record: dict, index: int, timer: StageTimer):
+        self.id = record.get("id", index)
+        self.chat_id = record["chat_id"]
+        self.raw_text = record.get("raw_text") or ""
+        self.date = datetime.fromisoformat(record["date"])
+        self.photo = f"photo:{self.chat_id}:{self.id}" if record.get("photo") else None
+        self.reply = record.get("reply")
+        self.is_reply = self.reply is not None
+        self.reply_to = self.reply
+        self.reply_to_msg_id = self.reply.get("id") if self.reply else None
+        self.timer = timer
+
+    async def get_reply_message(self):
+        start = perf_counter()
+        message = None
+        if self.reply and self.reply.get("raw_text") is not None:
+            photo = f"photo:{self.chat_id}:reply:{self.id}" if self.reply.get("photo") else None
+            message = FakeMessage(self.reply["raw_text"], photo)
+        self.timer.add("reply_fetch", perf_counter() - start)
+        return message
+
+
+class FakeClient:
+    """Замінник TelegramClient, який записує всі надіслані повідомлення."""
+
+    def __init__(self, state: dict):
+        self.state = state
+        self.parse_mode = "html"
+        self.sent = []
+
+    async def send_message(self, entity, message, silent=False, **kwargs):
+        self.sent.append({"chat_id": entity, "text": message, "file": None, "silent": silent})
+        return FakeMessage(message, None, len(self.sent))
+
+    async def send_file(self, entity, file=None, caption=None, silent=False, **kwargs):
+        self.sent.append({"chat_id": entity, "text": caption, "file": file, "silent": silent})
+        return FakeMessage(caption, file, len(self.sent))
+
+    async def edit_message(self, entity, message, text=None, **kwargs):
+        self.sent.append({"chat_id": entity, "edit": message, "text": text})
+
+
+class FakeSessionClient:
+    """Замінник клієнта додаткової сесії: отримує події від FakeTelegram за своїми обробниками."""
+
+    def __init__(self, name: str, joined=()):
+        self.name = name
+        self.joined = set(joined)  # Канали, на які підписаний акаунт
+        self.handlers = []  # (обробник, подія Telethon з chats)
+        self.connected = False
+        self.disconnected = None
+        self.delivered = 0
+
+    async def start(self):
+        await self.connect()
+
+    async def connect(self):
+        self.connected = True
+        self.disconnected = asyncio.get_running_loop().create_future()
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def run_until_disconnected(self):
+        if self.connected:
+            await self.disconnected
+
+    async def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.disconnected.set_result(None)
+
+    async def iter_dialogs(self):
+        for channel_id in sorted(self.joined):
+            yield FakeMessage("", None, channel_id)
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(handler, builder) for handler, builder in self.handlers if handler is not callback]
+
+
+class FakeTelegram:
+    """Доставляє подію кожній підключеній сесії, що слухає канал події."""
+
+    def __init__(self):
+        self.clients = []
+        self.undelivered = 0
+
+    def client(self, name: str, joined=()) -> FakeSessionClient:
+        session_client = FakeSessionClient(name, joined)
+        self.clients.append(session_client)
+        return session_client
+
+    async def publish(self, event) -> None:
+        delivered = False
+        for session_client in self.clients:
+            if not session_client.connected:
+                continue
+            for callback, builder in session_client.handlers:
+                if event.chat_id in builder.chats:
+                    session_client.delivered += 1
+                    delivered = True
+                    await callback(event)
+        if not delivered:
+            self.undelivered += 1
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def read_events(events_path: str) -> list:
+    with open(events_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prepare_workdir(config_dir: str, state_path: str) -> str:
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    for name in CONFIG_FILES:
+        shutil.copy(path.join(config_dir, name), workdir)
+    if state_path:
+        shutil.copy(state_path, path.join(workdir, "state.json"))
+    else:
+        with open(path.join(workdir, "state.json"), "w", encoding="utf-8") as f:
+            json.dump(DEFAULT_STATE, f)
+    return workdir
+
+
+async def replay(bot, records: list, timer: StageTimer) -> tuple:
+    """
+    Проганяє записані події через handler.
+
+    Args:
+        bot: Імпортований модуль bot.
+        records (list): Записані події.
+        timer (StageTimer): Збирач часу етапів.
+
+    Returns:
+        tuple: Список надісланих повідомлень, затримки подій, загальний час.
+    """
+    fake = FakeClient(bot.client.state)
+    bot.client = fake
+    bot.datetime = ReplayClock
+    bot.MATCHER = TimedProxy(bot.MATCHER, timer, {"scan": "matching"})
+    bot.PIPELINES = {
+        channel_id: TimedProxy(pipeline, timer, {"process": "process_text", "trunc": "process_text"})
+        for channel_id, pipeline in bot.PIPELINES.items()
+    }
+    for profile in bot.ROUTER:
+        profile.dedup = TimedProxy(profile.dedup, timer, {"describe": "dedup", "find": "dedup"})
+    bot.SEND_QUEUE.burst = len(records) * 4 + 1  # Без обмеження частоти під час відтворення
+    sender_task = asyncio.create_task(bot.SEND_QUEUE.run())
+
+    latencies = []
+    started = perf_counter()
+    for index, record in enumerate(records):
+        event = FakeEvent(record, index, timer)
+        ReplayClock.current = event.date.astimezone(timezone.utc).replace(tzinfo=None)
+        start = perf_counter()
+        if record.get("edited"):
+            await bot.edit_handler(event)
+        else:
+            await bot.handler(event)
+        latencies.append(perf_counter() - start)
+        # Вихідні повідомлення кожної події надсилаються до наступної; вікно дайджесту - одна подія
+        bot.COALESCER.flush_all()
+        await bot.SEND_QUEUE.join()
+    elapsed = perf_counter() - started
+
+    sender_task.cancel()
+    bot.STATE_STORE.close()
+    return fake.sent, latencies, elapsed
+
+
+class StressEvent(FakeEvent):
+    """Подія, у якої отримання цитати займає випадковий час, щоб обробники перемежовувалися."""
+
+    def __init__(self, record: dict, index: int, timer: StageTimer, delay: float):
+        super().__init__(record, index, timer)
+        self.delay = delay
+
+    async def get_reply_message(self):
+        await asyncio.sleep(self.delay)
+        return await super().get_reply_message()
+
+
+async def stress(bot, count: int, workers: int, seed: int, sessions=1) -> list:
+    """
+    Проганяє count випадкових перемежованих подій через INGEST.
+
+    З кількома сесіями події надходять через SessionPool і FakeTelegram, а
+    на третині прогону одна сесія відключається і згодом підключається знову.
+
+    Args:
+        bot: Імпортований модуль bot.
+        count (int): Кількість подій.
+        workers (int): Скільки каналів обробляти одночасно.
+        seed (int): Зерно генератора подій.
+        sessions (int): Кількість сесій Telegram.
+
+    Returns:
+        list: Опис порушень (порожній, якщо все гаразд).
+    """
+    rng = random.Random(seed)
+    fake = FakeClient(bot.client.state)
+    bot.client = fake
+    bot.SEND_QUEUE.burst = count * 4 + 1
+    bot.INGEST.max_workers = workers
+    bot.INGEST.max_depth = count + 1  # Скидання навантаження перевіряється окремо, тут лише порядок
+    bot.INGEST.max_age = float("inf")
+
+    channel_ids = list(bot.PIPELINES)
+    words = bot.REGION_LIST[:50] or ["тест"]
+    timer = StageTimer()
+    order = {}  # id каналу -> id подій у порядку початку обробки
+    active = 0
+    max_active = 0
+    process = bot.INGEST.process
+
+    async def tracked(event):
+        nonlocal active, max_active
+        order.setdefault(event.chat_id, []).append(event.id)
+        active += 1
+        max_active = max(max_active, active)
+        try:
+            await process(event)
+        finally:
+            active -= 1
+
+    bot.INGEST.process = tracked
+    sender_task = asyncio.create_task(bot.SEND_QUEUE.run())
+    ingest_task = asyncio.create_task(bot.INGEST.run())
+
+    network = None
+    pool_task = None
+    if sessions > 1:
+        network = FakeTelegram()
+        # Основна сесія підписана на всі канали, кожна додаткова - на половину
+        clients = {
+            f"session_{number}": network.client(
+                f"session_{number}",
+                [channel_id for index, channel_id in enumerate(channel_ids) if not number or (index + number) % 2],
+            )
+            for number in range(sessions)
+        }
+        await network.clients[0].connect()  # Основна сесія підключена ще до SessionPool.start
+        bot.SESSIONS = bot.SessionPool(
+            clients,
+            ((bot.on_new_message, bot.events.NewMessage),),
+            reconnect_delay=0.005,
+        )
+        await bot.SESSIONS.start()
+        bot.SESSIONS.set_channels(channel_ids)
+        pool_task = asyncio.create_task(bot.SESSIONS.run())
+
+    next_id = {channel_id: 1 for channel_id in channel_ids}
+    started = perf_counter()
+    for index in range(count):
+        channel_id = rng.choice(channel_ids)
+        pipeline = bot.PIPELINES[channel_id]
+        message_id = next_id[channel_id]
+        next_id[channel_id] += 1
+        keywords = pipeline.keywords or ["тест"]
+        record = {
+            "id": message_id,
+            "chat_id": channel_id,
+            "raw_text": f"{rng.choice(keywords)} {rng.choice(words)} {index}",
+            "date": datetime.now(timezone.utc).isoformat(),
+            # Цитата на повідомлення, якого бот не бачив: обробник чекає на get_reply_message
+            "reply": {"id": -message_id, "raw_text": "цитата", "photo": False} if rng.random() < 0.3 else None,
+        }
+        event = StressEvent(record, message_id, timer, rng.random() * 0.002)
+        if network is not None:
+            if index == count // 3:
+                await network.clients[-1].disconnect()
+                await asyncio.sleep(0)  # Даємо SessionPool перерозподілити канали
+            await network.publish(event)
+        else:
+            priority = bot.HIGH_PRIORITY if pipeline.is_alarm_source else bot.NORMAL_PRIORITY
+            bot.INGEST.put(channel_id, event, priority, sheddable=False)
+        if rng.random() < 0.1:
+            await asyncio.sleep(0)
+
+    while bot.INGEST.qsize() or bot.INGEST.busy:
+        await asyncio.sleep(0.01)
+    elapsed = perf_counter() - started
+    bot.COALESCER.flush_all()
+    await bot.SEND_QUEUE.join()
+    ingest_task.cancel()
+    sender_task.cancel()
+    if pool_task is not None:
+        pool_task.cancel()
+    bot.STATE_STORE.close()
+
+    print(f"Подій: {count}, каналів: {len(channel_ids)}, час: {elapsed:.3f} с, одночасно оброблялося до {max_active} каналів")
+    print(f"Надіслано повідомлень: {len(fake.sent)}")
+
+    problems = []
+    if network is not None:
+        print(
+            f"Сесій: {sessions}, перерозподілів: {bot.SESSIONS.rebalances}, доставлено: "
+            + ", ".join(f"{session_client.name} {session_client.delivered}" for session_client in network.clients)
+        )
+        if network.undelivered:
+            problems.append(f"{network.undelivered} подій не отримала жодна сесія")
+        for session_client in network.clients:
+            listened = {chat for _, builder in session_client.handlers for chat in builder.chats}
+            if not listened <= session_client.joined:
+                problems.append(f"{session_client.name} слухає канали, на які не підписана: {sorted(listened - session_client.joined)}")
+    processed = sum(len(ids) for ids in order.values())
+    if processed != count:
+        problems.append(f"оброблено {processed} подій з {count}")
+    last_seen = bot.client.state.get("last_seen", {})
+    for channel_id, ids in order.items():
+        if ids != sorted(ids):
+            problems.append(f"канал {channel_id}: порушено порядок подій")
+        if last_seen.get(str(channel_id)) != next_id[channel_id] - 1:
+            problems.append(f"канал {channel_id}: last_seen {last_seen.get(str(channel_id))}, очікувалося {next_id[channel_id] - 1}")
+    problems.extend(check_state_reload(bot))
+    return problems
+
+
+def check_state_reload(bot) -> list:
+    """
+    Перевіряє, що після перезапуску зміни на місці вкладених значень стану
+    (last_seen, forwarded) потрапляють у журнал і переживають наступне читання.
+
+    Args:
+        bot: Імпортований модуль bot; його STATE_STORE уже закритий.
+
+    Returns:
+        list: Описи порушень.
+    """
+    paths = (bot.STATE_STORE.snapshot_path, bot.STATE_STORE.journal_path, bot.STATE_STORE.compact_every)
+    store = bot.StateStore(*paths)
+    state = store.load(stack_maxlen=None)
+    last_seen = state.setdefault("last_seen", {})
+    marker = max(last_seen.values(), default=0) + 1000
+    last_seen["state_check"] = marker
+    state.setdefault("forwarded", {})["state_check:1"] = [0, marker, ""]
+    store.save(state)
+    queued = store.queue.qsize()
+    store.close()
+
+    reloaded = bot.StateStore(*paths)
+    state = reloaded.load(stack_maxlen=None)
+    reloaded.close()
+    problems = []
+    if not queued:
+        problems.append("стан після перезапуску: зміни на місці не поставлені в чергу на запис")
+    if state.get("last_seen", {}).get("state_check") != marker:
+        problems.append("стан після перезапуску: зміна last_seen не збереглася")
+    if state.get("forwarded", {}).get("state_check:1") != [0, marker, ""]:
+        problems.append("стан після перезапуску: зміна forwarded не збереглася")
+    return problems
+
+
+def report(latencies: list, elapsed: float, timer: StageTimer) -> None:
+    count = len(latencies)
+    print(f"Подій: {count}, час: {elapsed:.3f} с, {count / elapsed if elapsed else 0:.0f} подій/с")
+    print(f"Затримка handler: p50 {percentile(latencies, 0.5) * 1e3:.3f} мс, p99 {percentile(latencies, 0.99) * 1e3:.3f} мс")
+    for stage, samples in sorted(timer.samples.items()):
+        print(
+            f"  {stage:<14} викликів {len(samples):>6}, сумарно {sum(samples) * 1e3:9.3f} мс, "
+            f"p50 {percentile(samples, 0.5) * 1e6:8.1f} мкс, p99 {percentile(samples, 0.99) * 1e6:8.1f} мкс"
+        )
+
+
+def dump_outputs(sent: list) -> list:
+    return [json.dumps(message, ensure_ascii=False, sort_keys=True) for message in sent]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Офлайн-відтворення подій через handler бота.")
+    parser.add_argument("events", nargs="?", default="", help="jsonl файл із записаними подіями")
+    parser.add_argument("--config-dir", default=path.dirname(path.abspath(__file__)), help="тека з channels/settings/translate.json")
+    parser.add_argument("--state", default="", help="state.json, з якого почати (типово - порожній стан)")
+    parser.add_argument("--golden", default="", help="порівняти надіслані повідомлення з цим jsonl")
+    parser.add_argument("--write-golden", default="", help="записати надіслані повідомлення у jsonl")
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="помилка, якщо p99 затримки більша")
+    parser.add_argument("--stress", type=int, default=0, help="замість файлу подій прогнати стільки випадкових подій через INGEST")
+    parser.add_argument("--workers", type=int, default=8, help="кількість паралельних обробників у режимі --stress")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора подій у режимі --stress")
+    parser.add_argument("--sessions", type=int, default=1, help="кількість сесій Telegram у режимі --stress (одна відключається посеред прогону)")
+    args = parser.parse_args()
+    if not args.events and not args.stress:
+        parser.error("потрібен файл подій або --stress")
+
+    records = read_events(path.abspath(args.events)) if args.events else []
+    state_path = path.abspath(args.state) if args.state else ""
+    golden_path = path.abspath(args.golden) if args.golden else ""
+    write_golden_path = path.abspath(args.write_golden) if args.write_golden else ""
+
+    workdir = prepare_workdir(path.abspath(args.config_dir), state_path)
+    cwd = getcwd()
+    chdir(workdir)
+    sys.path.insert(0, path.dirname(path.abspath(__file__)))
+    # TelegramClient у bot.py вимагає ключі API, хоча під час відтворення не підключається
+    environ.setdefault("API_ID", "0")
+    environ.setdefault("API_HASH", "replay")
+    try:
+        bot = importlib.import_module("bot")
+        errors = ErrorCounter()
+        logging.getLogger().addHandler(errors)
+        if args.stress:
+            problems = asyncio.run(stress(bot, args.stress, args.workers, args.seed, args.sessions))
+        else:
+            timer = StageTimer()
+            sent, latencies, elapsed = asyncio.run(replay(bot, records, timer))
+    finally:
+        chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.stress:
+        for problem in problems:
+            print(f"Порушення: {problem}")
+        if errors.count:
+            print(f"Помилок під час обробки: {errors.count}")
+        return 1 if problems or errors.count else 0
+
+    report(latencies, elapsed, timer)
+    outputs = dump_outputs(sent)
+    print(f"Надіслано повідомлень: {len(outputs)}")
+    exit_code = 0
+
+    if write_golden_path:
+        with open(write_golden_path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in outputs)
+
+    if golden_path:
+        with open(golden_path, "r", encoding="utf-8") as f:
+            expected = [line.rstrip("\n") for line in f if line.strip()]
+        diff = list(difflib.unified_diff(expected, outputs, "golden", "replay", lineterm=""))
+        if diff:
+            print("\n".join(diff))
+            exit_code = 1
+        else:
+            print("Результат збігається з golden.")
+
+    if errors.count:
+        print(f"Помилок під час обробки: {errors.count}")
+        exit_code = 1
+
+    if args.max_p99_ms and percentile(latencies, 0.99) * 1e3 > args.max_p99_ms:
+        print(f"p99 затримки перевищує {args.max_p99_ms} мс.")
+        exit_code = 1
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Маршрутизація повідомлень між кількома областями в одному процесі.
+
+Кожна область (профіль) має власний канал тривог, канал призначення,
+населені пункти і стан: тривога, стек причин, вікно дублікатів, наші
+переслані повідомлення. Повідомлення каналу-джерела обробляється один
+раз (кеш, пошук збігів, цитата), а потім передається всім областям, які
+стежать за цим каналом.
+
+Області описуються в settings.json списком "regions". Якщо список
+порожній, працює одна область з ключів верхнього рівня (target_channel_id,
+alarm_channel_id, region), а її стан лишається на верхньому рівні
+state.json, як і раніше.
+"""
+
+import logging
+from datetime import datetime
+
+from state_store import REGIONS_KEY
+
+
+logger = logging.getLogger(__name__)
+
+# Стан нової області до першого повідомлення з її каналу тривог
+PROFILE_STATE_DEFAULTS = {
+    "is_alarm": False,
+    "alarm_start_time": datetime(2000, 1, 1),
+    "is_show_next_event": False,
+    "message_stack": [],
+    "last_message": "",
+    "last_message_time": datetime(2000, 1, 1),
+}
+
+
+class RegionProfile:
+    """Одна область: куди надсилати, звідки брати тривоги і її власний стан."""
+
+    def __init__(
+        self,
+        name: str,
+        target_channel_id: int,
+        alarm_channel_id: int,
+        region_list: list,
+        channels=None,
+        keywords=None,
+    ):
+        """
+        Args:
+            name (str): Назва області ("" - область за замовчуванням).
+            target_channel_id (int): Канал призначення.
+            alarm_channel_id (int): Канал тривог області.
+            region_list (list): Назви населених пунктів області.
+            channels (iterable): Id каналів-джерел області; None - усі канали.
+            keywords (dict): Id каналу -> ключові слова, що замінюють ключові слова каналу для цієї області.
+        """
+        self.name = name
+        self.target_channel_id = target_channel_id
+        self.alarm_channel_id = alarm_channel_id
+        self.region_list = region_list
+        self.channels = frozenset(channels) if channels is not None else None
+        self.keywords = keywords or {}
+        self.region_owner = name or None  # Власник населених пунктів у спільному матчері
+        # Стан прив'язує Router.bind_state, а решту заповнює bot.py: вони залежать від
+        # стану і спільного матчера, тому створюються вже в циклі подій
+        self.state = None
+        self.dedup = None
+        self.forwarded = None
+
+    def keyword_owner(self, channel_id):
+        """
+        Власник ключових слів каналу в спільному матчері для цієї області.
+
+        Args:
+            channel_id (int): Id каналу-джерела.
+
+        Returns:
+            Id каналу або (назва області, id каналу), якщо область має власні ключові слова.
+        """
+        return (self.name, channel_id) if channel_id in self.keywords else channel_id
+
+    def accepts(self, channel_id: int, pipeline) -> bool:
+        """
+        Перевіряє, чи стежить область за каналом.
+
+        Канал-джерело тривог належить лише тій області, чий це канал тривог.
+
+        Args:
+            channel_id (int): Id каналу-джерела.
+            pipeline (ChannelPipeline): Ланцюжок обробки каналу.
+
+        Returns:
+            bool: True, якщо повідомлення каналу треба передати області.
+        """
+        if pipeline.is_alarm_source:
+            return channel_id == self.alarm_channel_id
+        return self.channels is None or channel_id in self.channels
+
+
+def check_region_config(region) -> None:
+    """
+    Перевіряє структуру області з settings.json.
+
+    Args:
+        region (dict): Опис області.
+
+    Raises:
+        ValueError: Якщо бракує полів або поле має не той тип.
+    """
+    if not isinstance(region, dict):
+        raise ValueError("опис області має бути словником")
+    for key, expected in (("name", str), ("target_channel_id", int), ("alarm_channel_id", int), ("region", list)):
+        if key not in region:
+            raise ValueError(f"бракує поля '{key}'")
+        if not isinstance(region[key], expected) or isinstance(region[key], bool):
+            raise ValueError(f"поле '{key}' має бути {expected.__name__}")
+    if not region["name"]:
+        raise ValueError("назва області не може бути порожньою")
+    if not all(isinstance(locality, str) for locality in region["region"]):
+        raise ValueError("поле 'region' має містити лише рядки")
+    channels = region.get("channels")
+    if channels is not None and (
+        not isinstance(channels, list) or not all(isinstance(c, int) and not isinstance(c, bool) for c in channels)
+    ):
+        raise ValueError("поле 'channels' має бути списком id каналів")
+    keywords = region.get("keywords", {})
+    if not isinstance(keywords, dict) or not all(
+        isinstance(words, list) and all(isinstance(word, str) for word in words) for words in keywords.values()
+    ):
+        raise ValueError("поле 'keywords' має зіставляти id каналу зі списком слів")
+    for channel_id in keywords:
+        try:
+            int(channel_id)
+        except ValueError:
+            raise ValueError(f"'{channel_id}' у 'keywords' не є id каналу") from None
+
+
+def load_profiles(settings: dict) -> list:
+    """
+    Створює області з settings.json.
+
+    Args:
+        settings (dict): Загальні налаштування.
+
+    Returns:
+        list: Області RegionProfile без прив'язаного стану.
+
+    Raises:
+        ValueError: Якщо області в settings.json описані неправильно.
+    """
+    regions = settings.get("regions") or []
+    if not isinstance(regions, list):
+        raise ValueError("'regions' у settings.json має бути списком.")
+    for number, region in enumerate(regions, 1):
+        try:
+            check_region_config(region)
+        except ValueError as e:
+            raise ValueError(f"Область {number} у settings.json: {e}") from e
+    if not regions:
+        return [
+            RegionProfile(
+                "",
+                settings["target_channel_id"],
+                settings["alarm_channel_id"],
+                settings["region"],
+            )
+        ]
+
+    return [
+        RegionProfile(
+            region["name"],
+            region["target_channel_id"],
+            region["alarm_channel_id"],
+            region["region"],
+            region.get("channels"),
+            {int(k): v for k, v in region.get("keywords", {}).items()},
+        )
+        for region in regions
+    ]
+
+
+class Router:
+    """Області, згруповані за каналами-джерелами і каналами призначення."""
+
+    def __init__(self, profiles: list, pipelines: dict):
+        """
+        Args:
+            profiles (list): Області RegionProfile.
+            pipelines (dict): Id каналу -> ChannelPipeline.
+
+        Raises:
+            ValueError: Якщо назви або канали призначення областей повторюються.
+        """
+        names = [profile.name for profile in profiles]
+        if len(set(names)) != len(names):
+            raise ValueError("Назви областей у settings.json повторюються.")
+        self.by_target = {profile.target_channel_id: profile for profile in profiles}
+        if len(self.by_target) != len(profiles):
+            raise ValueError("Кілька областей мають той самий канал призначення.")
+
+        self.profiles = profiles
+        # Маршрути каналів обчислюються один раз, а не на кожну подію
+        self.routes = {
+            channel_id: tuple(profile for profile in profiles if profile.accepts(channel_id, pipeline))
+            for channel_id, pipeline in pipelines.items()
+        }
+        for channel_id, pipeline in pipelines.items():
+            if pipeline.is_alarm_source and not self.routes[channel_id]:
+                logger.warning("Канал тривог '%s' не належить жодній області.", pipeline.name)
+
+    def region_states(self, state: dict) -> dict:
+        """
+        Знаходить стани областей, не змінюючи state.
+
+        Область за замовчуванням використовує верхній рівень стану, решта -
+        state["regions"][назва]; нова область отримує порожній словник,
+        який додає до state лише bind_state.
+
+        Args:
+            state (dict): Стан скрипта (client.state).
+
+        Returns:
+            dict: Назва області -> словник її стану.
+        """
+        regions = state.get(REGIONS_KEY, {})
+        return {
+            profile.name: state if not profile.name else regions.get(profile.name, {})
+            for profile in self.profiles
+        }
+
+    def bind_state(self, state: dict, region_states: dict) -> None:
+        """
+        Прив'язує до областей їхні стани з region_states і додає стани нових
+        областей до state; відсутні ключі заповнюються значеннями за замовчуванням.
+
+        Args:
+            state (dict): Стан скрипта (client.state).
+            region_states (dict): Результат region_states.
+
+        Returns:
+            None.
+        """
+        for profile in self.profiles:
+            region_state = region_states[profile.name]
+            if profile.name:
+                state.setdefault(REGIONS_KEY, {})[profile.name] = region_state
+                for key, value in PROFILE_STATE_DEFAULTS.items():
+                    region_state.setdefault(key, list(value) if isinstance(value, list) else value)
+            profile.state = region_state
+
+    def __iter__(self):
+        return iter(self.profiles)
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def profiles_for(self, channel_id: int) -> tuple:
+        """
+        Args:
+            channel_id (int): Id каналу-джерела.
+
+        Returns:
+            tuple: Області, яким треба передати повідомлення каналу.
+        """
+        return self.routes.get(channel_id, ())
+
+    def region_lists(self) -> dict:
+        """Населені пункти всіх областей для спільного матчера: власник -> список."""
+        return {profile.region_owner: profile.region_list for profile in self.profiles}
+
+    def keyword_overrides(self) -> dict:
+        """Власні ключові слова областей для спільного матчера: власник -> список."""
+        return {
+            profile.keyword_owner(channel_id): keywords
+            for profile in self.profiles
+            for channel_id, keywords in profile.keywords.items()
+        }
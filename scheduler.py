@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import Counter, deque
+from time import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# Пріоритети подій і вихідних повідомлень: менше число - вищий пріоритет
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+
+
+class _Item:
+    __slots__ = ("enqueued_at", "channel_id", "event", "sheddable", "alive", "process")
+
+    def __init__(self, channel_id, event, sheddable: bool, process=None):
+        self.enqueued_at = monotonic()
+        self.channel_id = channel_id
+        self.event = event
+        self.sheddable = sheddable
+        self.alive = True
+        self.process = process
+
+
+class IngestScheduler:
+    """
+    Планувальник вхідних подій з пріоритетами і скиданням навантаження.
+
+    Події каналів-джерел тривоги завжди обробляються першими. Коли черга
+    довша за max_depth або найстаріша подія чекає довше за max_age секунд,
+    нова подія низькопріоритетного каналу замінює ще не оброблену подію
+    того самого каналу (coalesce), а прострочені події відкидаються (drop).
+    Кожне скинуте повідомлення рахується у shed.
+
+    Події одного каналу обробляються строго по черзі і в порядку надходження,
+    а події різних каналів - паралельно, не більше max_workers одночасно.
+    """
+
+    def __init__(self, process, max_depth: int, max_age: float, max_workers=1):
+        """
+        Args:
+            process (callable): Корутина, що обробляє одну подію.
+            max_depth (int): Довжина черги, після якої вмикається скидання навантаження.
+            max_age (float): Максимальний час очікування події в черзі, секунди.
+            max_workers (int): Скільки каналів можна обробляти одночасно.
+        """
+        self.process = process
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.busy = set()  # Канали, подія яких зараз обробляється
+        self.high = deque()
+        self.low = deque()
+        self.pending = {}  # id каналу -> остання ще не оброблена низькопріоритетна подія
+        self.size = 0
+        self.shed = Counter()  # ("coalesced" | "dropped", id каналу) -> кількість
+        self.ready = asyncio.Event()
+
+    def qsize(self) -> int:
+        return self.size
+
+    def is_overloaded(self) -> bool:
+        if self.size > self.max_depth:
+            return True
+        oldest = next((item for item in self.low if item.alive), None)
+        return oldest is not None and monotonic() - oldest.enqueued_at > self.max_age
+
+    def put(self, channel_id, event, priority: int, sheddable: bool, process=None) -> None:
+        """
+        Ставить подію в чергу на обробку.
+
+        Args:
+            channel_id (int): Id каналу-джерела.
+            event: Подія Telethon.
+            priority (int): HIGH_PRIORITY або NORMAL_PRIORITY.
+            sheddable (bool): Чи можна скинути подію при перевантаженні.
+            process (callable): Корутина для цієї події замість типової (наприклад, для редагувань).
+
+        Returns:
+            None.
+        """
+        item = _Item(channel_id, event, sheddable, process)
+
+        if priority == HIGH_PRIORITY:
+            self.high.append(item)
+        else:
+            previous = self.pending.get(channel_id)
+            # Замінюється лише подія, яку саму можна скинути: редагування не губляться
+            if sheddable and previous is not None and previous.alive and previous.sheddable and self.is_overloaded():
+                previous.alive = False
+                self.size -= 1
+                self.shed["coalesced", channel_id] += 1
+                logger.warning("Перевантаження: подію з каналу %s замінено новішою.", channel_id)
+            self.low.append(item)
+            self.pending[channel_id] = item
+
+        self.size += 1
+        self.ready.set()
+
+    def _take(self, queue: deque):
+        # Перша жива подія каналу, який зараз не обробляється; пізніші події
+        # зайнятого каналу лишаються за його ранішими, тож порядок зберігається
+        index = 0
+        while index < len(queue):
+            item = queue[index]
+            if not item.alive:
+                del queue[index]
+                continue
+            if item.channel_id not in self.busy:
+                del queue[index]
+                return item
+            index += 1
+        return None
+
+    def _next(self):
+        item = self._take(self.high)
+        if item is not None:
+            return item
+
+        while True:
+            item = self._take(self.low)
+            if item is None:
+                return None
+            if self.pending.get(item.channel_id) is item:
+                del self.pending[item.channel_id]
+            if item.sheddable and monotonic() - item.enqueued_at > self.max_age:
+                self.size -= 1
+                self.shed["dropped", item.channel_id] += 1
+                logger.warning("Перевантаження: застарілу подію з каналу %s відкинуто.", item.channel_id)
+                continue
+            return item
+
+    async def _work(self, item: _Item) -> None:
+        try:
+            await (item.process or self.process)(item.event)
+        finally:
+            self.busy.discard(item.channel_id)
+            self.ready.set()
+
+    async def run(self) -> None:
+        """
+        Корутина-диспетчер. Роздає події обробникам у порядку пріоритету, доки її не скасують.
+
+        Returns:
+            None.
+        """
+        workers = set()
+        try:
+            while True:
+                item = self._next() if len(self.busy) < self.max_workers else None
+                if item is None:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+
+                self.size -= 1
+                self.busy.add(item.channel_id)
+                worker = asyncio.create_task(self._work(item))
+                workers.add(worker)
+                worker.add_done_callback(workers.discard)
+        finally:
+            for worker in workers:
+                worker.cancel()
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import json
+import logging
+from datetime import datetime
+from itertools import count
+from time import monotonic
+from telethon.errors import BadRequestError, FloodWaitError, ForbiddenError, MessageNotModifiedError, NotFoundError
+from scheduler import NORMAL_PRIORITY
+
+
+logger = logging.getLogger(__name__)
+
+# Помилки, які не зникнуть після повтору: задовгий текст, немає прав на канал тощо
+PERMANENT_ERRORS = (BadRequestError, ForbiddenError, NotFoundError)
+
+
+class TokenBucket:
+    """Обмежувач частоти: не більше rate повідомлень за секунду з запасом capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Скільки секунд лишилося до наступного токена (0 - можна надсилати одразу).
+        """
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        """Забирає один токен."""
+        self._refill()
+        self.tokens -= 1
+
+
+class SendQueue:
+    """
+    Черга вихідних повідомлень з окремою корутиною-відправником.
+
+    Обробник подій лише кладе повідомлення в чергу, а відправник надсилає їх
+    (спершу з вищим пріоритетом) з обмеженням частоти для кожного чату
+    призначення. У кожного чату своя черга: якщо чат чекає на токен, на
+    FloodWait або на повтор після помилки, відправник тим часом надсилає
+    повідомлення в інші чати. Порядок повідомлень одного чату з однаковим
+    пріоритетом зберігається.
+
+    Тимчасові помилки повторюються з експоненційною паузою; після
+    max_retries невдалих спроб, або одразу для помилок, які повтор не
+    виправить (PERMANENT_ERRORS), повідомлення дописується у dead letter файл.
+    """
+
+    def __init__(self, send, rate_per_minute: int, burst: int, max_retries: int, dead_letter_path: str, dropped=None):
+        """
+        Args:
+            send (callable): Корутина, що надсилає один словник повідомлення.
+            rate_per_minute (int): Максимум повідомлень на хвилину в один чат.
+            burst (int): Скільки повідомлень можна надіслати підряд без очікування.
+            max_retries (int): Кількість повторних спроб після помилки.
+            dead_letter_path (str): Файл jsonl для повідомлень, які не вдалося надіслати.
+            dropped (callable): Функція, що викликається з кожним повідомленням, записаним у dead letter файл.
+        """
+        self.send = send
+        self.dropped = dropped
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.sequence = count()  # Зберігає порядок повідомлень з однаковим пріоритетом
+        self.queues = {}  # id чату -> купа (пріоритет, номер, повідомлення)
+        self.buckets = {}
+        self.blocked_until = {}  # id чату -> monotonic(), до якого чат чекає (FloodWait, повтор)
+        self.attempts = {}  # номер повідомлення -> кількість невдалих спроб
+        self.size = 0  # Повідомлень у черзі, разом з тим, що надсилається
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def put(self, message: dict) -> None:
+        """
+        Додає повідомлення в чергу, не чекаючи на надсилання.
+
+        Args:
+            message (dict): Словник з даними повідомлення, необов'язковий ключ "priority".
+
+        Returns:
+            None.
+        """
+        item = (message.get("priority", NORMAL_PRIORITY), next(self.sequence), message)
+        heapq.heappush(self.queues.setdefault(message.get("target_channel_id"), []), item)
+        self.size += 1
+        self.idle.clear()
+        self.wakeup.set()
+
+    def qsize(self) -> int:
+        return self.size
+
+    async def join(self) -> None:
+        """Чекає, доки всі повідомлення не будуть надіслані або відкинуті."""
+        await self.idle.wait()
+
+    def _bucket(self, target_channel_id) -> TokenBucket:
+        bucket = self.buckets.get(target_channel_id)
+        if bucket is None:
+            bucket = self.buckets[target_channel_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _next(self):
+        """
+        Returns:
+            tuple: (id чату, елемент черги) найпріоритетнішого повідомлення серед
+                чатів, готових до надсилання, і None; або (None, None) і кількість
+                секунд до готовності найближчого чату (None, якщо черга порожня).
+        """
+        now = monotonic()
+        ready = None
+        earliest = None
+        for target_channel_id, queue in self.queues.items():
+            wait = max(self.blocked_until.get(target_channel_id, 0) - now, self._bucket(target_channel_id).wait_time())
+            if wait > 0:
+                earliest = wait if earliest is None else min(earliest, wait)
+            elif ready is None or queue[0] < self.queues[ready][0]:
+                ready = target_channel_id
+        if ready is None:
+            return None, None, earliest
+
+        queue = self.queues[ready]
+        item = heapq.heappop(queue)
+        if not queue:
+            del self.queues[ready]
+        return ready, item, None
+
+    async def run(self) -> None:
+        """
+        Корутина-відправник. Працює, доки її не скасують.
+
+        Returns:
+            None.
+        """
+        while True:
+            target_channel_id, item, delay = self._next()
+            if item is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(target_channel_id, item)
+            except asyncio.CancelledError:
+                # Перерване зупинкою надсилання лишається в черзі для dead_letter_pending()
+                heapq.heappush(self.queues.setdefault(target_channel_id, []), item)
+                raise
+
+    def _done(self, sequence: int) -> None:
+        self.attempts.pop(sequence, None)
+        self.size -= 1
+        if not self.size:
+            self.idle.set()
+
+    async def _deliver(self, target_channel_id, item: tuple) -> None:
+        _, sequence, message = item
+        self._bucket(target_channel_id).take()
+        try:
+            await self.send(message)
+            self._done(sequence)
+            return
+        except MessageNotModifiedError:
+            logger.debug("Редагування %s не змінило текст.", message.get("edit_id"))
+            self._done(sequence)
+            return
+        except FloodWaitError as e:
+            error = e
+            wait = e.seconds
+            logger.warning("FloodWait для %s: чекаємо %s с.", target_channel_id, wait)
+        except PERMANENT_ERRORS as e:
+            logger.error("Помилка надсилання, яку повтор не виправить: %s", e)
+            await asyncio.to_thread(self._dead_letter, message, e, self.attempts.get(sequence, 0) + 1)
+            self._drop(sequence, message)
+            return
+        except Exception as e:
+            error = e
+            wait = 2 ** self.attempts.get(sequence, 0)
+            logger.error("Помилка надсилання: %s", e)
+
+        attempts = self.attempts[sequence] = self.attempts.get(sequence, 0) + 1
+        if attempts > self.max_retries:
+            await asyncio.to_thread(self._dead_letter, message, error, attempts)
+            self._drop(sequence, message)
+            return
+        # Повтор - з тим самим номером, тож повідомлення лишається попереду пізніших у своєму чаті
+        heapq.heappush(self.queues.setdefault(target_channel_id, []), item)
+        self.blocked_until[target_channel_id] = monotonic() + wait
+
+    def dead_letter_pending(self) -> int:
+        """
+        Дописує у dead letter файл повідомлення, що лишилися в черзі після
+        зупинки відправника, щоб вони не загубилися при виході.
+
+        Returns:
+            int: Кількість записаних повідомлень.
+        """
+        items = sorted(item for queue in self.queues.values() for item in queue)
+        self.queues.clear()
+        for _, sequence, message in items:
+            self._dead_letter(message, RuntimeError("бот зупинено до надсилання"), self.attempts.get(sequence, 0))
+            self._drop(sequence, message)
+        return len(items)
+
+    def _drop(self, sequence: int, message: dict) -> None:
+        # Викликається в циклі подій, а не в потоці _dead_letter
+        self._done(sequence)
+        if self.dropped is not None:
+            self.dropped(message)
+
+    def _dead_letter(self, message: dict, error: Exception, attempts: int) -> None:
+        record = {
+            "time": datetime.now().isoformat(),
+            "error": repr(error),
+            "target_channel_id": message.get("target_channel_id"),
+            "message_text": message.get("message_text"),
+            "file": repr(message["file"]) if message.get("file") else None,
+            "silent": message.get("silent", False),
+        }
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        logger.error("Повідомлення не надіслане після %s спроб, збережене у %s.", attempts, self.dead_letter_path)
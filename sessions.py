@@ -0,0 +1,245 @@
+"""
+Розподіл каналів-джерел між кількома сесіями Telegram.
+
+Кожна сесія слухає лише свою частку каналів, а всі події потрапляють в
+одну чергу INGEST основного процесу, яка володіє станом тривоги,
+дублікатами і надсиланням. Власник каналу визначається рандеву-хешуванням
+(найбільша вага hash(сесія, канал) серед підключених сесій, акаунт яких
+підписаний на канал), тож коли сесія відключається, переходять лише її
+канали, а після перепідключення вони повертаються назад.
+
+Підписки кожної сесії читаються з її діалогів при підключенні: канал
+переходить лише до сесії, чий акаунт на нього підписаний, тож акаунтам не
+треба бути підписаними на всі канали. Канал, на який не підписана жодна
+підключена сесія, ніхто не слухає, доки така сесія не з'явиться.
+"""
+
+import asyncio
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def owner_weight(session_name: str, channel_id: int) -> int:
+    """
+    Вага пари сесія-канал для рандеву-хешування; однакова між перезапусками.
+
+    Args:
+        session_name (str): Назва сесії.
+        channel_id (int): Id каналу.
+
+    Returns:
+        int: Вага.
+    """
+    digest = hashlib.blake2b(f"{session_name}:{channel_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Session:
+    """Сесія Telegram і канали, які вона зараз слухає."""
+
+    __slots__ = ("name", "client", "channels", "connected", "joined")
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.channels = set()
+        self.connected = False
+        self.joined = None  # Id каналів, на які підписаний акаунт; None - ще невідомо
+
+    def is_member(self, channel_id: int) -> bool:
+        return self.joined is None or channel_id in self.joined
+
+
+class SessionPool:
+    """
+    Кілька сесій Telegram, між якими розподілені канали-джерела.
+
+    Обробники подій реєструються на кожній сесії лише для її каналів.
+    Перша сесія - основна: вона ж надсилає повідомлення, тому її
+    підключення контролює main().
+    """
+
+    def __init__(self, clients: dict, handlers, reconnect_delay=5.0, max_reconnect_delay=300.0):
+        """
+        Args:
+            clients (dict): Назва сесії -> клієнт Telethon; перша - основна.
+            handlers (iterable): Пари (обробник, клас події), наприклад (on_new_message, events.NewMessage).
+            reconnect_delay (float): Перша пауза перед перепідключенням, секунди.
+            max_reconnect_delay (float): Найбільша пауза між спробами перепідключення.
+        """
+        self.sessions = [Session(name, client) for name, client in clients.items()]
+        self.handlers = tuple(handlers)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.channels = []  # Усі канали-джерела
+        self.unassigned = []  # Канали, на які не підписана жодна підключена сесія
+        self.rebalances = 0
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def set_channels(self, channels) -> None:
+        """
+        Задає список каналів-джерел і перерозподіляє їх між сесіями.
+
+        Args:
+            channels (iterable): Id каналів-джерел.
+
+        Returns:
+            None.
+        """
+        self.channels = list(channels)
+        self.rebalance()
+
+    def rebalance(self) -> None:
+        """
+        Призначає кожен канал підключеній сесії-учаснику з найбільшою вагою і
+        перереєстровує обробники сесій, чий набір каналів змінився.
+
+        Returns:
+            None.
+        """
+        live = [session for session in self.sessions if session.connected]
+        if not live:
+            logger.error("Немає жодної підключеної сесії - канали не слухає ніхто.")
+            return
+
+        assignment = {session.name: set() for session in live}
+        unassigned = []
+        for channel_id in self.channels:
+            members = [session for session in live if session.is_member(channel_id)]
+            if not members:
+                unassigned.append(channel_id)
+                continue
+            owner = max(members, key=lambda session: owner_weight(session.name, channel_id))
+            assignment[owner.name].add(channel_id)
+        if unassigned != self.unassigned and unassigned:
+            logger.error("Жодна підключена сесія не підписана на канали: %s", ", ".join(map(str, unassigned)))
+        self.unassigned = unassigned
+
+        changed = False
+        for session in self.sessions:
+            channels = assignment.get(session.name, set())
+            if channels != session.channels:
+                session.channels = channels
+                self._subscribe(session)
+                changed = True
+        if changed:
+            self.rebalances += 1
+            logger.info(
+                "Канали розподілено між сесіями: %s",
+                ", ".join(f"{session.name}: {len(session.channels)}" for session in self.sessions),
+            )
+
+    def _subscribe(self, session: Session) -> None:
+        for callback, event_class in self.handlers:
+            session.client.remove_event_handler(callback)
+            if session.channels:
+                session.client.add_event_handler(callback, event_class(chats=sorted(session.channels)))
+
+    def client_for(self, channel_id: int):
+        """
+        Args:
+            channel_id (int): Id каналу-джерела.
+
+        Returns:
+            Клієнт сесії, що слухає канал (або основний, якщо канал нікому не призначений).
+        """
+        for session in self.sessions:
+            if channel_id in session.channels:
+                return session.client
+        return self.sessions[0].client
+
+    def counts(self) -> dict:
+        return {session.name: len(session.channels) for session in self.sessions}
+
+    async def refresh_membership(self, session: Session) -> None:
+        """
+        Читає з діалогів сесії, на які канали підписаний її акаунт.
+
+        Якщо діалоги прочитати не вдалося, лишаються попередні підписки.
+
+        Args:
+            session (Session): Підключена сесія.
+
+        Returns:
+            None.
+        """
+        try:
+            session.joined = {dialog.id async for dialog in session.client.iter_dialogs()}
+        except Exception as e:
+            logger.warning("Не вдалося прочитати підписки сесії %s: %s", session.name, e)
+
+    async def start(self) -> None:
+        """
+        Підключає додаткові сесії (основна вже підключена), читає їхні підписки
+        і розподіляє канали.
+
+        Обробники всіх сесій, зокрема основної, реєструються лише тут і в
+        rebalance, тож сесія ніколи не слухає канал, який їй не призначено.
+        Сесія, яку не вдалося підключити, пробує знову у run().
+
+        Returns:
+            None.
+        """
+        self.sessions[0].connected = True
+        for session in self.sessions[1:]:
+            try:
+                await session.client.start()
+                session.connected = True
+            except Exception as e:
+                logger.error("Не вдалося підключити сесію %s: %s", session.name, e)
+        for session in self.sessions:
+            self._subscribe(session)
+            if session.connected:
+                await self.refresh_membership(session)
+        self.rebalance()
+
+    async def run(self) -> None:
+        """
+        Стежить за підключенням сесій, доки корутину не скасують.
+
+        Returns:
+            None.
+        """
+        await asyncio.gather(*(self._supervise(session) for session in self.sessions[1:]))
+
+    async def _supervise(self, session: Session) -> None:
+        delay = self.reconnect_delay
+        while True:
+            if session.connected:
+                await session.client.run_until_disconnected()
+                session.connected = False
+                logger.warning("Сесія %s відключилася, її канали переходять до інших сесій.", session.name)
+                self.rebalance()
+                delay = self.reconnect_delay
+
+            await asyncio.sleep(delay)
+            try:
+                await session.client.connect()
+                session.connected = session.client.is_connected()
+            except Exception as e:
+                logger.warning("Сесія %s не перепідключилася: %s", session.name, e)
+            if session.connected:
+                logger.info("Сесія %s знову підключена.", session.name)
+                await self.refresh_membership(session)
+                self.rebalance()
+            else:
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def close(self) -> None:
+        """
+        Відключає додаткові сесії; основну відключає main().
+
+        Returns:
+            None.
+        """
+        for session in self.sessions[1:]:
+            session.connected = False
+            try:
+                await session.client.disconnect()
+            except Exception as e:
+                logger.warning("Помилка відключення сесії %s: %s", session.name, e)
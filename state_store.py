@@ -0,0 +1,199 @@
+import copy
+import json
+import logging
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from os import fsync, path, replace
+
+
+logger = logging.getLogger(__name__)
+
+DATETIME_KEYS = ("alarm_start_time", "last_message_time")
+REGIONS_KEY = "regions"  # Стани областей, крім області за замовчуванням (вона - на верхньому рівні)
+
+
+def encode_value(key: str, value):
+    """
+    Перетворює значення стану на придатне для json.
+
+    Args:
+        key (str): Ключ стану.
+        value: Значення стану.
+
+    Returns:
+        Значення, яке можна записати в json.
+    """
+    if key == "message_stack":
+        return [
+            [time.isoformat() if hasattr(time, "isoformat") else time, *rest]
+            for time, *rest in value
+        ]
+    if key == REGIONS_KEY:
+        return {
+            name: {region_key: encode_value(region_key, region_value) for region_key, region_value in region.items()}
+            for name, region in value.items()
+        }
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return dict(value)  # Копія, інакше зміни на місці не відрізнити від збереженого
+    return value
+
+
+def decode_state(raw: dict, stack_maxlen: int) -> dict:
+    """
+    Відновлює типи змінних стану після читання з json.
+
+    Args:
+        raw (dict): Стан у вигляді, прочитаному з json.
+        stack_maxlen (int): Максимальна довжина стеку повідомлень.
+
+    Returns:
+        dict: Стан з datetime, deque та int на своїх місцях.
+    """
+    # Глибока копія: вкладені словники (last_seen, forwarded) змінюються на місці, і
+    # спільні з raw об'єкти зробили б ці зміни невидимими для StateStore.save()
+    state = copy.deepcopy(raw)
+    for key in DATETIME_KEYS:
+        if isinstance(state.get(key), str):
+            state[key] = datetime.fromisoformat(state[key])
+
+    stack = []
+    for message in state.get("message_stack", []):
+        message = list(message)
+        if isinstance(message[0], str):
+            message[0] = datetime.fromisoformat(message[0])
+        stack.append(message)
+    state["message_stack"] = deque(stack, maxlen=stack_maxlen)
+
+    if isinstance(state.get("message_count"), str):
+        state["message_count"] = int(state["message_count"])
+
+    if REGIONS_KEY in state:
+        state[REGIONS_KEY] = {name: decode_state(region, stack_maxlen) for name, region in state[REGIONS_KEY].items()}
+
+    return state
+
+
+class StateStore:
+    """
+    Збереження стану у вигляді знімка (state.json) і журналу змін.
+
+    save() лише порівнює стан з останнім збереженим і ставить у чергу
+    змінені ключі; запис на диск робить окремий потік. Журнал періодично
+    стискається в новий знімок через тимчасовий файл і rename, тому збій
+    посеред запису не псує state.json. При старті знімок доповнюється
+    записами журналу.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int):
+        """
+        Args:
+            snapshot_path (str): Шлях до знімка стану.
+            journal_path (str): Шлях до журналу змін.
+            compact_every (int): Після скількох записів журналу робити новий знімок.
+        """
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.persisted = {}  # Останні збережені (закодовані) значення по ключах
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def load(self, stack_maxlen: int) -> dict:
+        """
+        Читає знімок і відтворює поверх нього журнал змін.
+
+        Args:
+            stack_maxlen (int): Максимальна довжина стеку повідомлень.
+
+        Returns:
+            dict: Відновлений стан.
+        """
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+
+        replayed = 0
+        if path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        raw.update(json.loads(line))
+                        replayed += 1
+                    except json.JSONDecodeError:
+                        logger.warning("Пропущено пошкоджений запис журналу стану.")
+        if replayed:
+            logger.info("Відтворено %s записів журналу стану.", replayed)
+
+        self.persisted = copy.deepcopy(raw)
+        self.thread = threading.Thread(target=self._writer, args=(copy.deepcopy(raw), replayed), daemon=True)
+        self.thread.start()
+        return decode_state(raw, stack_maxlen)
+
+    def save(self, state: dict) -> None:
+        """
+        Ставить у чергу на запис ключі стану, що змінилися з минулого збереження.
+
+        Args:
+            state (dict): Поточний стан скрипта.
+
+        Returns:
+            None.
+        """
+        delta = {}
+        for key, value in state.items():
+            encoded = encode_value(key, value)
+            if self.persisted.get(key, delta) != encoded:
+                delta[key] = encoded
+                self.persisted[key] = encoded
+
+        if delta:
+            self.queue.put(delta)
+
+    def close(self) -> None:
+        """
+        Дописує чергу, робить фінальний знімок і зупиняє потік запису.
+
+        Returns:
+            None.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _writer(self, snapshot: dict, journal_length: int) -> None:
+        journal = open(self.journal_path, "a", encoding="utf-8")
+        while True:
+            delta = self.queue.get()
+            try:
+                if delta is None:
+                    self._compact(snapshot, journal).close()
+                    return
+
+                snapshot.update(delta)
+                journal.write(json.dumps(delta, ensure_ascii=False, separators=(",", ":")) + "\n")
+                journal.flush()
+                journal_length += 1
+
+                if journal_length >= self.compact_every:
+                    journal = self._compact(snapshot, journal)
+                    journal_length = 0
+            except Exception as e:
+                logger.error("Помилка запису стану: %s", e)
+                if delta is None:
+                    return
+
+    def _compact(self, snapshot: dict, journal):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=4)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp_path, self.snapshot_path)
+
+        # Журнал очищається лише після того, як знімок гарантовано на диску
+        journal.close()
+        return open(self.journal_path, "w", encoding="utf-8")
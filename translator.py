@@ -0,0 +1,191 @@
+import json
+import re
+from bisect import bisect_left, bisect_right
+from os import path, replace
+
+
+# Позиції меж слів - ті самі \b, що й у попередньому регулярному виразі з альтернативами
+WORD_BOUNDARY_RE = re.compile(r"\b")
+
+CACHE_FORMAT_VERSION = 1
+CACHE_ITEM_SEPARATOR = "\x00"
+CACHE_BLOCK_SEPARATOR = "\x01"
+
+
+class TranslationEngine:
+    """
+    Словниковий перекладач, який будує матчер один раз.
+
+    Ключ замінюється, якщо він стоїть між двома межами слова (\\b), тобто
+    як і в re.sub(r"\\b(k1|k2|...)\\b", ...). Кандидатами є лише позиції меж
+    слів у тексті, тому вартість перекладу залежить від довжини повідомлення,
+    а не від розміру словника. Із кількох ключів, що починаються в одній
+    позиції, обирається найдовший ("в верх" перемагає "в").
+    """
+
+    __slots__ = ("mapping", "max_key_length")
+
+    def __init__(self, mapping: dict):
+        self.mapping = {key: value for key, value in mapping.items() if key}
+        self.max_key_length = max(map(len, self.mapping), default=0)
+
+    def __bool__(self) -> bool:
+        return bool(self.mapping)
+
+    def __len__(self) -> int:
+        return len(self.mapping)
+
+    def __call__(self, text: str) -> str:
+        return self.translate(text)
+
+    def translate(self, text: str) -> str:
+        """
+        Перекладає повідомлення на українську, використовуючи словник.
+
+        Args:
+            text (str): Вхідний текст для обробки.
+
+        Returns:
+            str: Перекладений текст.
+        """
+        text = text.lower()
+        if not self.mapping or not text:
+            return text.capitalize()
+
+        mapping = self.mapping
+        max_key_length = self.max_key_length
+        boundaries = [m.start() for m in WORD_BOUNDARY_RE.finditer(text)]
+        result = []
+        position = 0  # Кінець останньої заміни у тексті
+
+        i = 0
+        count = len(boundaries)
+        while i < count:
+            start = boundaries[i]
+            # Найдовший ключ першим: перебираємо межі слів справа наліво
+            last = bisect_right(boundaries, start + max_key_length, i + 1) - 1
+            for j in range(last, i, -1):
+                end = boundaries[j]
+                value = mapping.get(text[start:end])
+                if value is not None:
+                    result.append(text[position:start])
+                    result.append(value)
+                    position = end
+                    i = bisect_left(boundaries, end, j)
+                    break
+            else:
+                i += 1
+
+        if not result:
+            return text.capitalize()
+
+        result.append(text[position:])
+        return "".join(result).capitalize()
+
+    @classmethod
+    def from_json(cls, json_path: str, cache_path: str = ""):
+        """
+        Завантажує словник з json, за потреби через попередньо скомпільований кеш на диску.
+
+        Кеш вважається дійсним, поки розмір і час зміни json не змінились.
+        Ключі і значення в ньому зберігаються двома суцільними рядками, тому
+        завантаження - це одне декодування і split без розбору json.
+
+        Args:
+            json_path (str): Шлях до translate.json.
+            cache_path (str): Шлях до файлу кешу. Порожній рядок вимикає кеш.
+
+        Returns:
+            TranslationEngine: Готовий перекладач.
+        """
+        if not cache_path:
+            with open(json_path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+
+        source_stat = [path.getmtime(json_path), path.getsize(json_path)]
+        try:
+            engine = cls.load(cache_path, source_stat)
+            if engine is not None:
+                return engine
+        except (OSError, KeyError, ValueError):
+            pass  # Кеш відсутній або пошкоджений - перебудовуємо з json
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            engine = cls(json.load(f))
+        try:
+            engine.save(cache_path, source_stat)
+        except OSError:
+            pass  # Кеш - лише прискорення, без нього перекладач працює так само
+        return engine
+
+    @classmethod
+    def load(cls, cache_path: str, source_stat=None):
+        """
+        Завантажує перекладач з файлу кешу.
+
+        Args:
+            cache_path (str): Шлях до файлу кешу.
+            source_stat (list): Очікувані час зміни і розмір json. None - не перевіряти.
+
+        Returns:
+            TranslationEngine | None: Перекладач, або None, якщо кеш застарів.
+        """
+        with open(cache_path, "rb") as f:
+            header = json.loads(f.readline())
+            if header["version"] != CACHE_FORMAT_VERSION:
+                return None
+            if source_stat is not None and header["source_stat"] != list(source_stat):
+                return None
+            keys, values = f.read().decode("utf-8").split(CACHE_BLOCK_SEPARATOR)
+
+        engine = cls.__new__(cls)
+        engine.mapping = dict(zip(keys.split(CACHE_ITEM_SEPARATOR), values.split(CACHE_ITEM_SEPARATOR)))
+        engine.max_key_length = header["max_key_length"]
+        if len(engine.mapping) != header["count"]:
+            raise ValueError("Пошкоджений кеш словника перекладу.")
+        return engine
+
+    def save(self, cache_path: str, source_stat=(0, 0)) -> None:
+        """
+        Зберігає словник у компактному вигляді (атомарно, через тимчасовий файл).
+
+        Args:
+            cache_path (str): Шлях до файлу кешу.
+            source_stat (list): Час зміни і розмір json, з якого зібрано словник.
+
+        Returns:
+            None.
+        """
+        header = {
+            "version": CACHE_FORMAT_VERSION,
+            "source_stat": list(source_stat),
+            "count": len(self.mapping),
+            "max_key_length": self.max_key_length,
+        }
+        body = (
+            CACHE_ITEM_SEPARATOR.join(self.mapping)
+            + CACHE_BLOCK_SEPARATOR
+            + CACHE_ITEM_SEPARATOR.join(self.mapping.values())
+        )
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(body.encode("utf-8"))
+        replace(tmp_path, cache_path)
+
+
+def translate_text(text: str, translate_dict) -> str:
+    """
+    Перекладає повідомлення на українську, використовуючи словник.
+
+    Args:
+        text (str): Вхідний текст для обробки.
+        translate_dict (dict | TranslationEngine): Словник з парами слів або готовий перекладач.
+
+    Returns:
+        str: Перекладений текст.
+    """
+    if not isinstance(translate_dict, TranslationEngine):
+        translate_dict = TranslationEngine(translate_dict)
+
+    return translate_dict.translate(text)